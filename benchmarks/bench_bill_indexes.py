@@ -0,0 +1,125 @@
+""" Measure billing queries with and without Bill indexes
+
+Seed a database with many bills, then time the admin list view, its
+isPaid filter and search, a coworker history and period reports. Each
+query runs once without the indexes of Bill.Meta.indexes and once with
+them::
+
+    python benchmarks/bench_bill_indexes.py --bills 1000000
+"""
+import argparse
+import datetime
+import random
+
+from common import measure, setup_django
+
+
+def seed(users_count, bills_count):
+    from django.contrib.auth.models import User
+    from billjobs.models import Bill, UserProfile
+
+    if Bill.objects.count() >= bills_count:
+        return
+    Bill.objects.all().delete()
+    UserProfile.objects.all().delete()
+    User.objects.all().delete()
+    admin = User.objects.create_superuser('admin', 'admin@billjobs.org', 'x')
+    UserProfile.objects.create(user=admin, billing_address='Admin')
+    User.objects.bulk_create(
+            User(username='coworker%d' % i, first_name='First%d' % i,
+                 last_name='Last%d' % i)
+            for i in range(users_count))
+    user_ids = list(User.objects.values_list('pk', flat=True))
+
+    random.seed(0)
+    # billing_date is auto_now_add, keep the random dates of seeded bills
+    Bill._meta.get_field('billing_date').auto_now_add = False
+    start = datetime.date.today() - datetime.timedelta(days=5 * 365)
+    batch = []
+    for i in range(bills_count):
+        batch.append(Bill(
+            user_id=random.choice(user_ids),
+            number='S%010d' % i,
+            isPaid=random.random() < 0.9,
+            billing_date=start + datetime.timedelta(
+                days=random.randrange(5 * 365)),
+            amount=random.randrange(10, 500),
+            issuer_address='Issuer',
+            billing_address='Address'))
+        if len(batch) == 10000:
+            Bill.objects.bulk_create(batch)
+            batch = []
+    Bill.objects.bulk_create(batch)
+    Bill._meta.get_field('billing_date').auto_now_add = True
+
+
+def queries():
+    from django.contrib.auth.models import User
+    from django.db.models import Sum
+    from django.test import Client
+    from billjobs.models import Bill
+
+    client = Client()
+    client.force_login(User.objects.get(username='admin'))
+    user_id = User.objects.filter(username='coworker1').values_list(
+            'pk', flat=True).get()
+    today = datetime.date.today()
+    month = today.replace(day=1) - datetime.timedelta(days=365)
+    next_month = (month + datetime.timedelta(days=31)).replace(day=1)
+
+    return [
+        ('changelist', lambda: client.get('/admin/billjobs/bill/')),
+        ('changelist unpaid filter',
+         lambda: client.get('/admin/billjobs/bill/?isPaid__exact=0')),
+        ('changelist search',
+         lambda: client.get('/admin/billjobs/bill/?q=Last1')),
+        ('coworker history', lambda: list(
+            Bill.objects.filter(user_id=user_id)
+            .order_by('-billing_date')[:50])),
+        ('month revenue', lambda: Bill.objects.filter(
+            billing_date__gte=month, billing_date__lt=next_month)
+            .aggregate(Sum('amount'))),
+        ('unpaid older than 30 days', lambda: Bill.objects.filter(
+            isPaid=False,
+            billing_date__lt=today - datetime.timedelta(days=30)).count()),
+        ]
+
+
+def run(repeat):
+    from django.db import connection
+    from billjobs.models import Bill
+
+    results = {}
+    for state in ('without', 'with'):
+        with connection.schema_editor() as schema_editor:
+            for index in Bill._meta.indexes:
+                if state == 'without':
+                    schema_editor.remove_index(Bill, index)
+                else:
+                    schema_editor.add_index(Bill, index)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        for name, query in queries():
+            results.setdefault(name, {})[state] = measure(query, repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db', default='bench_indexes.sqlite3')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--bills', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django(args.db)
+    seed(args.users, args.bills)
+    results = run(args.repeat)
+    print('%-28s %14s %14s' % ('query', 'without (ms)', 'with (ms)'))
+    for name, timing in results.items():
+        print('%-28s %14.1f %14.1f' % (
+            name, timing['without'], timing['with']))
+
+
+if __name__ == '__main__':
+    main()
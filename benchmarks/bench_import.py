@@ -0,0 +1,88 @@
+""" Measure startup time of manage.py commands and the modules they import
+
+Each run starts a new interpreter running a management command, ``check`` by
+default, and measures it until it exits::
+
+    python benchmarks/bench_import.py --repeat 10
+    python benchmarks/bench_import.py --command migrate --command check
+
+The slowest top level imports are then listed from ``python -X importtime``,
+which needs Python 3.7 or later. Older interpreters only list which of the
+packages loaded on first pdf or Slack use were imported, from ``python -v``.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from common import ROOT_DIR
+
+MANAGE = os.path.join(ROOT_DIR, 'manage.py')
+# packages billjobs only needs to render a pdf or send a Slack request
+DEFERRED = ('reportlab', 'requests', 'urllib3', 'chardet', 'idna', 'certifi')
+# "import time:       self [us] |  cumulative | imported package"
+IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+# "import 'reportlab' # <_frozen_importlib_external.SourceFileLoader ...>"
+VERBOSE_IMPORT = re.compile(r"^import '([^'.]+)'", re.MULTILINE)
+
+
+def run(command, *options):
+    """ Run a manage.py command, return (seconds, standard error) """
+    args = [sys.executable] + list(options) + [MANAGE] + command.split()
+    start = time.perf_counter()
+    result = subprocess.run(
+            args, cwd=ROOT_DIR, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, universal_newlines=True)
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        sys.exit('%s failed:\n%s' % (' '.join(args), result.stderr[-2000:]))
+    return seconds, result.stderr
+
+
+def slowest_imports(stderr, count):
+    """ Return (cumulative ms, package) of the slowest top level imports """
+    imports = []
+    for self_us, cumulative_us, indent, package in IMPORTTIME.findall(
+            stderr):
+        if not indent:
+            imports.append((int(cumulative_us) / 1000, package))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--command', action='append',
+                        help='manage.py command and arguments, check if unset')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15,
+                        help='number of slowest imports listed')
+    args = parser.parse_args()
+
+    for command in args.command or ['check']:
+        # first run fills the bytecode cache
+        run(command)
+        values = [run(command)[0] * 1000 for i in range(args.repeat)]
+        print('manage.py %s: median %.0f ms, min %.0f ms' % (
+              command, statistics.median(values), min(values)))
+
+        if sys.version_info >= (3, 7):
+            seconds, stderr = run(command, '-X', 'importtime')
+            for cumulative, package in slowest_imports(stderr, args.top):
+                print('  %8.1f ms  %s' % (cumulative, package))
+            imported = set(package.strip() for self_us, cumulative_us,
+                           indent, package in IMPORTTIME.findall(stderr))
+        else:
+            seconds, stderr = run(command, '-v')
+            imported = set(VERBOSE_IMPORT.findall(stderr))
+        loaded = [package for package in DEFERRED if package in imported]
+        print('  deferred packages imported: %s' % (
+              ', '.join(loaded) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
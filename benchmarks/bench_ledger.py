@@ -0,0 +1,69 @@
+""" Measure coworker balances read from the ledger and the ledger rebuild
+
+The database is seeded with the seed_bills command, then the balance of the
+coworker with the most bills is read from its last ledger entry and summed
+from its unpaid bills. The rebuild_ledger command is measured last::
+
+    python benchmarks/bench_ledger.py --bills 100000 --users 50
+
+The rebuild is rolled back, so the script can run again on the same
+database.
+"""
+import argparse
+import sys
+import time
+
+from common import measure, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='bench_ledger.sqlite3')
+    parser.add_argument('--bills', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django(args.db)
+    from decimal import Decimal
+    from django.core.management import call_command
+    from django.db import transaction
+    from django.db.models import Count, Sum
+    from django.db.models.functions import Coalesce
+    from billjobs.ledger import rebuild_ledger
+    from billjobs.models import Bill, LedgerEntry, coworker_balance
+    from billjobs.seed import is_seeded
+
+    if not is_seeded():
+        call_command('seed_bills', users=args.users, bills=args.bills,
+                     lines=1, stdout=sys.stderr)
+    if not LedgerEntry.objects.exists():
+        # seeded before the ledger existed
+        rebuild_ledger()
+
+    user_id, bills = (Bill.objects.values_list('user_id')
+                      .annotate(bills=Count('pk')).order_by('-bills')[0])
+
+    def summed():
+        return (Bill.objects.filter(user_id=user_id, isPaid=False)
+                .aggregate(amount=Coalesce(Sum('amount'), Decimal(0)))
+                ['amount'])
+
+    assert coworker_balance(user_id) == summed()
+    print('balance of a coworker with %d bills: ledger %.3f ms, '
+          'sum of bills %.3f ms' % (
+              bills, measure(lambda: coworker_balance(user_id), args.repeat),
+              measure(summed, args.repeat)))
+
+    with transaction.atomic():
+        start = time.perf_counter()
+        entries = rebuild_ledger()
+        seconds = time.perf_counter() - start
+        transaction.set_rollback(True)
+    print('rebuild of %d entries: %.2f s' % (entries, seconds))
+
+
+if __name__ == '__main__':
+    main()
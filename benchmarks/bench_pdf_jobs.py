@@ -0,0 +1,65 @@
+""" Measure pdf jobs throughput with several worker processes
+
+Enqueue one pdf job per bill, then run the pdf_worker command until the
+queue is empty, with 1, 2 and 4 processes by default::
+
+    python benchmarks/bench_pdf_jobs.py --jobs 500 --processes 1 2 4
+"""
+import argparse
+import io
+
+from common import setup_django
+
+
+def seed(bills_count, lines_count):
+    from django.contrib.auth.models import User
+    from billjobs.models import Bill, BillLine, Service, UserProfile
+
+    if Bill.objects.count() >= bills_count:
+        return list(Bill.objects.values_list('pk', flat=True)[:bills_count])
+    user, created = User.objects.get_or_create(
+            username='coworker', first_name='Bill', last_name='Jobs')
+    UserProfile.objects.get_or_create(
+            user=user, defaults={'billing_address': '1 rue de la Paix'})
+    service = Service.objects.create(
+            reference='FT001', name='Full Time',
+            description='Full time access for one month', price=180)
+    numbers = ['J%010d' % i for i in range(bills_count)]
+    Bill.objects.bulk_create(
+            Bill(user=user, number=number, issuer_address='Issuer',
+                 billing_address='1 rue de la Paix')
+            for number in numbers)
+    bill_ids = list(Bill.objects.filter(number__in=numbers)
+                    .values_list('pk', flat=True))
+    BillLine.objects.bulk_create(
+            BillLine(bill_id=bill_id, service=service, quantity=1, total=180)
+            for bill_id in bill_ids for i in range(lines_count))
+    return bill_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db', default='bench_pdf_jobs.sqlite3')
+    parser.add_argument('--jobs', type=int, default=500)
+    parser.add_argument('--lines', type=int, default=10)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    # measure rendering, not cache hits
+    setup_django(args.db, BILLJOBS_PDF_CACHE=None)
+    from django.core.management import call_command
+    from billjobs.models import PdfJob
+
+    bill_ids = seed(args.jobs, args.lines)
+    for processes in args.processes:
+        PdfJob.objects.all().delete()
+        PdfJob.objects.bulk_create(
+                PdfJob(bill_id=bill_id) for bill_id in bill_ids)
+        output = io.StringIO()
+        call_command('pdf_worker', processes=processes, burst=True,
+                     stdout=output)
+        print('%d processes: %s' % (processes, output.getvalue().strip()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+""" Measure concurrent pdf downloads on a threaded WSGI server
+
+A threaded server answers requests of clients downloading bill pdf at the
+same time as requests of one client opening the signup page. The run is done
+once for each --limit value, a limit of 0 does not limit pdf renders::
+
+    python benchmarks/bench_pdf_load.py --clients 8 --limit 0 --limit 2
+
+For each run the script prints pdf downloads per second, latencies of pdf
+and page requests and the number of downloads refused with 503. The pdf
+cache is disabled so every download renders its pdf.
+"""
+import argparse
+import socketserver
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from common import setup_django
+
+
+def percentile(values, rank):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * rank / 100))]
+
+
+def start_server():
+    """ Serve the project in a thread, return (server, base url) """
+    from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    # like runserver, one thread per request
+    class ThreadedWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+    server.set_app(get_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+
+def get(url, cookie):
+    """ Return (status, seconds) of a GET request, content is read """
+    request = urllib.request.Request(url, headers={'Cookie': cookie})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        error.read()
+        status = error.code
+    return status, time.perf_counter() - start
+
+
+def run(base_url, cookie, pdf_urls, clients, downloads):
+    """ Return results of clients downloading downloads pdf each """
+    pdf_times = []
+    refused = []
+    page_times = []
+    done = threading.Event()
+
+    def download():
+        for i in range(downloads):
+            status, seconds = get(pdf_urls[i % len(pdf_urls)], cookie)
+            if status == 200:
+                pdf_times.append(seconds)
+            elif status == 503:
+                refused.append(seconds)
+            else:
+                raise RuntimeError('pdf download answered %d' % status)
+
+    def browse():
+        while not done.is_set():
+            status, seconds = get(base_url + '/billjobs/signup/', cookie)
+            page_times.append(seconds)
+
+    threads = [threading.Thread(target=download) for i in range(clients)]
+    browser = threading.Thread(target=browse)
+    start = time.perf_counter()
+    browser.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    browser.join()
+    return {
+            'seconds': elapsed,
+            'pdf_per_second': len(pdf_times) / elapsed,
+            'pdf_p50': percentile(pdf_times, 50),
+            'pdf_p95': percentile(pdf_times, 95),
+            'refused': len(refused),
+            'page_p50': percentile(page_times, 50),
+            'page_p95': percentile(page_times, 95),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='bench_pdf_load.sqlite3')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--downloads', type=int, default=10,
+                        help='pdf downloaded by each client')
+    parser.add_argument('--lines', type=int, default=50,
+                        help='lines of each downloaded bill')
+    parser.add_argument('--limit', type=int, action='append',
+                        help='BILLJOBS_PDF_RENDER_CONCURRENCY, 0 is None')
+    parser.add_argument('--wait', type=float, default=30,
+                        help='BILLJOBS_PDF_RENDER_WAIT')
+    args = parser.parse_args()
+
+    setup_django(args.db, BILLJOBS_PDF_CACHE=None,
+                 BILLJOBS_PDF_RENDER_WAIT=args.wait,
+                 ALLOWED_HOSTS=['127.0.0.1'])
+    from django.conf import settings
+    from django.contrib.auth.models import User
+    from django.shortcuts import reverse
+    from django.test import Client
+    from billjobs.settings import billjobs_settings
+    from billjobs.seed import is_seeded, seed_bills
+    from billjobs.models import Bill
+
+    if not is_seeded():
+        seed_bills(users=20, services=10, bills=args.clients * 2,
+                   lines=args.lines)
+    admin, created = User.objects.get_or_create(
+            username='bench-admin',
+            defaults={'is_staff': True, 'is_superuser': True})
+    client = Client()
+    client.force_login(admin)
+    cookie = '%s=%s' % (settings.SESSION_COOKIE_NAME,
+                        client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    server, base_url = start_server()
+    pdf_urls = [base_url + reverse('generate-pdf', args=(pk,))
+                for pk in Bill.objects.filter(number__startswith='S')
+                .order_by('pk').values_list('pk', flat=True)]
+    # first download loads reportlab and fonts
+    get(pdf_urls[0], cookie)
+
+    print('%-6s %8s %8s %8s %8s %8s %8s' % (
+          'limit', 'pdf/s', 'pdf p50', 'pdf p95', '503', 'page p50',
+          'page p95'), file=sys.stderr)
+    for limit in args.limit or [0, 2]:
+        settings.BILLJOBS_PDF_RENDER_CONCURRENCY = limit or None
+        billjobs_settings.reload()
+        result = run(base_url, cookie, pdf_urls, args.clients,
+                     args.downloads)
+        print('%-6s %8.1f %7.0fms %7.0fms %8d %7.0fms %7.0fms' % (
+              limit or '-', result['pdf_per_second'],
+              result['pdf_p50'] * 1000, result['pdf_p95'] * 1000,
+              result['refused'], result['page_p50'] * 1000,
+              result['page_p95'] * 1000), file=sys.stderr)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+""" Measure rendering of a bill pdf with many lines against a budget
+
+A usage bill of 10000 lines is rendered on several hundred pages, the
+script exits with status 1 when the render is slower or allocates more
+memory than the budget::
+
+    python benchmarks/bench_pdf_pages.py --lines 10000 --max-seconds 10 \\
+        --max-mib 200
+
+Rendering time grows linearly with the number of lines, --lines 1000 and
+--lines 10000 give about the same time per line.
+"""
+import argparse
+import re
+import sys
+import time
+import tracemalloc
+
+from common import setup_django
+from bench_pdf_render import seed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='bench_pdf_pages.sqlite3')
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--max-seconds', type=float, default=10)
+    parser.add_argument('--max-mib', type=float, default=200)
+    args = parser.parse_args()
+
+    setup_django(args.db)
+    from billjobs.pdf import render_bill_pdf
+
+    bill = seed(args.lines)
+    # load reportlab fonts and modules before measuring
+    render_bill_pdf(seed(1))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    pdf = render_bill_pdf(bill)
+    duration = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peak /= 1024 * 1024
+
+    pages = len(re.findall(rb'/Type /Page\b', pdf))
+    print('%d lines, %d pages, %d KiB: %.2f s, %.1f ms per 1000 lines, '
+          'peak %.1f MiB' % (
+              args.lines, pages, len(pdf) / 1024, duration,
+              duration * 1000 * 1000 / args.lines, peak))
+    if duration > args.max_seconds or peak > args.max_mib:
+        print('Budget exceeded: %.2f s for %.2f s, %.1f MiB for %.1f MiB' % (
+            duration, args.max_seconds, peak, args.max_mib))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+""" Measure latency and allocations of rendering one bill pdf
+
+"cold" rebuilds the invoice template for each pdf, as every pdf did before
+the template was kept by the process, "warm" reuses it::
+
+    python benchmarks/bench_pdf_render.py --lines 10 --repeat 200
+"""
+import argparse
+import tracemalloc
+
+from common import measure, setup_django
+
+
+def seed(lines_count):
+    from django.contrib.auth.models import User
+    from billjobs.models import Bill, BillLine, Service, UserProfile
+
+    user, created = User.objects.get_or_create(
+            username='coworker', first_name='Bill', last_name='Jobs')
+    UserProfile.objects.get_or_create(
+            user=user, defaults={'billing_address': '1 rue de la Paix'})
+    service, created = Service.objects.get_or_create(
+            reference='FT001', name='Full Time',
+            description='Full time access for one month', price=180)
+    bill = Bill.objects.create(user=user, issuer_address='Issuer')
+    BillLine.objects.bulk_create(
+            BillLine(bill=bill, service=service, quantity=1, total=180)
+            for i in range(lines_count))
+    return (Bill.objects
+            .select_related('user')
+            .prefetch_related('billline_set__service')
+            .get(pk=bill.pk))
+
+
+def allocations(func):
+    """ Return peak and total size of memory allocated by func in KiB """
+    tracemalloc.start()
+    func()
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    total = sum(stat.size for stat in snapshot.statistics('filename'))
+    return peak / 1024, total / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db', default='bench_pdf_render.sqlite3')
+    parser.add_argument('--lines', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django(args.db)
+    from billjobs.pdf import get_invoice_template, invoice_template, \
+        render_bill_pdf
+
+    bill = seed(args.lines)
+
+    def cold():
+        invoice_template.cache_clear()
+        render_bill_pdf(bill)
+
+    def warm():
+        render_bill_pdf(bill)
+
+    # load reportlab fonts and modules before measuring
+    render_bill_pdf(bill)
+    for name, func in (('cold', cold), ('warm', warm)):
+        duration = measure(func, args.repeat)
+        # allocations of the template itself are kept by the warm process
+        get_invoice_template()
+        peak, total = allocations(func)
+        print('%s: %.2f ms per pdf, peak %.0f KiB, retained %.0f KiB' % (
+            name, duration, peak, total))
+
+
+if __name__ == '__main__':
+    main()
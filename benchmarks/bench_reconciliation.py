@@ -0,0 +1,86 @@
+""" Measure reconciliation of a bank statement with many credits
+
+The database is seeded with the seed_bills command and every bill is set
+unpaid, then a csv statement gets one credit per bill. One label in ten
+only has the coworker name, the others have the bill number. Seeded
+coworkers share a few names, so most of the first ones are rejected as
+ambiguous::
+
+    python benchmarks/bench_reconciliation.py --bills 100000
+
+Changes are rolled back at the end, so the script can run again on the same
+database.
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+from common import setup_django
+
+
+def write_statement(path):
+    from billjobs.models import Bill
+
+    bills = (Bill.objects.filter(isPaid=False)
+             .values_list('number', 'amount', 'billing_date',
+                          'user__first_name', 'user__last_name')
+             .iterator())
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as statement:
+        writer = csv.writer(statement, delimiter=';')
+        writer.writerow(('Date', 'Libellé', 'Montant'))
+        for number, amount, date, first_name, last_name in bills:
+            label = ('VIR SEPA %s %s' % (first_name, last_name)
+                     if count % 10 == 0 else 'VIR SEPA FACTURE %s' % number)
+            writer.writerow((date.strftime('%d/%m/%Y'), label,
+                             str(amount).replace('.', ',')))
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='bench_reconciliation.sqlite3')
+    parser.add_argument('--bills', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django(args.db)
+    from django.core.management import call_command
+    from django.db import transaction
+    from billjobs.models import Bill
+    from billjobs.reconciliation import mark_bills_paid, parse_statement, \
+        reconcile
+    from billjobs.seed import is_seeded
+
+    if not is_seeded():
+        call_command('seed_bills', users=args.users, bills=args.bills,
+                     lines=1, stdout=sys.stderr)
+
+    path = os.path.join(tempfile.mkdtemp(), 'statement.csv')
+    with transaction.atomic():
+        Bill.objects.update(isPaid=False)
+        credits = write_statement(path)
+
+        start = time.perf_counter()
+        with open(path, 'rb') as stream:
+            matches, rejects = reconcile(parse_statement(stream, 'csv'))
+        matched = time.perf_counter()
+        mark_bills_paid(bill_id for payment, bill_id, reason in matches)
+        end = time.perf_counter()
+        transaction.set_rollback(True)
+    os.remove(path)
+
+    print('%d credits, %d matched, %d not matched' % (
+        credits, len(matches), len(rejects)))
+    print('parse and match: %.2f s, update: %.2f s, total: %.2f s' % (
+        matched - start, end - matched, end - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+""" Measure the account statement pdf of coworkers with many bills
+
+The database is seeded with the seed_bills command. The statement of the
+coworker with the most bills is rendered with bills read by batches of each
+--batch-size value, then downloaded twice to measure the cached one::
+
+    python benchmarks/bench_statement.py --bills 20000 --users 5
+
+For each batch size the script prints render time, pages, queries and the
+peak of memory allocated while rendering, measured with tracemalloc.
+"""
+import argparse
+import datetime
+import re
+import sys
+import time
+import tracemalloc
+
+from common import measure, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='bench_statement.sqlite3')
+    parser.add_argument('--bills', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, action='append',
+                        help='bills read by query, 500 if unset')
+    args = parser.parse_args()
+
+    setup_django(args.db, BILLJOBS_PDF_CACHE='default')
+    from django.core.management import call_command
+    from django.db import connection
+    from django.db.models import Count
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from billjobs.models import Bill
+    from billjobs.pdf import render_statement_pdf
+    from billjobs.seed import is_seeded
+    from billjobs.statement import statement_bills, statement_totals
+
+    if not is_seeded():
+        call_command('seed_bills', users=args.users, bills=args.bills,
+                     lines=2, stdout=sys.stderr)
+    user_id, bills = (Bill.objects.values_list('user_id')
+                      .annotate(bills=Count('pk')).order_by('-bills')[0])
+    user = User.objects.get(pk=user_id)
+    print('statement of %d bills' % bills)
+
+    for batch_size in args.batch_size or [500]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            pdf = render_statement_pdf(
+                    user, '', statement_bills(user_id, batch_size),
+                    statement_totals(user_id), datetime.date.today())
+        seconds = time.perf_counter() - start
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('batch %6d: %.2f s, %d pages, %d queries, pdf %.1f MB, '
+              'peak %.1f MB' % (
+                  batch_size, seconds,
+                  len(re.findall(rb'/Type /Page\b', pdf)),
+                  len(queries), len(pdf) / 2**20, peak / 2**20))
+
+    client = Client()
+    client.force_login(user)
+    # first download renders and caches the statement
+    client.get('/billjobs/statement/')
+    print('cached download: %.1f ms' % measure(
+        lambda: client.get('/billjobs/statement/')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+""" Measure billing hot paths and write results as json
+
+The database is seeded once with the seed_bills command, then each case is
+measured repeat times. Results of two runs are compared by compare.py::
+
+    python benchmarks/bench_suite.py --output before.json
+    python benchmarks/bench_suite.py --output after.json
+    python benchmarks/compare.py before.json after.json
+
+Cases changing data run in a transaction rolled back after each call, so
+every run measures the same database.
+"""
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+
+from common import ROOT_DIR, durations, setup_django
+
+# lines of bills rendered in pdf
+PDF_LINES = (1, 50, 500)
+# lines of the bill saved by the amount cases
+LARGE_BILL_LINES = 1000
+
+
+def seeded_user():
+    from django.contrib.auth.models import User
+    from billjobs.seed import SEED_PREFIX
+
+    return (User.objects.filter(username__startswith=SEED_PREFIX)
+            .order_by('username').first())
+
+
+def bench_bill(lines_count):
+    """ Return a bill of lines_count lines, created on first run """
+    from billjobs.models import Bill, BillLine, Service
+
+    number = 'BENCH%06d' % lines_count
+    bill = Bill.objects.filter(number=number).first()
+    if bill is not None:
+        return bill
+    bill = Bill.objects.create(user=seeded_user(), number=number)
+    service = Service.objects.order_by('pk').first()
+    BillLine.objects.bulk_create(
+            BillLine(bill=bill, service=service, quantity=1,
+                     total=service.price)
+            for i in range(lines_count))
+    bill.save()
+    return bill
+
+
+def rolled_back(func):
+    """ Return func calling func in a transaction rolled back """
+    from django.db import transaction
+
+    def wrapper():
+        with transaction.atomic():
+            func()
+            transaction.set_rollback(True)
+    return wrapper
+
+
+def cases():
+    """ Return (name, func) of each measured case """
+    from django.contrib.auth.models import User
+    from django.shortcuts import reverse
+    from django.test import Client
+    from billjobs.export import stream_accounting_csv
+    from billjobs.models import Bill, BillLine, Service
+
+    admin, created = User.objects.get_or_create(
+            username='bench-admin',
+            defaults={'is_staff': True, 'is_superuser': True})
+    client = Client()
+    client.force_login(admin)
+    user = seeded_user()
+    service = Service.objects.order_by('pk').first()
+    large_bill = bench_bill(LARGE_BILL_LINES)
+    large_line = large_bill.billline_set.first()
+
+    def bill_create():
+        # pre_save and post_save receivers run for the bill and each line
+        bill = Bill.objects.create(user=user)
+        for i in range(10):
+            BillLine.objects.create(bill=bill, service=service, quantity=2)
+
+    def bill_save():
+        large_bill.save()
+
+    def line_save():
+        large_line.quantity += 1
+        large_line.total = 0
+        large_line.save()
+
+    def get(url):
+        def func():
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+            # streamed responses are produced while consumed
+            b''.join(response)
+        return func
+
+    def export_csv():
+        for chunk in stream_accounting_csv(Bill.objects.all()):
+            pass
+
+    yield 'bill_create_10_lines', rolled_back(bill_create)
+    yield 'bill_save_%d_lines' % LARGE_BILL_LINES, rolled_back(bill_save)
+    yield 'line_save_%d_lines' % LARGE_BILL_LINES, rolled_back(line_save)
+    for lines_count in PDF_LINES:
+        bill = bench_bill(lines_count)
+        yield 'generate_pdf_%d_lines' % lines_count, get(
+                reverse('generate-pdf', args=(bill.pk,)))
+    yield 'admin_bill_changelist', get(
+            reverse('admin:billjobs_bill_changelist'))
+    yield 'export_accounting_csv', export_csv
+
+
+def rows():
+    from django.contrib.auth.models import User
+    from billjobs.models import Bill, BillLine, Service
+
+    return {
+            'users': User.objects.count(),
+            'services': Service.objects.count(),
+            'bills': Bill.objects.count(),
+            'bill_lines': BillLine.objects.count(),
+            }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR,
+                stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='bench_suite.sqlite3')
+    parser.add_argument('--output', help='Json file, standard output if unset')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument(
+            '--case', action='append',
+            help='Only measure cases whose name contains this value')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--services', type=int, default=20)
+    parser.add_argument('--bills', type=int, default=5000)
+    parser.add_argument('--lines', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # pdf would be rendered only once with the cache
+    setup_django(args.db, BILLJOBS_PDF_CACHE=None)
+    import django
+    from django.core.management import call_command
+    from billjobs.seed import is_seeded
+
+    if not is_seeded():
+        call_command(
+                'seed_bills', users=args.users, services=args.services,
+                bills=args.bills, lines=args.lines, seed=args.seed,
+                stdout=sys.stderr)
+
+    results = {}
+    for name, func in cases():
+        if args.case and not any(case in name for case in args.case):
+            continue
+        # first call loads modules, fonts and templates
+        func()
+        values = durations(func, args.repeat)
+        results[name] = {
+                'repeat': args.repeat,
+                'median_ms': round(statistics.median(values), 3),
+                'min_ms': round(min(values), 3),
+                'max_ms': round(max(values), 3),
+                }
+        print('%-28s %10.2f ms' % (name, results[name]['median_ms']),
+              file=sys.stderr)
+
+    report = {
+            'meta': {
+                'date': datetime.datetime.utcnow().isoformat() + 'Z',
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'platform': platform.platform(),
+                # seed arguments are only used by the first run of a database
+                'rows': rows(),
+                },
+            'results': results,
+            }
+    content = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(content)
+    else:
+        sys.stdout.write(content)
+
+
+if __name__ == '__main__':
+    main()
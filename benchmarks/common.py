@@ -0,0 +1,53 @@
+""" Helpers shared by benchmark scripts
+
+Benchmarks run against their own sqlite database, never the development
+one. Run them from the repository root, for example::
+
+    python benchmarks/bench_bill_indexes.py --bills 100000
+"""
+import os
+import statistics
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django(db_name, **overrides):
+    """ Configure Django with core settings and a benchmark database
+
+        overrides are settings set before billjobs is loaded.
+    """
+    sys.path.insert(0, ROOT_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    import django
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = db_name
+    # the toolbar would be rendered in each measured response
+    settings.DEBUG = False
+    settings.INSTALLED_APPS = [
+            app for app in settings.INSTALLED_APPS if app != 'debug_toolbar']
+    settings.MIDDLEWARE_CLASSES = [
+            middleware for middleware in settings.MIDDLEWARE_CLASSES
+            if not middleware.startswith('debug_toolbar')]
+    settings.ALLOWED_HOSTS = ['testserver']
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def durations(func, repeat=5):
+    """ Call func repeat times, return each duration in milliseconds """
+    values = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        values.append((time.perf_counter() - start) * 1000)
+    return values
+
+
+def measure(func, repeat=5):
+    """ Call func repeat times, return median duration in milliseconds """
+    return statistics.median(durations(func, repeat))
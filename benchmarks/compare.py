@@ -0,0 +1,60 @@
+""" Compare two json results of bench_suite.py
+
+Print the median of each case in both runs and exit with status 1 when one
+is slower than the threshold, 10% by default::
+
+    python benchmarks/compare.py before.json after.json --threshold 0.1
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as result:
+        return json.load(result)['results']
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument(
+            '--threshold', type=float, default=0.1,
+            help='Highest accepted slowdown ratio of a median')
+    args = parser.parse_args()
+
+    baseline = load(args.baseline)
+    current = load(args.current)
+    regressions = []
+    print('%-28s %12s %12s %8s' % ('case', 'baseline ms', 'current ms',
+                                   'change'))
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline or name not in current:
+            print('%-28s %12s %12s' % (
+                name,
+                '%.2f' % baseline[name]['median_ms']
+                if name in baseline else '-',
+                '%.2f' % current[name]['median_ms']
+                if name in current else '-'))
+            continue
+        before = baseline[name]['median_ms']
+        after = current[name]['median_ms']
+        change = after / before - 1 if before else 0
+        flag = ''
+        if change > args.threshold:
+            regressions.append(name)
+            flag = ' slower'
+        print('%-28s %12.2f %12.2f %+7.1f%%%s' % (
+            name, before, after, change * 100, flag))
+
+    if regressions:
+        print('%d case(s) slower than %.0f%%: %s' % (
+            len(regressions), args.threshold * 100, ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
-import csv
 from django import forms
-from django.http import HttpResponse
-from django.db.models import Q
-from django.contrib import admin
+from django.http import StreamingHttpResponse
+from django.core.exceptions import ValidationError
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserChangeForm
@@ -10,36 +10,104 @@ from django.core.urlresolvers import reverse
 from django.forms.models import BaseInlineFormSet
 from django.utils.html import format_html
 from django.utils.translation import ugettext_lazy as _
-from .models import Bill, BillLine, Service, UserProfile
+from .models import Bill, BillLine, LedgerEntry, Service, Subscription, \
+        UserProfile, available_services, coworker_balance, defer_bill_amount
+from .export import stream_accounting_csv, stream_bills_zip, \
+        stream_email_csv
+from .ledger import CreditNoteError, credit_bill
+from .mailing import send_invoices
+
+class ServiceChoiceField(forms.ModelChoiceField):
+    """ Choice of a service among a list, without database query """
+
+    def set_services(self, services):
+        self.services = {str(service.pk): service for service in services}
+        self.choices = [('', self.empty_label)] + [
+                (service.pk, self.label_from_instance(service))
+                for service in services]
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.services[str(value)]
+        except KeyError:
+            raise ValidationError(self.error_messages['invalid_choice'],
+                                  code='invalid_choice')
+
 
 class BillLineInlineForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
+        services = kwargs.pop('services', None)
         super(BillLineInlineForm, self).__init__(*args, **kwargs)
-        if self.instance.id:
-            self.fields['service'].queryset = Service.objects.filter(Q(is_available=True) | Q(name=self.instance.service.name))
-            print(self.fields['service'].choices)
-        else:
-            self.fields['service'].queryset = Service.objects.filter(is_available=True)
+        if services is None:
+            services = available_services()
+        # a line keeps its service when it is not available anymore
+        if self.instance.service_id and self.instance.service_id not in {
+                service.pk for service in services}:
+            services = tuple(services) + (self.instance.service,)
+        self.fields['service'].set_services(services)
 
     class Meta:
         model = BillLine
         fields = ('service', 'quantity', 'total', 'note')
+        field_classes = {'service': ServiceChoiceField}
+
+
+class BillLineInlineFormSet(BaseInlineFormSet):
+    """ Read available services once for all forms """
+
+    def get_form_kwargs(self, index):
+        kwargs = super(BillLineInlineFormSet, self).get_form_kwargs(index)
+        if not hasattr(self, 'services'):
+            self.services = available_services()
+        kwargs['services'] = self.services
+        return kwargs
 
 class BillLineInline(admin.TabularInline):
     model = BillLine
     extra = 1
     form = BillLineInlineForm
+    formset = BillLineInlineFormSet
+
+    def get_queryset(self, request):
+        return super(BillLineInline, self).get_queryset(
+                request).select_related('service')
+
+
+class BillChangeList(ChangeList):
+    """ Bill list reading only the columns it shows
+
+        Actions get the whole bills from get_queryset(), only the page of
+        listed bills skips address columns.
+    """
+
+    def get_results(self, request):
+        queryset = self.queryset
+        self.queryset = queryset.only(
+                'number', 'isPaid', 'billing_date', 'amount',
+                'user__first_name', 'user__last_name')
+        try:
+            super(BillChangeList, self).get_results(request)
+        finally:
+            self.queryset = queryset
 
 
 class BillAdmin(admin.ModelAdmin):
-    readonly_fields = ('number', 'billing_date', 'amount')
+    readonly_fields = ('number', 'billing_date', 'amount', 'credited_bill')
     exclude = ('issuer_address', 'billing_address')
     inlines = [BillLineInline]
     list_display = ('__str__', 'coworker_name_link', 'amount', 'billing_date',
             'isPaid', 'pdf_file_url')
     list_editable = ('isPaid',)
     list_filter = ('isPaid', )
+    # coworker name of each listed bill
+    list_select_related = ('user',)
     search_fields = ('user__first_name', 'user__last_name', 'number', 'amount')
+    actions = ['export_pdf_zip', 'export_accounting_csv', 'send_invoices',
+               'credit_bills']
+    # filtered list does not count every bill again
+    show_full_result_count = False
 
     def formfield_for_foreignkey(self, db_field, request=None, **kwargs):
         field = super(BillAdmin, self).formfield_for_foreignkey(
@@ -49,6 +117,15 @@ class BillAdmin(admin.ModelAdmin):
             field.label_from_instance = self.get_user_label
         return field
 
+    def get_changelist(self, request, **kwargs):
+        return BillChangeList
+
+    def save_related(self, request, form, formsets, change):
+        """ Compute bill amount once after all lines are saved """
+        with defer_bill_amount():
+            super(BillAdmin, self).save_related(
+                    request, form, formsets, change)
+
     def get_user_label(self, user):
         name = user.get_full_name()
         username = user.username
@@ -59,7 +136,7 @@ class BillAdmin(admin.ModelAdmin):
         ''' Create a link to user admin edit view '''
         return format_html(
                 '<a href="{}">{}</a>',
-                reverse('admin:auth_user_change', args=(obj.user.id,)),
+                reverse('admin:auth_user_change', args=(obj.user_id,)),
                 obj.coworker_name())
     coworker_name_link.short_description = _('Coworker name')
 
@@ -70,6 +147,49 @@ class BillAdmin(admin.ModelAdmin):
                 obj.number)
     pdf_file_url.short_description=_('Download invoice')
 
+    def export_pdf_zip(self, request, queryset):
+        """ Download pdf of selected bills in one zip archive """
+        response = StreamingHttpResponse(
+                stream_bills_zip(queryset), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="bills.zip"'
+        return response
+    export_pdf_zip.short_description = _('Download pdf of selected bills')
+
+    def export_accounting_csv(self, request, queryset):
+        """ Download selected bills and their lines in one csv file """
+        response = StreamingHttpResponse(
+                stream_accounting_csv(queryset), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="bills.csv"'
+        return response
+    export_accounting_csv.short_description = _(
+            'Export selected bills for accounting')
+
+    def send_invoices(self, request, queryset):
+        """ Send pdf of selected bills to their coworker by email """
+        sent, skipped = send_invoices(queryset)
+        self.message_user(request, _('%d bills sent by email.') % sent)
+        if skipped:
+            self.message_user(
+                    request,
+                    _('Coworker of bills %s has no email.') % ', '.join(
+                        bill.number for bill in skipped),
+                    messages.WARNING)
+    send_invoices.short_description = _('Send selected bills by email')
+
+    def credit_bills(self, request, queryset):
+        """ Cancel selected bills with a credit note of all their lines """
+        created = []
+        for bill in queryset.order_by('pk'):
+            try:
+                created.append(credit_bill(bill).number)
+            except CreditNoteError as error:
+                self.message_user(request, str(error), messages.WARNING)
+        if created:
+            self.message_user(request, _('Credit notes %s created.') % (
+                ', '.join(created)))
+    credit_bills.short_description = _(
+            'Create credit notes of selected bills')
+
 class RequiredInlineFormSet(BaseInlineFormSet):
     """
     Generates an inline formset that is required
@@ -112,31 +232,75 @@ class UserAdmin(UserAdmin):
             (_('Important dates'), {
                 'classes': ('collapse',),
                 'fields': ('last_login', 'date_joined')
+                }),
+            (_('Billing'), {
+                'fields': ('ledger_balance', 'statement_link')
                 })
             )
+    readonly_fields = ('ledger_balance', 'statement_link')
     list_display = ('username', 'get_full_name', 'email')
     actions = ['export_email']
     form = UserForm
 
-    def export_email(self, request, queryset):
-        """ Export emails of selected account """
-        response = HttpResponse(content_type='text/csv')
+    def ledger_balance(self, obj):
+        ''' Amount of unpaid bills, from the last ledger entry '''
+        return coworker_balance(obj.pk)
+    ledger_balance.short_description = _('Balance')
 
-        writer = csv.writer(response)
-        for email in queryset.values_list('email'):
-            writer.writerow(email)
+    def statement_link(self, obj):
+        ''' Link to the account statement pdf of the user '''
+        if obj.pk is None:
+            return ''
+        return format_html(
+                '<a href="{}">{}</a>',
+                reverse('generate-user-statement', args=(obj.pk,)),
+                _('Download statement'))
+    statement_link.short_description = _('Account statement')
 
+    def export_email(self, request, queryset):
+        """ Export emails and names of selected account """
+        response = StreamingHttpResponse(
+                stream_email_csv(queryset), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="emails.csv"'
         return response
     export_email.short_description = _('Export email of selected users')
 
+class LedgerEntryAdmin(admin.ModelAdmin):
+    """ Ledger entries are only read, they are appended by bill changes """
+    model = LedgerEntry
+    list_display = ('created_at', 'user', 'bill_number', 'kind', 'amount',
+                    'balance')
+    list_filter = ('kind',)
+    list_select_related = ('user',)
+    search_fields = ('user__first_name', 'user__last_name', 'bill_number')
+    readonly_fields = ('created_at', 'user', 'bill', 'bill_number', 'kind',
+                       'bill_amount', 'is_paid', 'amount', 'balance')
+    ordering = ('-pk',)
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 class ServiceAdmin(admin.ModelAdmin):
     model = Service
     list_display = ('__str__', 'price', 'is_available')
     list_editable = ('is_available',)
     list_filter = ('is_available',)
 
+class SubscriptionAdmin(admin.ModelAdmin):
+    model = Subscription
+    list_display = ('__str__', 'quantity', 'last_billing_date', 'is_active')
+    list_editable = ('is_active',)
+    list_filter = ('is_active', 'service')
+    search_fields = ('user__first_name', 'user__last_name', 'user__username')
+
 admin.site.register(Bill, BillAdmin)
 admin.site.register(Service, ServiceAdmin)
+admin.site.register(Subscription, SubscriptionAdmin)
+admin.site.register(LedgerEntry, LedgerEntryAdmin)
 
 # User have to be unregistered
 admin.site.unregister(User)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from functools import wraps
+from django.db.models import Q
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date, quote_etag, urlencode
+from django.views.decorators.http import require_GET
+from .cache import get_api_cache, get_api_version
+from .models import Bill, Service, UserProfile
+from .settings import billjobs_settings
+
+# highest number of bills in one page
+MAX_PAGE_SIZE = 100
+
+
+class ApiError(Exception):
+    ''' Error returned as json with an http status '''
+
+    def __init__(self, message, status=400):
+        super(ApiError, self).__init__(message)
+        self.message = message
+        self.status = status
+
+
+def call_view(view, request, *args, **kwargs):
+    try:
+        data = view(request, *args, **kwargs)
+    except Http404:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    except ApiError as error:
+        return JsonResponse({'error': error.message}, status=error.status)
+    return JsonResponse(data)
+
+
+def api_view(view):
+    ''' Read only json view of the data of the logged in user
+
+        The view returns data to serialize. ETag and Last-Modified headers
+        come from the api version of the user, a conditional request gets a
+        304 without calling the view. Responses are cached per user until
+        the version changes. Without api cache, the ETag is a hash of the
+        response and a conditional request gets a 304 once the view ran.
+    '''
+    @require_GET
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse(
+                    {'error': 'Authentication required'}, status=401)
+        versions = get_api_version(request.user.pk)
+        if versions is None:
+            response = call_view(view, request, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = quote_etag(
+                        hashlib.sha1(response.content).hexdigest())
+                response = get_conditional_response(
+                        request, etag=response['ETag'], response=response)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        digest = hashlib.sha1(repr((
+            request.user.pk, versions, request.get_full_path())).encode(
+                'utf-8')).hexdigest()
+        etag = quote_etag(digest)
+        last_modified = max(versions)
+        response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+        if response is None:
+            cache = get_api_cache()
+            key = 'billjobs:api:response:%s:%s' % (request.user.pk, digest)
+            content = cache.get(key)
+            if content is None:
+                response = call_view(view, request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(key, response.content,
+                              billjobs_settings.API_CACHE_TIMEOUT)
+            else:
+                response = HttpResponse(
+                        content, content_type='application/json')
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        # client must ask if its copy is still valid
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    return wrapper
+
+
+def page_size(request):
+    try:
+        limit = int(request.GET.get('limit', billjobs_settings.API_PAGE_SIZE))
+    except ValueError:
+        raise ApiError('limit must be a number')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_cursor(cursor):
+    ''' Return (billing date, id) of the last bill of the previous page '''
+    try:
+        date, pk = cursor.split('.')
+        date, pk = parse_date(date), int(pk)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ApiError('Invalid cursor')
+    return date, pk
+
+
+def bill_data(bill):
+    return {
+            'id': bill.pk,
+            'number': bill.number,
+            'billing_date': bill.billing_date,
+            'amount': bill.amount,
+            'is_paid': bill.isPaid,
+            'pdf': reverse('generate-pdf', args=(bill.pk,)),
+            }
+
+
+def service_data(service):
+    return {
+            'id': service.pk,
+            'reference': service.reference,
+            'name': service.name,
+            'description': service.description,
+            'price': service.price,
+            }
+
+
+@api_view
+def bill_list(request):
+    ''' Bills of the user, newest first
+
+        Pages are selected with the billing date and id of the last bill of
+        the previous page, given in the cursor parameter, so a page is found
+        with the (user, billing_date) index without counting older bills.
+    '''
+    limit = page_size(request)
+    bills = (Bill.objects
+             .filter(user=request.user)
+             .only('number', 'billing_date', 'amount', 'isPaid')
+             .order_by('-billing_date', '-pk'))
+    cursor = request.GET.get('cursor')
+    if cursor:
+        date, pk = parse_cursor(cursor)
+        bills = bills.filter(billing_date__lte=date).filter(
+                Q(billing_date__lt=date) | Q(pk__lt=pk))
+    bills = list(bills[:limit + 1])
+
+    next_url = None
+    if len(bills) > limit:
+        bills = bills[:limit]
+        next_url = '%s?%s' % (reverse('api-bill-list'), urlencode({
+            'cursor': '%s.%d' % (bills[-1].billing_date.isoformat(),
+                                 bills[-1].pk),
+            'limit': limit,
+            }))
+    return {'results': [bill_data(bill) for bill in bills], 'next': next_url}
+
+
+@api_view
+def bill_detail(request, bill_id):
+    ''' Bill of the user with its lines and services '''
+    bill = get_object_or_404(
+            Bill.objects.filter(user=request.user)
+            .prefetch_related('billline_set__service'),
+            pk=bill_id)
+    data = bill_data(bill)
+    data['issuer_address'] = bill.issuer_address
+    data['billing_address'] = bill.billing_address
+    data['lines'] = [{
+        'id': line.pk,
+        'service': service_data(line.service),
+        'quantity': line.quantity,
+        'total': line.total,
+        'note': line.note,
+        } for line in bill.billline_set.all()]
+    return data
+
+
+@api_view
+def service_list(request):
+    ''' Services available to coworkers '''
+    services = Service.objects.filter(is_available=True).order_by('reference')
+    return {'results': [service_data(service) for service in services]}
+
+
+@api_view
+def profile(request):
+    ''' Account and billing address of the user '''
+    user = request.user
+    billing_address = (UserProfile.objects
+                       .filter(user=user)
+                       .values_list('billing_address', flat=True)
+                       .first())
+    return {
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'email': user.email,
+            'billing_address': billing_address or '',
+            'statement': reverse('generate-statement'),
+            }
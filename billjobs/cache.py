@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from django.core.cache import caches
+from django.db import connection, transaction
+from .instrumentation import observe, timed
+from .settings import billjobs_settings
+
+# Settings used to render a pdf, a change in one of them gives new digests
+PDF_SETTINGS = (
+        'DEBUG_PDF',
+        'BILL_LOGO_PATH',
+        'BILL_LOGO_WIDTH',
+        'BILL_LOGO_HEIGHT',
+        'BILL_PAYMENT_INFO',
+        )
+
+# renders of downloads running in this process, by concurrency setting
+render_slots = {}
+
+
+def settings_digest():
+    ''' Hash of the current values of PDF_SETTINGS '''
+    values = tuple(getattr(billjobs_settings, name) for name in PDF_SETTINGS)
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()[:12]
+
+
+def get_render_slots():
+    ''' Return the semaphore limiting renders of downloads or None '''
+    concurrency = billjobs_settings.PDF_RENDER_CONCURRENCY
+    if concurrency is None:
+        return None
+    slots = render_slots.get(concurrency)
+    if slots is None:
+        slots = render_slots.setdefault(
+                concurrency, threading.BoundedSemaphore(concurrency))
+    return slots
+
+
+class RenderBusy(Exception):
+    ''' No pdf render slot was free before the wait expired '''
+
+
+def get_pdf_cache():
+    ''' Return the cache backend storing pdf or None if cache is disabled '''
+    if billjobs_settings.PDF_CACHE is None:
+        return None
+    return caches[billjobs_settings.PDF_CACHE]
+
+
+def digest_key(bill_id):
+    ''' Cache key of the last digest computed for a bill '''
+    return 'billjobs:pdf:digest:%s:%s' % (settings_digest(), bill_id)
+
+
+def pdf_key(digest):
+    ''' Cache key of a pdf content '''
+    return 'billjobs:pdf:content:%s' % digest
+
+
+def bill_digest(bill):
+    ''' Compute a hash of everything printed in the bill pdf '''
+    content = [
+            settings_digest(),
+            bill.number,
+            bill.billing_date.isoformat(),
+            bill.amount,
+            bill.issuer_address,
+            bill.billing_address,
+            bill.user.first_name,
+            bill.user.last_name,
+            ]
+    for line in bill.billline_set.all():
+        content.append((
+            line.service.reference,
+            line.service.name,
+            line.service.description,
+            line.service.price,
+            line.quantity,
+            line.total,
+            line.note,
+            ))
+    return hashlib.sha256(repr(content).encode('utf-8')).hexdigest()
+
+
+def get_bill_digest(bill_id):
+    ''' Return digest of the last pdf cached for this bill or None '''
+    cache = get_pdf_cache()
+    if cache is None:
+        return None
+    return cache.get(digest_key(bill_id))
+
+
+def get_cached_pdf(digest):
+    ''' Return a pdf from its digest or None '''
+    cache = get_pdf_cache()
+    if cache is None:
+        return None
+    return cache.get(pdf_key(digest))
+
+
+@contextmanager
+def render_slot(limited):
+    ''' Hold one of the BILLJOBS_PDF_RENDER_CONCURRENCY render slots
+
+        When limited is True, wait for a free slot and raise RenderBusy if
+        none is free after BILLJOBS_PDF_RENDER_WAIT seconds. Renders not
+        limited run at once.
+    '''
+    slots = get_render_slots() if limited else None
+    if slots is None:
+        yield
+        return
+    with timed('pdf_render_wait_seconds') as labels:
+        acquired = slots.acquire(timeout=billjobs_settings.PDF_RENDER_WAIT)
+        labels['status'] = 'acquired' if acquired else 'busy'
+    if not acquired:
+        raise RenderBusy()
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+def render_pdf(bill, limited=False):
+    ''' Render a bill pdf, recording render time and pdf size
+
+        limited is given to render_slot(), it is True for downloads.
+    '''
+    # pdf module loads reportlab, it is only needed on cache miss
+    from .pdf import render_bill_pdf
+
+    with render_slot(limited), timed('pdf_render_seconds'):
+        pdf = render_bill_pdf(bill)
+    observe('pdf_bytes', len(pdf))
+    return pdf
+
+
+def get_bill_pdf(bill, limited=False):
+    ''' Return (digest, pdf) of a bill, pdf is rendered only on cache miss
+
+        limited is given to render_pdf, it is True for downloads.
+    '''
+    digest = bill_digest(bill)
+    pdf = get_cached_pdf(digest)
+    if pdf is not None:
+        cache_bill_pdf(bill.pk, digest)
+        return digest, pdf
+
+    pdf = render_pdf(bill, limited)
+    cache_bill_pdf(bill.pk, digest, pdf)
+    return digest, pdf
+
+
+def cache_bill_pdf(bill_id, digest, pdf=None):
+    ''' Cache the digest of a bill, and its pdf when it was just rendered '''
+    cache = get_pdf_cache()
+    if cache is None:
+        return
+    timeout = billjobs_settings.PDF_CACHE_TIMEOUT
+    if pdf is not None:
+        cache.set(pdf_key(digest), pdf, timeout)
+    cache.set(digest_key(bill_id), digest, timeout)
+
+
+def invalidate_bill_pdf(*bill_ids):
+    ''' Forget digests of bills, next download will compute them again '''
+    cache = get_pdf_cache()
+    if cache is not None and bill_ids:
+        cache.delete_many([digest_key(bill_id) for bill_id in bill_ids])
+
+
+def get_api_cache():
+    ''' Return the cache backend storing api responses or None '''
+    if billjobs_settings.API_CACHE is None:
+        return None
+    return caches[billjobs_settings.API_CACHE]
+
+
+def api_version_key(user_id):
+    ''' Cache key of the version of api responses of a user
+
+        Data shown to every user, like services, has the 'shared' version.
+    '''
+    return 'billjobs:api:version:%s' % user_id
+
+
+def get_api_version(user_id):
+    ''' Return (user version, shared version) or None if cache is disabled
+
+        A version is the time of the last change, in seconds. Versions not
+        in cache start now.
+    '''
+    cache = get_api_cache()
+    if cache is None:
+        return None
+    keys = [api_version_key(user_id), api_version_key('shared')]
+    versions = cache.get_many(keys)
+    missing = {key: int(time.time()) for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return tuple(versions[key] for key in keys)
+
+
+def invalidate_api_cache(*user_ids):
+    ''' Give a new version to api responses of users
+
+        Versions always grow, by one second at least, so Last-Modified
+        headers are different for each change.
+    '''
+    cache = get_api_cache()
+    if cache is None or not user_ids:
+        return
+    keys = [api_version_key(user_id) for user_id in set(user_ids)]
+
+    def new_versions():
+        versions = cache.get_many(keys)
+        now = int(time.time())
+        cache.set_many({
+            key: max(now, versions.get(key, 0) + 1) for key in keys}, None)
+
+    new_versions()
+    if connection.in_atomic_block:
+        # a response computed before the commit still has the old data
+        transaction.on_commit(new_versions)
+
+
+def invalidate_shared_api_cache():
+    ''' Give a new version to api responses of every user '''
+    invalidate_api_cache('shared')
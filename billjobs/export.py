@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import pickle
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from django.utils.text import compress_sequence
+from .cache import bill_digest, cache_bill_pdf, get_bill_pdf, \
+        get_cached_pdf
+from .instrumentation import observe
+from .settings import billjobs_settings
+
+# number of bills fetched from database at once
+EXPORT_CHUNK_SIZE = 100
+
+# columns of the accounting export, one row per bill line
+ACCOUNTING_HEADER = (
+        'number', 'billing_date', 'first_name', 'last_name', 'is_paid',
+        'bill_amount', 'service_reference', 'service_name', 'unit_price',
+        'quantity', 'line_total', 'note')
+ACCOUNTING_FIELDS = (
+        'number', 'billing_date', 'user__first_name', 'user__last_name',
+        'isPaid', 'amount', 'billline__service__reference',
+        'billline__service__name', 'billline__service__price',
+        'billline__quantity', 'billline__total', 'billline__note')
+
+# number of csv rows sent in one chunk of a streaming response
+CSV_CHUNK_ROWS = 500
+
+# number of rows fetched from database at once by iter_values()
+VALUES_CHUNK_SIZE = 2000
+
+# columns of the email export, one row per account
+EMAIL_HEADER = ('email', 'first_name', 'last_name')
+
+
+def bill_pdf_filename(bill):
+    ''' Return the file name used when a bill pdf is downloaded '''
+    return '{}.pdf'.format(bill.number)
+
+
+def filter_export_bills(queryset, since=None, until=None, username=None,
+                        unpaid=False):
+    ''' Filter bills to export on billing date, coworker and paid status '''
+    if since is not None:
+        queryset = queryset.filter(billing_date__gte=since)
+    if until is not None:
+        queryset = queryset.filter(billing_date__lte=until)
+    if username:
+        queryset = queryset.filter(user__username=username)
+    if unpaid:
+        queryset = queryset.filter(isPaid=False)
+    return queryset
+
+
+def iter_export_bills(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    ''' Iterate over bills of a queryset by pk order, chunk by chunk
+
+        Each chunk is fetched with its user and lines so the pdf rendering
+        does not run any query, the next one starts after the last pk of
+        the previous chunk. Only one chunk is in memory at a time.
+    '''
+    queryset = (queryset
+                .select_related('user')
+                .prefetch_related('billline_set__service')
+                .order_by('pk'))
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        bills = list(chunk[:chunk_size])
+        yield from bills
+        if len(bills) < chunk_size:
+            return
+        last_pk = bills[-1].pk
+
+
+def render_pickled_bill(data):
+    ''' Render the pdf of a pickled bill, in a process of the export pool '''
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        # started by spawn rather than fork
+        django.setup()
+    from .pdf import render_bill_pdf
+    return render_bill_pdf(pickle.loads(data))
+
+
+def rendered_pdf(bill, digest, pdf):
+    ''' Return (bill, pdf) once pdf, a bytes or a future of it, is done '''
+    if isinstance(pdf, Future):
+        pdf = pdf.result()
+        observe('pdf_bytes', len(pdf))
+        cache_bill_pdf(bill.pk, digest, pdf)
+    else:
+        cache_bill_pdf(bill.pk, digest)
+    return bill, pdf
+
+
+def iter_rendered_pdfs(queryset, workers=None):
+    ''' Yield (bill, pdf) for each bill of the queryset, by pk order
+
+        Pdf are read from the pdf cache or rendered in a pool of workers
+        processes: rendering is bound by the CPU, threads would wait for
+        each other on the GIL. Bills are given pickled with their lines,
+        workers do not run any query, and the pdf cache is only read and
+        written by this process. No more than two bills per worker are
+        pending so memory does not grow with the queryset size. With one
+        worker, pdf are rendered by this process.
+    '''
+    workers = workers or billjobs_settings.PDF_EXPORT_WORKERS
+    if workers == 1:
+        for bill in iter_export_bills(queryset):
+            yield bill, get_bill_pdf(bill)[1]
+        return
+
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for bill in iter_export_bills(queryset):
+            digest = bill_digest(bill)
+            pdf = get_cached_pdf(digest)
+            if pdf is None:
+                pdf = executor.submit(render_pickled_bill, pickle.dumps(bill))
+            pending.append((bill, digest, pdf))
+            if len(pending) >= 2 * workers:
+                yield rendered_pdf(*pending.popleft())
+        while pending:
+            yield rendered_pdf(*pending.popleft())
+
+
+class ZipStream(object):
+    ''' Write only file object collecting what zipfile writes
+
+        zipfile accepts unseekable file objects, each pop() returns bytes
+        written since the previous call.
+    '''
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_bills_zip(queryset, workers=None):
+    ''' Generate a zip archive of bill pdf, one chunk of bytes per bill
+
+        Pdf are already compressed, entries are stored without compression.
+    '''
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) \
+            as archive:
+        for bill, pdf in iter_rendered_pdfs(queryset, workers):
+            archive.writestr(bill_pdf_filename(bill), pdf)
+            yield stream.pop()
+    yield stream.pop()
+
+
+def iter_accounting_rows(queryset):
+    ''' Yield one tuple per line of the bills of the queryset
+
+        Rows are read with one query joining coworkers, lines and services,
+        without creating model instances. iterator() does not cache results
+        and uses a server-side cursor on PostgreSQL. A bill without line
+        gives one row with empty line columns.
+    '''
+    return (queryset
+            .order_by('billing_date', 'pk', 'billline__pk')
+            .values_list(*ACCOUNTING_FIELDS)
+            .iterator())
+
+
+def stream_csv(header, rows, chunk_rows=CSV_CHUNK_ROWS):
+    ''' Generate a csv document, one string per chunk of rows '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_accounting_csv(queryset):
+    ''' Generate the accounting csv export of bills and their lines '''
+    return stream_csv(ACCOUNTING_HEADER, iter_accounting_rows(queryset))
+
+
+def iter_values(queryset, fields, chunk_size=VALUES_CHUNK_SIZE):
+    ''' Yield values of fields for each object of the queryset, by pk order
+
+        Objects are fetched chunk by chunk, each query starts after the last
+        pk of the previous chunk so memory and query time do not grow with
+        the queryset size.
+    '''
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list('pk', *fields)[:chunk_size])
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            return
+        last_pk = rows[-1][0]
+
+
+def stream_email_csv(queryset, compress=False):
+    ''' Generate the csv export of emails and names of user accounts
+
+        With compress, the csv is compressed with gzip and generated as bytes.
+    '''
+    chunks = stream_csv(EMAIL_HEADER, iter_values(queryset, EMAIL_HEADER))
+    if compress:
+        return compress_sequence(chunk.encode('utf-8') for chunk in chunks)
+    return chunks
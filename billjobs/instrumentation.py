@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+from .settings import billjobs_settings
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics(object):
+    ''' Count and sum of values observed in this process, by name and labels
+
+        Values are exposed as Prometheus summaries without quantiles.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.summaries = {}
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            summary = self.summaries.setdefault(key, [0, 0])
+            summary[0] += 1
+            summary[1] += value
+
+    def clear(self):
+        with self.lock:
+            self.summaries.clear()
+
+    def render(self):
+        ''' Return metrics in Prometheus text format '''
+        with self.lock:
+            summaries = sorted(
+                    (key, list(summary))
+                    for key, summary in self.summaries.items())
+        lines = []
+        last_name = None
+        for (name, labels), (count, total) in summaries:
+            if name != last_name:
+                lines.append('# TYPE billjobs_%s summary' % name)
+                last_name = name
+            labels = ','.join(
+                    '%s="%s"' % (label, escape_label(value))
+                    for label, value in labels)
+            labels = '{%s}' % labels if labels else ''
+            lines.append('billjobs_%s_count%s %d' % (name, labels, count))
+            lines.append('billjobs_%s_sum%s %r' % (name, labels, total))
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+
+class RequestValues(threading.local):
+    ''' Values observed during the request handled by this thread '''
+    values = None
+
+
+_request = RequestValues()
+
+
+def observe(name, value, **labels):
+    ''' Record a value, also in the current request log line '''
+    if not billjobs_settings.INSTRUMENTATION:
+        return
+    metrics.observe(name, value, **labels)
+    if _request.values is not None:
+        _request.values[name] = _request.values.get(name, 0) + value
+
+
+@contextmanager
+def timed(name, **labels):
+    ''' Record seconds spent in the block as the name value
+
+        The labels dict of the block can be updated inside, e.g. with the
+        status of an http request.
+    '''
+    if not billjobs_settings.INSTRUMENTATION:
+        yield labels
+        return
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+class RecordedStream(object):
+    ''' Content of a streaming response, its request is recorded at the end
+
+        The request is recorded once the content is sent, or when the
+        response is closed before, e.g. when the client went away.
+    '''
+
+    def __init__(self, content, record):
+        self.content = content
+        self.record = record
+
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+    def close(self):
+        record, self.record = self.record, None
+        if record is not None:
+            record()
+
+
+class InstrumentationMiddleware(MiddlewareMixin):
+    ''' Record duration and database queries of each request
+
+        Django does not keep executed queries unless DEBUG is True, the
+        middleware asks it to for the duration of the request. Queries are
+        reset by Django when each request starts. Streaming responses run
+        most of their queries while their content is sent, they are recorded
+        once it is. It is removed from the middleware chain when
+        BILLJOBS_INSTRUMENTATION is False.
+    '''
+
+    def __init__(self, get_response=None):
+        if not billjobs_settings.INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        super(InstrumentationMiddleware, self).__init__(get_response)
+
+    def process_request(self, request):
+        request._billjobs_start = time.perf_counter()
+        request._billjobs_debug_cursors = []
+        for connection in connections.all():
+            request._billjobs_debug_cursors.append(
+                    (connection, connection.force_debug_cursor))
+            connection.force_debug_cursor = True
+        _request.values = {}
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        request._billjobs_view = (
+                match.view_name if match and match.url_name else
+                '%s.%s' % (view_func.__module__, view_func.__name__))
+
+    def process_response(self, request, response):
+        if getattr(request, '_billjobs_start', None) is None:
+            return response
+        if response.streaming:
+            response.streaming_content = RecordedStream(
+                    response.streaming_content,
+                    lambda: self.record(request, response))
+        else:
+            self.record(request, response)
+        return response
+
+    def record(self, request, response):
+        ''' Record duration and queries of the request and log them '''
+        duration = time.perf_counter() - request._billjobs_start
+        queries = 0
+        query_time = 0.0
+        for connection, debug_cursor in request._billjobs_debug_cursors:
+            queries += len(connection.queries_log)
+            query_time += sum(
+                    float(query['time']) for query in connection.queries_log)
+            connection.force_debug_cursor = debug_cursor
+        values, _request.values = _request.values or {}, None
+
+        view = getattr(request, '_billjobs_view', 'unknown')
+        metrics.observe('request_seconds', duration, view=view,
+                        method=request.method, status=response.status_code)
+        metrics.observe('db_queries', queries, view=view)
+        metrics.observe('db_seconds', query_time, view=view)
+        logger.info(json.dumps(dict({
+            'event': 'request',
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration': round(duration, 6),
+            'db_queries': queries,
+            'db_seconds': round(query_time, 6),
+            }, **values), sort_keys=True))
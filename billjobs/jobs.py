@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import datetime
+import time
+import traceback
+from django.utils import timezone
+from .cache import bill_digest, get_bill_pdf
+from .models import Bill, PdfJob
+from .settings import billjobs_settings
+
+
+def enqueue_pdf_job(bill):
+    ''' Return a waiting job rendering this bill pdf, create it if needed '''
+    expire_pdf_jobs()
+    job = (PdfJob.objects
+           .filter(bill=bill, status__in=(PdfJob.PENDING, PdfJob.RUNNING))
+           .order_by('pk')
+           .first())
+    if job is None:
+        job = PdfJob.objects.create(bill=bill)
+    return job
+
+
+def find_done_job(bill):
+    ''' Return the last job which rendered the current bill pdf or None '''
+    return (PdfJob.objects
+            .filter(bill=bill, status=PdfJob.DONE, digest=bill_digest(bill))
+            .order_by('pk')
+            .last())
+
+
+def expire_pdf_jobs():
+    ''' Mark failed the jobs running for more than BILLJOBS_PDF_JOB_TIMEOUT
+
+        A worker stopped while rendering leaves its job running, the next
+        download of the bill then creates a new job. Return the number of
+        expired jobs.
+    '''
+    timeout = billjobs_settings.PDF_JOB_TIMEOUT
+    now = timezone.now()
+    return PdfJob.objects.filter(
+            status=PdfJob.RUNNING,
+            started_at__lt=now - datetime.timedelta(seconds=timeout)).update(
+                    status=PdfJob.FAILED, finished_at=now,
+                    error='Not finished after %s seconds' % timeout)
+
+
+def claim_next_job():
+    ''' Return the oldest pending job, marked as running, or None
+
+        A job is claimed with a conditional UPDATE, when many workers try to
+        claim the same job only one of them updates the row.
+    '''
+    expire_pdf_jobs()
+    while True:
+        pending = list(PdfJob.objects
+                       .filter(status=PdfJob.PENDING)
+                       .order_by('pk')
+                       .values_list('pk', flat=True)[:10])
+        if not pending:
+            return None
+        for pk in pending:
+            claimed = PdfJob.objects.filter(
+                    pk=pk, status=PdfJob.PENDING).update(
+                            status=PdfJob.RUNNING, started_at=timezone.now())
+            if claimed:
+                return PdfJob.objects.defer('pdf').get(pk=pk)
+
+
+def run_job(job):
+    ''' Render the pdf of a claimed job and store it in the job '''
+    try:
+        bill = (Bill.objects
+                .select_related('user')
+                .prefetch_related('billline_set__service')
+                .get(pk=job.bill_id))
+        job.digest, job.pdf = get_bill_pdf(bill)
+        job.status = PdfJob.DONE
+    except Exception:
+        job.status = PdfJob.FAILED
+        job.error = traceback.format_exc()
+    job.finished_at = timezone.now()
+    job.save(update_fields=[
+        'digest', 'pdf', 'status', 'error', 'finished_at'])
+    return job
+
+
+def work(burst=False, poll_interval=1.0, max_jobs=None):
+    ''' Run pending jobs until max_jobs, return number of jobs done
+
+        Without burst the worker waits poll_interval seconds for new jobs
+        when the queue is empty, otherwise it stops.
+    '''
+    count = 0
+    while max_jobs is None or count < max_jobs:
+        job = claim_next_job()
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        count += 1
+    return count
+
+
+def purge_pdf_jobs(days=1):
+    ''' Delete finished jobs older than days, return deleted count '''
+    limit = timezone.now() - datetime.timedelta(days=days)
+    deleted, _ = PdfJob.objects.filter(
+            status__in=(PdfJob.DONE, PdfJob.FAILED),
+            finished_at__lt=limit).delete()
+    return deleted
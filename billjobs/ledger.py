@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import datetime
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from .models import BATCH_SIZE, Bill, BillLine, LedgerEntry, \
+        bills_updated, reserve_bill_numbers, update_bill_amounts
+
+# first letter of credit note numbers, bill numbers start with F
+CREDIT_NOTE_LETTER = 'A'
+
+
+class CreditNoteError(Exception):
+    ''' A credit note can not be created for a bill '''
+
+
+@transaction.atomic
+def credit_bill(bill, lines=None, date=None):
+    ''' Create and return the credit note of lines of bill
+
+        lines are bill lines of bill, all of them by default. The credit note
+        is a bill of the same coworker with the same services, negative
+        quantities and totals. It is numbered in its own sequence, 'A' +
+        year + month + a counter. A bill is not credited more than its
+        amount.
+
+        A credit note of a whole unpaid bill cancels it, both are marked
+        paid. Otherwise the credit note is unpaid, and is the amount given
+        back to the coworker.
+    '''
+    # lock the bill, credit notes of a bill are created one at a time
+    bill = Bill.objects.select_for_update().get(pk=bill.pk)
+    if bill.is_credit_note:
+        raise CreditNoteError('%s is a credit note' % bill.number)
+    all_lines = list(bill.billline_set.order_by('pk'))
+    if lines is None:
+        lines = all_lines
+    else:
+        lines = list(lines)
+        if any(line.bill_id != bill.pk for line in lines):
+            raise CreditNoteError('Lines are not lines of %s' % bill.number)
+    if not lines:
+        raise CreditNoteError('%s has no line to credit' % bill.number)
+    credited = -(bill.credit_notes.aggregate(
+        amount=Coalesce(Sum('amount'), Decimal(0)))['amount'])
+    total = sum(line.total for line in lines)
+    if credited + total > bill.amount:
+        raise CreditNoteError('%s is already credited of %s' % (
+            bill.number, credited))
+
+    cancelled = (not bill.isPaid and not credited and
+                 len(lines) == len(all_lines))
+    date = date or datetime.date.today()
+    credit_note = Bill.objects.create(
+            user_id=bill.user_id,
+            number=reserve_bill_numbers(1, date, CREDIT_NOTE_LETTER)[0],
+            credited_bill=bill,
+            issuer_address=bill.issuer_address,
+            billing_address=bill.billing_address)
+    BillLine.objects.bulk_create(
+            BillLine(bill=credit_note, service_id=line.service_id,
+                     quantity=-line.quantity, total=-line.total,
+                     note=line.note)
+            for line in lines)
+    # bulk_create does not send post_save
+    update_bill_amounts(credit_note.pk)
+    if cancelled:
+        Bill.objects.filter(pk__in=(bill.pk, credit_note.pk)).update(
+                isPaid=True)
+        bills_updated(bill.pk, credit_note.pk)
+    return Bill.objects.get(pk=credit_note.pk)
+
+
+def replay_ledger(bill_model=Bill, entry_model=LedgerEntry,
+                  batch_size=BATCH_SIZE):
+    ''' Append ledger entries of every bill, return the number of entries
+
+        Bills are read one by one ordered by date, with their amount summed
+        from their lines, and entries are inserted by batches, so memory only
+        grows with the number of coworkers. A bill gives a billed entry and
+        a paid entry if it is paid. The ledger must be empty. Models are
+        arguments for data migrations.
+    '''
+    bills = (bill_model.objects
+             .order_by('billing_date', 'pk')
+             .values_list('pk', 'user_id', 'number', 'isPaid')
+             .annotate(lines_amount=Coalesce(Sum('billline__total'),
+                                             Decimal(0)))
+             .iterator())
+    balances = {}
+    batch = []
+    count = 0
+    for bill_id, user_id, number, is_paid, amount in bills:
+        # kinds are values, models of data migrations have no constants
+        entries = []
+        if amount:
+            entries.append(('billed', False, amount))
+        if is_paid:
+            entries.append(('paid', True, -amount))
+        for kind, entry_paid, change in entries:
+            balance = balances.get(user_id, Decimal(0)) + change
+            balances[user_id] = balance
+            batch.append(entry_model(
+                bill_id=bill_id, user_id=user_id, bill_number=number,
+                kind=kind, bill_amount=amount, is_paid=entry_paid,
+                amount=change, balance=balance))
+        if len(batch) >= batch_size:
+            entry_model.objects.bulk_create(batch)
+            count += len(batch)
+            batch = []
+    entry_model.objects.bulk_create(batch)
+    return count + len(batch)
+
+
+def rebuild_ledger(batch_size=BATCH_SIZE):
+    ''' Replace every ledger entry, return number of entries
+
+        Signals and bills_updated() keep the ledger up to date, rebuild it
+        after changing bills or lines without them, e.g. with raw SQL. The
+        history of changes is lost, each bill gets the entries of its
+        current state.
+    '''
+    with transaction.atomic():
+        # queryset delete does not call LedgerEntry.delete()
+        LedgerEntry.objects.all().delete()
+        return replay_ledger(batch_size=batch_size)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from .settings import billjobs_settings
+from .export import bill_pdf_filename, iter_rendered_pdfs
+
+
+def invoice_message(bill, pdf):
+    ''' Return the email of a bill to its coworker, with the pdf attached '''
+    context = {'bill': bill}
+    subject = render_to_string(
+            'billjobs/invoice_email_subject.txt', context).strip()
+    message = EmailMessage(
+            subject,
+            render_to_string('billjobs/invoice_email.txt', context),
+            billjobs_settings.INVOICE_EMAIL_FROM,
+            [bill.user.email])
+    message.attach(bill_pdf_filename(bill), pdf, 'application/pdf')
+    return message
+
+
+def send_invoices(queryset, connection=None, batch_size=None, workers=None):
+    ''' Send each bill of queryset by email to its coworker
+
+        Pdf are rendered by iter_rendered_pdfs() processes while a sending
+        thread gives batches of messages to the email backend, over one
+        connection opened for all of them. Only one batch waits for the
+        sending thread, so memory does not grow with the queryset size.
+        Return (number of emails sent, bills without email).
+    '''
+    batch_size = batch_size or billjobs_settings.INVOICE_EMAIL_BATCH_SIZE
+    connection = connection or get_connection()
+    skipped = list(queryset.filter(user__email='').select_related('user'))
+    sent = 0
+    batch = []
+    pending = None
+    with connection, ThreadPoolExecutor(max_workers=1) as sender:
+        for bill, pdf in iter_rendered_pdfs(
+                queryset.exclude(user__email=''), workers):
+            batch.append(invoice_message(bill, pdf))
+            if len(batch) >= batch_size:
+                if pending is not None:
+                    sent += pending.result()
+                pending = sender.submit(connection.send_messages, batch)
+                batch = []
+        if pending is not None:
+            sent += pending.result()
+        if batch:
+            sent += connection.send_messages(batch)
+    return sent, skipped
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from billjobs.totals import audit_bill_totals, fix_bill_totals
+
+
+class Command(BaseCommand):
+    help = 'Check every bill amount is the sum of its lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                '--fix', action='store_true',
+                help='Set wrong bill amounts to the sum of their lines')
+
+    def handle(self, *args, **options):
+        wrong_ids = []
+        for pk, number, amount, lines_total in audit_bill_totals():
+            wrong_ids.append(pk)
+            self.stdout.write('%s: amount %s, lines total %s' % (
+                number, amount, lines_total))
+        if options['fix']:
+            fix_bill_totals(wrong_ids)
+            self.stdout.write('%d bill amounts fixed' % len(wrong_ids))
+        else:
+            self.stdout.write('%d wrong bill amounts' % len(wrong_ids))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from billjobs.export import filter_export_bills, stream_accounting_csv
+from billjobs.models import Bill
+from .export_bills_pdf import parse_date
+
+
+class Command(BaseCommand):
+    help = 'Write bills and their lines in one csv file for accounting'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                'output', help='Path of the csv file, - for standard output')
+        parser.add_argument(
+                '--since', help='Only bills billed this day or after')
+        parser.add_argument(
+                '--until', help='Only bills billed this day or before')
+        parser.add_argument('--user', help='Only bills of this username')
+        parser.add_argument(
+                '--unpaid', action='store_true', help='Only unpaid bills')
+
+    def handle(self, *args, **options):
+        queryset = filter_export_bills(
+                Bill.objects.all(),
+                since=options['since'] and parse_date(options['since']),
+                until=options['until'] and parse_date(options['until']),
+                username=options['user'],
+                unpaid=options['unpaid'])
+
+        if options['output'] == '-':
+            for chunk in stream_accounting_csv(queryset):
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='') as output:
+            for chunk in stream_accounting_csv(queryset):
+                output.write(chunk)
+        self.stdout.write('Bills written to %s' % options['output'])
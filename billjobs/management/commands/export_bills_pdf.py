@@ -0,0 +1,42 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from billjobs.export import filter_export_bills, stream_bills_zip
+from billjobs.models import Bill
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError('Date must be in YYYY-MM-DD format: %s' % value)
+
+
+class Command(BaseCommand):
+    help = 'Write pdf of many bills in one zip archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the zip archive')
+        parser.add_argument(
+                '--since', help='Only bills billed this day or after')
+        parser.add_argument(
+                '--until', help='Only bills billed this day or before')
+        parser.add_argument('--user', help='Only bills of this username')
+        parser.add_argument(
+                '--unpaid', action='store_true', help='Only unpaid bills')
+        parser.add_argument(
+                '--workers', type=int, help='Number of rendering processes')
+
+    def handle(self, *args, **options):
+        queryset = filter_export_bills(
+                Bill.objects.all(),
+                since=options['since'] and parse_date(options['since']),
+                until=options['until'] and parse_date(options['until']),
+                username=options['user'],
+                unpaid=options['unpaid'])
+
+        count = queryset.count()
+        with open(options['output'], 'wb') as archive:
+            for chunk in stream_bills_zip(queryset, options['workers']):
+                archive.write(chunk)
+        self.stdout.write('%d bills written to %s' % (
+            count, options['output']))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from billjobs.recurring import due_subscriptions, generate_subscription_bills
+
+
+class Command(BaseCommand):
+    help = 'Create this month bills of coworkers subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                '--force', action='store_true',
+                help='Bill again subscriptions already billed this month')
+        parser.add_argument(
+                '--dry-run', action='store_true',
+                help='Only display how many subscriptions are due')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            subscriptions = due_subscriptions(force=options['force'])
+            self.stdout.write('%d subscriptions of %d coworkers are due' % (
+                subscriptions.count(),
+                subscriptions.values('user').distinct().count()))
+            return
+        count = generate_subscription_bills(force=options['force'])
+        self.stdout.write('%d bills created' % count)
@@ -0,0 +1,52 @@
+import multiprocessing
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from billjobs.jobs import purge_pdf_jobs, work
+
+
+def run_worker(arguments):
+    # each process opens its own database connection
+    connections.close_all()
+    burst, poll_interval, max_jobs = arguments
+    return work(burst=burst, poll_interval=poll_interval, max_jobs=max_jobs)
+
+
+class Command(BaseCommand):
+    help = 'Render pdf of bills downloaded when BILLJOBS_PDF_ASYNC is True'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                '--processes', type=int, default=1,
+                help='Number of worker processes')
+        parser.add_argument(
+                '--burst', action='store_true',
+                help='Stop when there is no pending job')
+        parser.add_argument(
+                '--poll-interval', type=float, default=1.0,
+                help='Seconds to wait for new jobs when the queue is empty')
+        parser.add_argument(
+                '--max-jobs', type=int,
+                help='Stop each process after this number of jobs')
+        parser.add_argument(
+                '--purge-days', type=int,
+                help='First delete jobs finished more than this days ago')
+
+    def handle(self, *args, **options):
+        if options['purge_days'] is not None:
+            deleted = purge_pdf_jobs(options['purge_days'])
+            self.stdout.write('%d old jobs deleted' % deleted)
+
+        arguments = (options['burst'], options['poll_interval'],
+                     options['max_jobs'])
+        start = time.perf_counter()
+        if options['processes'] > 1:
+            connections.close_all()
+            with multiprocessing.Pool(options['processes']) as pool:
+                count = sum(pool.map(
+                    run_worker, [arguments] * options['processes']))
+        else:
+            count = work(*arguments)
+        duration = time.perf_counter() - start
+        self.stdout.write('%d jobs in %.2fs, %.1f jobs/s' % (
+            count, duration, count / duration if duration else 0))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from billjobs.ledger import rebuild_ledger
+from billjobs.models import BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Replace every ledger entry by the entries of current bills'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                '--batch-size', type=int, default=BATCH_SIZE,
+                help='Number of entries inserted at once')
+
+    def handle(self, *args, **options):
+        count = rebuild_ledger(options['batch_size'])
+        self.stdout.write('%d ledger entries written' % count)
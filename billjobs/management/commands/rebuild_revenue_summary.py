@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from billjobs.reporting import rebuild_revenue_summary
+
+
+class Command(BaseCommand):
+    help = 'Compute again every revenue summary row from bill lines'
+
+    def handle(self, *args, **options):
+        count = rebuild_revenue_summary()
+        self.stdout.write('%d revenue summary rows written' % count)
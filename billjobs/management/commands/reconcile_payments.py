@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from billjobs.reconciliation import STATEMENT_FORMATS, StatementError, \
+        mark_bills_paid, parse_statement, reconcile, statement_format
+
+
+class Command(BaseCommand):
+    help = 'Mark bills paid by the credits of a bank statement'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                'statement', help='Path of a csv, OFX or CAMT.053 file')
+        parser.add_argument(
+                '--format', choices=STATEMENT_FORMATS,
+                help='Statement format, guessed from the file extension '
+                     'if not given')
+        parser.add_argument(
+                '--encoding', help='Encoding of csv and OFX statements')
+        parser.add_argument(
+                '--dry-run', action='store_true',
+                help='Show matched bills without marking them paid')
+
+    def handle(self, *args, **options):
+        path = options['statement']
+        try:
+            with open(path, 'rb') as stream:
+                matches, rejects = reconcile(parse_statement(
+                    stream, options['format'] or statement_format(path),
+                    options['encoding']))
+        except (OSError, StatementError) as error:
+            raise CommandError(error)
+
+        for payment, reason in rejects:
+            self.stdout.write('Not matched: %s %s %s (%s)' % (
+                payment.date, payment.amount, payment.label, reason))
+        if options['dry_run']:
+            self.stdout.write('%d bills would be marked paid' % len(matches))
+            return
+        count = mark_bills_paid(bill_id for payment, bill_id, reason
+                                in matches)
+        self.stdout.write('%d bills marked paid, %d payments not matched' % (
+            count, len(rejects)))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from billjobs.seed import is_seeded, seed_bills
+
+
+class Command(BaseCommand):
+    help = 'Create coworkers, services and bills to measure performances'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--services', type=int, default=10)
+        parser.add_argument('--bills', type=int, default=1000)
+        parser.add_argument(
+                '--lines', type=int, default=5, help='Lines of each bill')
+        parser.add_argument(
+                '--months', type=int, default=36,
+                help='Bills are spread over this number of last months')
+        parser.add_argument(
+                '--seed', type=int, default=0, help='Seed of random values')
+
+    def handle(self, *args, **options):
+        if is_seeded():
+            raise CommandError('Database is already seeded')
+        if not 0 < options['services'] <= 1000:
+            raise CommandError('Services must be between 1 and 1000')
+        if options['users'] < 1:
+            raise CommandError('Users must be at least 1')
+        count = seed_bills(
+                users=options['users'], services=options['services'],
+                bills=options['bills'], lines=options['lines'],
+                months=options['months'], seed=options['seed'])
+        self.stdout.write('%d bills created' % count)
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from billjobs.export import filter_export_bills
+from billjobs.mailing import send_invoices
+from billjobs.models import Bill
+from .export_bills_pdf import parse_date
+
+
+class Command(BaseCommand):
+    help = 'Send pdf of bills to their coworker by email'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+                '--since', help='Only bills billed this day or after')
+        parser.add_argument(
+                '--until', help='Only bills billed this day or before')
+        parser.add_argument('--user', help='Only bills of this username')
+        parser.add_argument(
+                '--unpaid', action='store_true', help='Only unpaid bills')
+        parser.add_argument(
+                '--batch-size', type=int,
+                help='Number of emails given at once to the email backend')
+        parser.add_argument(
+                '--workers', type=int, help='Number of rendering processes')
+
+    def handle(self, *args, **options):
+        queryset = filter_export_bills(
+                Bill.objects.all(),
+                since=options['since'] and parse_date(options['since']),
+                until=options['until'] and parse_date(options['until']),
+                username=options['user'],
+                unpaid=options['unpaid'])
+
+        sent, skipped = send_invoices(
+                queryset, batch_size=options['batch_size'],
+                workers=options['workers'])
+        for bill in skipped:
+            self.stdout.write('%s not sent, %s has no email' % (
+                bill.number, bill.user.username))
+        self.stdout.write('%d bills sent by email' % sent)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 13:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F, Func, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def round_cents(expression):
+    ''' SQL rounding of expression to 2 decimal places '''
+    return Func(expression, Value(2), function='ROUND',
+                output_field=models.DecimalField())
+
+
+def compute_bill_amounts(apps, schema_editor):
+    ''' Data migration rounding prices and line totals to cents
+
+    AlterField keeps float values on sqlite. Bill amount is then the rounded
+    sum of rounded line totals.
+    '''
+    Bill = apps.get_model('billjobs', 'Bill')
+    BillLine = apps.get_model('billjobs', 'BillLine')
+    Service = apps.get_model('billjobs', 'Service')
+    Service.objects.update(price=round_cents(F('price')))
+    BillLine.objects.update(total=round_cents(F('total')))
+    lines_total = (BillLine.objects
+                   .filter(bill=OuterRef('pk'))
+                   .order_by()
+                   .values('bill')
+                   .annotate(amount=Sum('total'))
+                   .values('amount'))
+    Bill.objects.update(amount=round_cents(Coalesce(
+        Subquery(lines_total, output_field=models.DecimalField()), 0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billjobs', '0011_bill_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bill',
+            name='amount',
+            field=models.DecimalField(blank=True, decimal_places=2, default=0, help_text='The amount is computed automatically.', max_digits=10, verbose_name='Bill total amount'),
+        ),
+        migrations.AlterField(
+            model_name='billline',
+            name='total',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='This value is computed automatically', max_digits=10, verbose_name='Total'),
+        ),
+        migrations.AlterField(
+            model_name='service',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Price'),
+        ),
+        migrations.RunPython(compute_bill_amounts, migrations.RunPython.noop),
+    ]
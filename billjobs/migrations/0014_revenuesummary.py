@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 13:30
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def compute_revenue_summary(apps, schema_editor):
+    ''' Data migration summarize existing bill lines '''
+    BillLine = apps.get_model('billjobs', 'BillLine')
+    RevenueSummary = apps.get_model('billjobs', 'RevenueSummary')
+    rows = (BillLine.objects
+            .annotate(month=TruncMonth('bill__billing_date'))
+            .order_by()
+            .values_list('month', 'bill__user_id', 'service_id',
+                         'bill__isPaid')
+            .annotate(Sum('quantity'), Sum('total')))
+    RevenueSummary.objects.bulk_create(
+            RevenueSummary(month=month, user_id=user_id,
+                           service_id=service_id, is_paid=is_paid,
+                           quantity=quantity, amount=amount)
+            for month, user_id, service_id, is_paid, quantity, amount
+            in rows.iterator())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('billjobs', '0013_pdfjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Month')),
+                ('is_paid', models.BooleanField(default=False, verbose_name='Paid')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Quantity')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Amount')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='billjobs.Service', verbose_name='Service')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Coworker')),
+            ],
+            options={
+                'verbose_name': 'Revenue Summary',
+                'verbose_name_plural': 'Revenue Summaries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='revenuesummary',
+            index=models.Index(fields=['month', 'user'], name='billjobs_summary_month_idx'),
+        ),
+        migrations.RunPython(compute_revenue_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 14:05
+from __future__ import unicode_literals
+
+import billjobs.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billjobs', '0014_revenuesummary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bill',
+            name='issuer_address',
+            field=models.CharField(default=billjobs.models.bill_issuer, max_length=1024),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 14:18
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def replay_ledger(apps, schema_editor):
+    ''' Data migration give existing bills their ledger entries '''
+    from billjobs.ledger import replay_ledger
+    replay_ledger(apps.get_model('billjobs', 'Bill'),
+                  apps.get_model('billjobs', 'LedgerEntry'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('billjobs', '0015_bill_issuer_callable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bill_number', models.CharField(max_length=16, verbose_name='Bill number')),
+                ('kind', models.CharField(choices=[('billed', 'Billed'), ('paid', 'Paid'), ('unpaid', 'Unpaid'), ('moved', 'Moved'), ('deleted', 'Deleted')], max_length=8, verbose_name='Kind')),
+                ('bill_amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Bill total amount')),
+                ('is_paid', models.BooleanField(default=False, verbose_name='Paid')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Amount')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Balance')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Date')),
+            ],
+            options={
+                'verbose_name': 'Ledger Entry',
+                'verbose_name_plural': 'Ledger Entries',
+            },
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='credited_bill',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Set on credit notes, the bill they credit.', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='credit_notes', to='billjobs.Bill', verbose_name='Credited bill'),
+        ),
+        migrations.AddField(
+            model_name='ledgerentry',
+            name='bill',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='billjobs.Bill', verbose_name='Bill'),
+        ),
+        migrations.AddField(
+            model_name='ledgerentry',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Coworker'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['user', 'id'], name='billjobs_ledger_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['bill', 'id'], name='billjobs_ledger_bill_idx'),
+        ),
+        migrations.RunPython(replay_ledger, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,32 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from django.db.models.signals import pre_save, post_save, post_delete
+from django.db.models import F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.core.signals import setting_changed
+from django.db.models.signals import pre_save, post_save, pre_delete, \
+        post_delete, post_init
 from django.utils.translation import ugettext_lazy as _
-from .settings import BILLJOBS_BILL_ISSUER
+from .settings import billjobs_settings
+from .cache import invalidate_bill_pdf, invalidate_api_cache, \
+        invalidate_shared_api_cache
+from contextlib import contextmanager
+from decimal import Decimal
 import datetime
+import threading
+
+# sqlite does not accept more than 999 parameters in one query
+BATCH_SIZE = 500
+
+
+def chunks(values, size=BATCH_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start+size]
+
+
+def bill_issuer():
+    ''' Issuer address of new bills, read when a bill is created '''
+    return billjobs_settings.BILL_ISSUER
 
 
 class Bill(models.Model):
@@ -24,7 +46,9 @@ class Bill(models.Model):
             auto_now_add=True,
             verbose_name=_('Date'),
             help_text=_('This value is set automatically.'))
-    amount = models.FloatField(
+    amount = models.DecimalField(
+            max_digits=10,
+            decimal_places=2,
             blank=True,
             default=0,
             verbose_name=_('Bill total amount'),
@@ -32,18 +56,42 @@ class Bill(models.Model):
     issuer_address = models.CharField(
             max_length=1024,
             blank=False,
-            default=BILLJOBS_BILL_ISSUER)
+            default=bill_issuer)
     billing_address = models.CharField(max_length=1024, blank=True)
+    credited_bill = models.ForeignKey(
+            'self',
+            on_delete=models.PROTECT,
+            null=True,
+            blank=True,
+            editable=False,
+            related_name='credit_notes',
+            verbose_name=_('Credited bill'),
+            help_text=_('Set on credit notes, the bill they credit.'))
 
     def __str__(self):
         return self.number
 
+    @property
+    def is_credit_note(self):
+        return self.credited_bill_id is not None
+
     def coworker_name(self):
         return '%s %s' % (self.user.first_name, self.user.last_name)
     coworker_name.short_description = _('Coworker name')
 
     class Meta:
         verbose_name = _('Bill')
+        indexes = [
+                # coworker history ordered by date
+                models.Index(fields=['user', 'billing_date'],
+                             name='billjobs_bill_user_date_idx'),
+                # period reports
+                models.Index(fields=['billing_date'],
+                             name='billjobs_bill_date_idx'),
+                # admin isPaid filter and unpaid bills by date
+                models.Index(fields=['isPaid', 'billing_date'],
+                             name='billjobs_bill_paid_date_idx'),
+                ]
 
     def save(self, *args, **kwargs):
         if not self.billing_address:
@@ -59,7 +107,10 @@ class Service(models.Model):
             max_length=256,
             verbose_name=_('Description'),
             help_text=_('Write service description limited to 256 characters'))
-    price = models.FloatField(verbose_name=_('Price'))
+    price = models.DecimalField(
+            max_digits=10,
+            decimal_places=2,
+            verbose_name=_('Price'))
     is_available = models.BooleanField(
             verbose_name=_('Is available ?'),
             default=True)
@@ -77,7 +128,9 @@ class BillLine(models.Model):
     bill = models.ForeignKey(Bill)
     service = models.ForeignKey(Service)
     quantity = models.SmallIntegerField(default=1, verbose_name=_('Quantity'))
-    total = models.FloatField(
+    total = models.DecimalField(
+            max_digits=10,
+            decimal_places=2,
             blank=True,
             help_text=_('This value is computed automatically'),
             verbose_name=_('Total'))
@@ -93,6 +146,178 @@ class BillLine(models.Model):
         verbose_name_plural = _('Bill Lines')
 
 
+class Subscription(models.Model):
+    """ Service billed to a coworker every month """
+    user = models.ForeignKey(User, verbose_name=_('Coworker'))
+    service = models.ForeignKey(Service, verbose_name=_('Service'))
+    quantity = models.SmallIntegerField(default=1, verbose_name=_('Quantity'))
+    note = models.CharField(
+            max_length=1024,
+            verbose_name=_('Note'),
+            blank=True,
+            help_text=_('Write a simple note which will be added in your bill')
+            )
+    is_active = models.BooleanField(
+            default=True,
+            verbose_name=_('Is active ?'))
+    last_billing_date = models.DateField(
+            null=True,
+            blank=True,
+            editable=False,
+            verbose_name=_('Last billing date'))
+
+    def __str__(self):
+        return '%s - %s' % (self.user, self.service)
+
+    class Meta:
+        verbose_name = _('Subscription')
+        verbose_name_plural = _('Subscriptions')
+
+
+class PdfJob(models.Model):
+    """ Bill pdf rendered by a worker process, outside of the request """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+            (PENDING, _('Pending')),
+            (RUNNING, _('Running')),
+            (DONE, _('Done')),
+            (FAILED, _('Failed')),
+            )
+
+    bill = models.ForeignKey(Bill, verbose_name=_('Bill'))
+    status = models.CharField(
+            max_length=8,
+            choices=STATUS_CHOICES,
+            default=PENDING,
+            db_index=True,
+            verbose_name=_('Status'))
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    digest = models.CharField(max_length=64, blank=True)
+    pdf = models.BinaryField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return '%s %s' % (self.bill_id, self.status)
+
+    class Meta:
+        verbose_name = _('Pdf Job')
+        verbose_name_plural = _('Pdf Jobs')
+
+
+class BillSequence(models.Model):
+    """ Last number given to a bill for one prefix, e.g. F201803 """
+    prefix = models.CharField(max_length=8, unique=True)
+    last_value = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '%s%03d' % (self.prefix, self.last_value)
+
+    class Meta:
+        verbose_name = _('Bill Sequence')
+        verbose_name_plural = _('Bill Sequences')
+
+
+class RevenueSummary(models.Model):
+    """ Amount billed to a coworker for a service in one month
+
+        Rows of a coworker and a month are computed again from bill lines
+        each time one of these bills changes, reports read them instead of
+        scanning every bill line.
+    """
+    month = models.DateField(verbose_name=_('Month'))
+    user = models.ForeignKey(User, verbose_name=_('Coworker'))
+    service = models.ForeignKey(Service, verbose_name=_('Service'))
+    is_paid = models.BooleanField(default=False, verbose_name=_('Paid'))
+    quantity = models.IntegerField(default=0, verbose_name=_('Quantity'))
+    amount = models.DecimalField(
+            max_digits=12, decimal_places=2, default=0,
+            verbose_name=_('Amount'))
+
+    def __str__(self):
+        return '%s %s %s' % (self.month, self.user_id, self.service_id)
+
+    class Meta:
+        verbose_name = _('Revenue Summary')
+        verbose_name_plural = _('Revenue Summaries')
+        indexes = [
+                models.Index(fields=['month', 'user'],
+                             name='billjobs_summary_month_idx'),
+                ]
+
+
+class LedgerEntry(models.Model):
+    """ Change of the amount a coworker owes, entries are never changed
+
+        An entry is appended for each change of a bill amount, paid status,
+        coworker or deletion. amount is the change of the coworker balance,
+        the sum of amounts of unpaid bills, and balance is the balance after
+        the entry. bill_amount and is_paid are the bill state after the
+        entry, the last entry of a bill tells what the ledger knows of it.
+    """
+    BILLED = 'billed'
+    PAID = 'paid'
+    UNPAID = 'unpaid'
+    MOVED = 'moved'
+    DELETED = 'deleted'
+    KIND_CHOICES = (
+            (BILLED, _('Billed')),
+            (PAID, _('Paid')),
+            (UNPAID, _('Unpaid')),
+            (MOVED, _('Moved')),
+            (DELETED, _('Deleted')),
+            )
+
+    # entries outlive their bill and coworker, they are never updated
+    user = models.ForeignKey(
+            User, on_delete=models.DO_NOTHING, db_constraint=False,
+            db_index=False, related_name='+', verbose_name=_('Coworker'))
+    bill = models.ForeignKey(
+            Bill, on_delete=models.DO_NOTHING, db_constraint=False,
+            db_index=False, related_name='+', verbose_name=_('Bill'))
+    bill_number = models.CharField(
+            max_length=16, verbose_name=_('Bill number'))
+    kind = models.CharField(
+            max_length=8, choices=KIND_CHOICES, verbose_name=_('Kind'))
+    bill_amount = models.DecimalField(
+            max_digits=10, decimal_places=2,
+            verbose_name=_('Bill total amount'))
+    is_paid = models.BooleanField(default=False, verbose_name=_('Paid'))
+    amount = models.DecimalField(
+            max_digits=12, decimal_places=2, verbose_name=_('Amount'))
+    balance = models.DecimalField(
+            max_digits=12, decimal_places=2, verbose_name=_('Balance'))
+    created_at = models.DateTimeField(
+            auto_now_add=True, verbose_name=_('Date'))
+
+    def __str__(self):
+        return '%s %s %s' % (self.bill_number, self.kind, self.amount)
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Ledger entries can not be changed')
+        super(LedgerEntry, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Ledger entries can not be deleted')
+
+    class Meta:
+        verbose_name = _('Ledger Entry')
+        verbose_name_plural = _('Ledger Entries')
+        indexes = [
+                # last entry of a coworker gives its balance
+                models.Index(fields=['user', 'id'],
+                             name='billjobs_ledger_user_idx'),
+                # last entry of a bill gives what the ledger knows of it
+                models.Index(fields=['bill', 'id'],
+                             name='billjobs_ledger_bill_idx'),
+                ]
+
+
 class UserProfile(models.Model):
     """ extend User class """
     user = models.OneToOneField(User)
@@ -112,24 +337,57 @@ def compute_total(sender, instance, **kwargs):
             instance.total = instance.service.price * instance.quantity
 
 
+def reserve_bill_numbers(count=1, date=None, letter='F'):
+    """ Return a list of count consecutive bill numbers for date month
+
+        Numbers are letter + year + month + a counter starting at 001 each
+        month, letter is 'F' for bills and 'A' for credit notes.
+        The counter row is incremented in one UPDATE which locks it until the
+        end of the transaction, so concurrent callers never get the same
+        number.
+    """
+    date = date or datetime.date.today()
+    prefix = '%s%s' % (letter, date.strftime('%Y%m'))
+    with transaction.atomic():
+        updated = BillSequence.objects.filter(prefix=prefix).update(
+                last_value=F('last_value') + count)
+        if not updated:
+            try:
+                # savepoint, another transaction may create it at the same time
+                with transaction.atomic():
+                    BillSequence.objects.create(
+                            prefix=prefix,
+                            last_value=last_bill_number(prefix) + count)
+            except IntegrityError:
+                BillSequence.objects.filter(prefix=prefix).update(
+                        last_value=F('last_value') + count)
+        last_value = BillSequence.objects.values_list(
+                'last_value', flat=True).get(prefix=prefix)
+    return ['%s%03d' % (prefix, value)
+            for value in range(last_value - count + 1, last_value + 1)]
+
+
+def last_bill_number(prefix):
+    """ Return the highest counter of existing bills numbered with prefix
+
+        Only used to start a sequence, bills may have been numbered before
+        sequences exist.
+    """
+    counters = [0]
+    for number in Bill.objects.filter(number__startswith=prefix).values_list(
+            'number', flat=True):
+        if number[len(prefix):].isdigit():
+            counters.append(int(number[len(prefix):]))
+    return max(counters)
+
+
 @receiver(pre_save, sender=Bill)
 def define_number(sender, instance, **kwargs):
     """ set bill number incrementally """
 
     # only when we create record for the first time
     if not instance.number:
-        today = datetime.date.today()
-        # get last id in base, we assume it's the last record
-        try:
-            last_record = sender.objects.latest('id')
-            # get last bill number and increment it
-            # add 00 for padding if less than 999
-            last_num = '%03d' % (int(last_record.number[7:])+1)
-        # no Bill in db
-        except sender.DoesNotExist:
-            last_num = '001'
-
-        instance.number = 'F%s%s' % (today.strftime('%Y%m'), last_num)
+        instance.number = reserve_bill_numbers()[0]
 
 
 @receiver(pre_save, sender=Bill)
@@ -147,16 +405,365 @@ def bill_billLine_post_save_and_delete(sender, instance, **kwargs):
         When admin modify or delete a BillLine, Bill instance has no change, so
         the pre_save is not called and total amount is not computed.
     """
-    set_bill_amount(sender, instance.bill, **kwargs)
+    set_bill_amount(sender, instance, **kwargs)
+
+
+@receiver(post_save, sender=Bill)
+@receiver(post_delete, sender=Bill)
+def bill_post_save_and_delete(sender, instance, **kwargs):
+    """ Cached pdf and api responses are outdated when the bill changes """
+    invalidate_bill_pdf(instance.pk)
+    invalidate_api_cache(instance.user_id)
+    record_ledger(instance.pk)
+
+
+@receiver(pre_delete, sender=Bill)
+def bill_pre_delete(sender, instance, **kwargs):
+    """ Lines deleted with their bill do not change its amount
+
+        Otherwise each line would update the bill, its revenue summary and
+        append a ledger entry before the bill is deleted.
+    """
+    _deferred.deleted_bill_ids = _deferred.deleted_bill_ids | {instance.pk}
+
+
+@receiver(post_delete, sender=Bill)
+def bill_post_delete(sender, instance, **kwargs):
+    # lines are deleted before their bill
+    _deferred.deleted_bill_ids = _deferred.deleted_bill_ids - {instance.pk}
+
+
+@receiver(post_init, sender=Bill)
+def bill_post_init(sender, instance, **kwargs):
+    """ Remember what a bill is summarized by, to see if a save changes it """
+    instance._summary_state = bill_summary_state(instance)
+
+
+@receiver(post_save, sender=Bill)
+def bill_post_save_summary(sender, instance, created, **kwargs):
+    """ Move bill lines in revenue summary when date, coworker or paid change
+
+        A new bill has no line yet, lines update the summary when saved.
+    """
+    state = bill_summary_state(instance)
+    if not created and state != instance._summary_state:
+        refresh_revenue_summary(
+                summary_key(*instance._summary_state[:2]),
+                summary_key(*state[:2]))
+        if instance._summary_state[1] is not None:
+            # the bill is not in api responses of its old coworker anymore
+            invalidate_api_cache(instance._summary_state[1])
+    instance._summary_state = state
+
+
+@receiver(post_delete, sender=Bill)
+def bill_post_delete_summary(sender, instance, **kwargs):
+    refresh_revenue_summary(summary_key(instance.billing_date,
+                                        instance.user_id))
+
+
+@receiver(post_save, sender=User)
+def user_post_save(sender, instance, created, update_fields=None, **kwargs):
+    """ Coworker name is printed on each bill pdf and sent by the api
+
+        Login only updates last_login, it does not change anything shown.
+    """
+    if created or (update_fields is not None and not
+                   {'first_name', 'last_name', 'email'} & set(update_fields)):
+        return
+    invalidate_api_cache(instance.pk)
+    invalidate_bill_pdf(*instance.bill_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Service)
+def service_post_save(sender, instance, **kwargs):
+    """ Service name, description and price are printed on bill pdf """
+    invalidate_bill_pdf(*BillLine.objects.filter(service=instance)
+                        .values_list('bill_id', flat=True).distinct())
+    invalidate_shared_api_cache()
+
+
+@receiver(post_delete, sender=Service)
+def service_post_delete(sender, instance, **kwargs):
+    invalidate_shared_api_cache()
+
+
+def available_services():
+    """ Return a tuple of available services, read with one query
+
+        Services are read again for each page, a formset reads them once for
+        all its forms. Keeping them in the process would hide a service added
+        by another process.
+    """
+    return tuple(Service.objects.filter(is_available=True))
+
+
+@receiver(setting_changed)
+def reload_settings(sender, setting, **kwargs):
+    """ Read billjobs settings again, e.g. when a test overrides one """
+    if billjobs_settings.is_billjobs_setting(setting):
+        billjobs_settings.reload()
+
+
+@receiver(post_save, sender=UserProfile)
+def userprofile_post_save(sender, instance, **kwargs):
+    """ Billing address is sent by the api """
+    invalidate_api_cache(instance.user_id)
 
 
 def set_bill_amount(sender, instance, **kwargs):
-    """ set total price of billing when saving """
-    # reset self.amount in case is already set
-    bill = instance
-    bill.amount = 0
-    for line in bill.billline_set.all():
-        bill.amount += line.total
-
-    if sender is not Bill:
-        bill.save()
+    """ set total price of billing when saving
+
+        A Bill being saved gets the sum of its lines, computed by the
+        database. A BillLine change updates the amount of its bill with one
+        UPDATE statement, the line.bill instance in memory is not refreshed.
+    """
+    if sender is Bill:
+        bill = instance
+        if bill.pk is None:
+            bill.amount = 0
+        else:
+            bill.amount = BillLine.objects.filter(bill=bill).aggregate(
+                    amount=Sum('total'))['amount'] or 0
+    elif instance.bill_id in _deferred.deleted_bill_ids:
+        # post_delete of the bill updates summary, caches and ledger
+        return
+    elif _deferred.bill_ids is not None:
+        _deferred.bill_ids.add(instance.bill_id)
+    else:
+        update_bill_amounts(instance.bill_id)
+
+
+def update_bill_amounts(*bill_ids):
+    """ Set amount of bills to the sum of their lines in one UPDATE """
+    if not bill_ids:
+        return
+    lines_total = (BillLine.objects
+                   .filter(bill=OuterRef('pk'))
+                   .order_by()
+                   .values('bill')
+                   .annotate(amount=Sum('total'))
+                   .values('amount'))
+    Bill.objects.filter(pk__in=bill_ids).update(amount=Coalesce(
+        Subquery(lines_total, output_field=models.DecimalField()), 0))
+    # update() does not send post_save
+    bills_updated(*bill_ids)
+
+
+def bill_summary_state(bill):
+    """ Return (billing date, user id, paid) of a bill, None if not loaded """
+    # deferred fields are not read, it would query the database
+    return (bill.__dict__.get('billing_date'), bill.__dict__.get('user_id'),
+            bill.__dict__.get('isPaid'))
+
+
+def summary_key(billing_date, user_id):
+    """ Return (month, user id) of revenue summary rows of a bill """
+    if billing_date is None or user_id is None:
+        return None
+    return (billing_date.replace(day=1), user_id)
+
+
+def next_month(month):
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def refresh_revenue_summary(*keys):
+    """ Compute again revenue summary rows of (month, user id) keys
+
+        Rows of a month are replaced using one aggregate query on bill lines
+        of the given coworkers, by batches of BATCH_SIZE coworkers. None keys
+        are ignored.
+    """
+    months = {}
+    for key in keys:
+        if key is not None:
+            months.setdefault(key[0], set()).add(key[1])
+    with transaction.atomic():
+        for month, month_user_ids in months.items():
+            for user_ids in chunks(sorted(month_user_ids)):
+                refresh_month_summary(month, user_ids)
+
+
+def refresh_month_summary(month, user_ids):
+    RevenueSummary.objects.filter(month=month, user_id__in=user_ids).delete()
+    rows = (BillLine.objects
+            .filter(bill__user_id__in=user_ids,
+                    bill__billing_date__gte=month,
+                    bill__billing_date__lt=next_month(month))
+            .order_by()
+            .values_list('bill__user_id', 'service_id', 'bill__isPaid')
+            .annotate(Sum('quantity'), Sum('total')))
+    RevenueSummary.objects.bulk_create(
+            RevenueSummary(month=month, user_id=user_id,
+                           service_id=service_id, is_paid=is_paid,
+                           quantity=quantity, amount=amount)
+            for user_id, service_id, is_paid, quantity, amount in rows)
+
+
+def bills_updated(*bill_ids):
+    """ Update pdf cache, revenue summary and api cache of bills
+
+        To be called after bills are changed with update() or bulk_create(),
+        which do not send signals.
+    """
+    if not bill_ids:
+        return
+    invalidate_bill_pdf(*bill_ids)
+    bills = []
+    for ids in chunks(bill_ids):
+        bills.extend(Bill.objects.filter(pk__in=ids)
+                     .values_list('billing_date', 'user_id'))
+    refresh_revenue_summary(*{
+        summary_key(billing_date, user_id) for billing_date, user_id in bills})
+    invalidate_api_cache(*{user_id for billing_date, user_id in bills})
+    record_ledger(*bill_ids)
+
+
+def owed_amount(amount, is_paid):
+    """ Part of a bill in the balance of its coworker """
+    return Decimal(0) if is_paid else amount
+
+
+def ledger_changes(bill_id, old, new):
+    """ Return entries changing the ledger state old of a bill to new
+
+        States are (user id, number, amount, paid) tuples, old is None for a
+        bill without entry and new is None for a deleted bill. Entries are
+        (bill id, user id, number, kind, bill amount, paid, amount) tuples.
+    """
+    if new is None:
+        if old is None:
+            return []
+        user_id, number, amount, is_paid = old
+        return [(bill_id, user_id, number, LedgerEntry.DELETED, amount,
+                 is_paid, -owed_amount(amount, is_paid))]
+    if old is None:
+        old = (new[0], new[1], Decimal(0), False)
+    user_id, number, amount, is_paid = old
+    changes = []
+    if user_id != new[0]:
+        owed = owed_amount(amount, is_paid)
+        changes.append((bill_id, user_id, number, LedgerEntry.MOVED,
+                        amount, is_paid, -owed))
+        user_id = new[0]
+        changes.append((bill_id, user_id, number, LedgerEntry.MOVED,
+                        amount, is_paid, owed))
+    if amount != new[2]:
+        changes.append((bill_id, user_id, new[1], LedgerEntry.BILLED,
+                        new[2], is_paid,
+                        owed_amount(new[2], is_paid) -
+                        owed_amount(amount, is_paid)))
+        amount = new[2]
+    if is_paid != new[3]:
+        kind = LedgerEntry.PAID if new[3] else LedgerEntry.UNPAID
+        changes.append((bill_id, user_id, new[1], kind, amount, new[3],
+                        -amount if new[3] else amount))
+    return changes
+
+
+def last_entries(field, values):
+    """ Return last ledger entries of bills or coworkers, by field value """
+    last_ids = (LedgerEntry.objects
+                .filter(**{field + '__in': values})
+                .order_by()
+                .values(field)
+                .annotate(last_id=Max('pk'))
+                .values_list('last_id', flat=True))
+    return {getattr(entry, field): entry
+            for entry in LedgerEntry.objects.filter(pk__in=list(last_ids))}
+
+
+def record_ledger(*bill_ids):
+    """ Append ledger entries for changes of bills since their last entry
+
+        Current state of bills is compared to the state their last entries
+        give, by batches of BATCH_SIZE bills. Bills without any change get no
+        entry. Bills and coworkers are locked until the end of the
+        transaction, so concurrent changes are recorded one after the other.
+    """
+    if not bill_ids:
+        return
+    with transaction.atomic():
+        for ids in chunks(sorted(set(bill_ids))):
+            record_ledger_chunk(ids)
+
+
+def record_ledger_chunk(bill_ids):
+    bills = {pk: state for pk, *state in
+             Bill.objects.select_for_update()
+             .filter(pk__in=bill_ids)
+             .order_by('pk')
+             .values_list('pk', 'user_id', 'number', 'amount', 'isPaid')}
+    known = {}
+    for bill_id, entry in last_entries('bill_id', bill_ids).items():
+        if entry.kind != LedgerEntry.DELETED:
+            known[bill_id] = (entry.user_id, entry.bill_number,
+                              entry.bill_amount, entry.is_paid)
+    changes = []
+    for bill_id in bill_ids:
+        new = bills.get(bill_id)
+        changes.extend(ledger_changes(
+            bill_id, known.get(bill_id),
+            None if new is None else tuple(new)))
+    if not changes:
+        return
+
+    user_ids = sorted({change[1] for change in changes})
+    # the balance of a coworker is changed by one transaction at a time
+    list(User.objects.select_for_update().filter(pk__in=user_ids)
+         .order_by('pk').values_list('pk', flat=True))
+    balances = {user_id: entry.balance for user_id, entry in
+                last_entries('user_id', user_ids).items()}
+    entries = []
+    for bill_id, user_id, number, kind, bill_amount, is_paid, amount \
+            in changes:
+        balance = balances.get(user_id, Decimal(0)) + amount
+        balances[user_id] = balance
+        entries.append(LedgerEntry(
+            bill_id=bill_id, user_id=user_id, bill_number=number, kind=kind,
+            bill_amount=bill_amount, is_paid=is_paid, amount=amount,
+            balance=balance))
+    LedgerEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
+
+def coworker_balance(user_id):
+    """ Return the amount a coworker owes, from its last ledger entry
+
+        Found with the (user, id) index, without reading other entries.
+    """
+    balance = (LedgerEntry.objects
+               .filter(user_id=user_id)
+               .order_by('-pk')
+               .values_list('balance', flat=True)
+               .first())
+    return Decimal(0) if balance is None else balance
+
+
+class DeferredBillIds(threading.local):
+    bill_ids = None
+    # bills being deleted with their lines
+    deleted_bill_ids = frozenset()
+
+
+_deferred = DeferredBillIds()
+
+
+@contextmanager
+def defer_bill_amount():
+    """ Compute bill amounts once, when leaving the block
+
+        Saving many lines of a bill, for example from the admin inline
+        formset, updates the bill amount once instead of once per line.
+    """
+    if _deferred.bill_ids is not None:
+        # already deferred by an outer block
+        yield
+        return
+    _deferred.bill_ids = set()
+    try:
+        yield
+        bill_ids = _deferred.bill_ids
+    finally:
+        _deferred.bill_ids = None
+    update_bill_amounts(*bill_ids)
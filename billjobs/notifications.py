@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import queue
+import threading
+import time
+from .instrumentation import timed
+from .settings import billjobs_settings
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait before the first retry, doubled for each next one
+RETRY_BACKOFF = 0.5
+# highest number of queued requests handled together
+BATCH_SIZE = 20
+
+
+class Dispatcher(object):
+    ''' Send http POST requests from a background thread
+
+        Requests are queued by post() and sent by one thread of the process
+        with a pooled session, a timeout and retries. Queued requests which
+        only differ by a joinable field, e.g. messages to the same channel,
+        are sent in one request. timeout and retries default to the
+        BILLJOBS_SLACK_TIMEOUT and BILLJOBS_SLACK_RETRIES settings.
+        Requests which must not be received twice are only sent again when
+        they were not received, i.e. the connection failed or slack
+        answered 429.
+    '''
+
+    def __init__(self, timeout=None, retries=None, backoff=RETRY_BACKOFF,
+                 batch_size=BATCH_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pid = None
+        self.thread = None
+
+    def post(self, url, data, callback=None, join=None, idempotent=True):
+        ''' Queue a POST request of data to url
+
+            callback is called with the json answer, or None if the request
+            failed. join is the name of the data field to join with the one
+            of other queued requests having the same url and other fields.
+            idempotent is False when the request must not be sent again
+            once slack may have received it.
+        '''
+        self.start()
+        self.queue.put((url, data, callback, join, idempotent))
+
+    def start(self):
+        ''' Start the thread of this process if it is not running '''
+        # requests is only loaded by processes sending requests
+        import requests
+
+        with self.lock:
+            if self.pid != os.getpid():
+                # a forked process has a copy of the queue but no thread
+                self.pid = os.getpid()
+                self.queue = queue.Queue()
+                self.session = requests.Session()
+                self.thread = None
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                        target=self.run, name='billjobs-dispatcher',
+                        daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            jobs = [self.queue.get()]
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for url, data, callbacks, idempotent in self.batch(jobs):
+                answer = self.send(url, data, idempotent)
+                for callback in callbacks:
+                    try:
+                        callback(answer)
+                    except Exception:
+                        logger.exception('Callback of %s failed', url)
+            for job in jobs:
+                self.queue.task_done()
+
+    def batch(self, jobs):
+        ''' Return (url, data, callbacks, idempotent) of requests to send '''
+        batch = []
+        joined = {}
+        for url, data, callback, join, idempotent in jobs:
+            callbacks = [callback] if callback is not None else []
+            if join is None:
+                batch.append((url, data, callbacks, idempotent))
+                continue
+            key = (url, join, idempotent, tuple(sorted(
+                (name, value) for name, value in data.items()
+                if name != join)))
+            if key in joined:
+                request = joined[key]
+                request[1][join] = '\n\n'.join((request[1][join], data[join]))
+                request[2].extend(callbacks)
+            else:
+                joined[key] = (url, dict(data), callbacks, idempotent)
+                batch.append(joined[key])
+        return batch
+
+    def send(self, url, data, idempotent=True):
+        ''' POST data to url, retry on failure, return json answer or None '''
+        import requests
+
+        timeout = self.timeout
+        if timeout is None:
+            timeout = billjobs_settings.SLACK_TIMEOUT
+        retries = self.retries
+        if retries is None:
+            retries = billjobs_settings.SLACK_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                with timed('slack_request_seconds',
+                           method=url.rsplit('/', 1)[-1]) as labels:
+                    labels['status'] = 'error'
+                    response = self.session.post(
+                            url, data=data, timeout=timeout)
+                    labels['status'] = response.status_code
+            except requests.RequestException as error:
+                logger.warning('Request to %s failed: %s', url, error)
+                if not idempotent and request_sent(error):
+                    return None
+                delay = self.backoff * 2 ** attempt
+            else:
+                if response.status_code != 429 and (
+                        response.status_code < 500 or not idempotent):
+                    try:
+                        return response.json()
+                    except ValueError:
+                        logger.error('Answer of %s is not json', url)
+                        return None
+                logger.warning('Request to %s answered %d',
+                               url, response.status_code)
+                try:
+                    delay = float(response.headers['Retry-After'])
+                except (KeyError, ValueError):
+                    delay = self.backoff * 2 ** attempt
+            if attempt < retries:
+                time.sleep(delay)
+        logger.error('Request to %s failed %d times', url, retries + 1)
+        return None
+
+    def flush(self, timeout=None):
+        ''' Wait until queued requests are sent, False if timeout expires '''
+        if self.pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+dispatcher = Dispatcher()
+
+
+def request_sent(error):
+    ''' False if a request failed before it was sent, from its exception '''
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.ConnectTimeout):
+        return False
+    if isinstance(error, requests.ConnectionError) and error.args:
+        # connection refused or host not found
+        reason = getattr(error.args[0], 'reason', None)
+        return not isinstance(reason, NewConnectionError)
+    return True
+
+
+def slack_url(method):
+    return '%s/%s' % (billjobs_settings.SLACK_API_URL.rstrip('/'), method)
+
+
+def send_slack_invitation(user):
+    ''' Send an invitation to the newly created user
+
+        The invitation and the message about it are sent after the response,
+        by the dispatcher thread.
+    '''
+    payload = {'token': billjobs_settings.SLACK_TOKEN, 'email': user.email}
+
+    def invitation_sent(answer):
+        # answer['ok'] is a bool
+        notify_subscription(user, bool(answer and answer.get('ok')))
+
+    dispatcher.post(
+            slack_url('users.admin.invite'), payload, callback=invitation_sent,
+            idempotent=False)
+
+
+def notify_subscription(user, invitation):
+    ''' Send to a specific channel information about last signup '''
+    if invitation is True:
+        invitation_status = 'L\'envoi de l\'invitation slack a réussi'
+    elif invitation is False:
+        invitation_status = (
+                "L\'envoi de l\'invitation slack a échoué\nSoit il sait pas "
+                "écrire son email (ça commence bien), soit slack a un "
+                "problème (c\'est possible)"
+                )
+
+    payload = {
+            'username': 'signup-bot',
+            'token': billjobs_settings.SLACK_TOKEN,
+            'channel': billjobs_settings.SLACK_CHANNEL,
+            'text': (
+                ':new:\nL\'utilisateur {0} ({1} {2}) est inscrit\n'
+                'L\'adresse email est {3}\n{4}'.format(
+                    user.username,
+                    user.first_name,
+                    user.last_name,
+                    user.email,
+                    invitation_status
+                    )
+                )
+            }
+    # failures are only logged by the dispatcher
+    dispatcher.post(slack_url('chat.postMessage'), payload, join='text',
+                    idempotent=False)
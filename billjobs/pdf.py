@@ -0,0 +1,527 @@
+# -*- coding: utf-8 -*-
+from functools import lru_cache
+from reportlab.pdfgen import canvas
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Table, Paragraph
+from decimal import Decimal
+from io import BytesIO
+from itertools import chain
+from .settings import billjobs_settings
+from .cache import settings_digest
+from textwrap import wrap
+
+# define a line height
+LINE_HEIGHT = 15
+TABLE_HEADER = ('Désignation', 'Prix unit. HT', 'Quantité', 'Total HT')
+# rows ending the table of the last page
+TOTAL_ROWS = 3
+STATEMENT_HEADER = ('Date', 'Désignation', 'Quantité', 'Montant', 'Payé')
+
+
+class InvoiceTemplate(object):
+    ''' Invoice parts which are the same for every bill
+
+        The template is built once per process by get_invoice_template(), and
+        again when a pdf setting changes. It only keeps what the public
+        reportlab api draws from: the style sheet, the logo already read and
+        decoded, settings and dimensions of the page. Static parts of next pages are drawn in a form xobject
+        written once in each document.
+    '''
+    NEXT_FORM_NAME = 'billjobs-invoice-next'
+
+    def __init__(self):
+        self.styles = getSampleStyleSheet()
+        self.debug = billjobs_settings.DEBUG_PDF
+        self.logo_path = billjobs_settings.BILL_LOGO_PATH
+        self.logo = ImageReader(self.logo_path)
+        # decode now, drawImage reads pixels of the logo for each document
+        self.logo.getRGBData()
+        self.logo_width = billjobs_settings.BILL_LOGO_WIDTH
+        self.logo_height = billjobs_settings.BILL_LOGO_HEIGHT
+        self.payment_info_text = billjobs_settings.BILL_PAYMENT_INFO
+        # define document width and height with cm as margin
+        width, height = A4
+        self.width = width - 2*cm
+        self.height = height - 2*cm
+        info_width, info_height = self.payment_info().wrap(
+                self.width*0.6, 100)
+        # lines are not drawn below the payment information
+        self.bottom = 3*LINE_HEIGHT + info_height + LINE_HEIGHT
+        # top of the lines table on first and next pages
+        self.first_top = self.height - 90 - 10*LINE_HEIGHT
+        self.next_top = self.height - 4*LINE_HEIGHT
+
+    def draw_static(self, pdf):
+        ''' Draw parts of the first page which do not depend on the bill '''
+        width, height, lh = self.width, self.height, LINE_HEIGHT
+
+        self.draw_debug(pdf)
+
+        # Put logo on top of pdf original image size is 570px/250px
+        pdf.drawImage(
+                self.logo,
+                0,
+                height-self.logo_height,
+                width=self.logo_width,
+                height=self.logo_height
+                )
+
+        # define new height
+        nh = height - 90
+
+        # seller
+        pdf.setFillColorRGB(0.95, 0.95, 0.95)
+        pdf.setStrokeColorRGB(1, 1, 1)
+        # rect(x,y,width,height)
+        pdf.rect(0, nh-8*lh, width/2-40, 6.4*lh, fill=1)
+        # reset fill for text color
+        pdf.setFillColorRGB(0.3, 0.3, 0.3)
+        pdf.setFont("Helvetica", 10)
+        pdf.drawString(10, nh-lh, 'Émetteur')
+
+        # customer
+        pdf.drawString(width/2, nh-lh, 'Adressé à')
+        pdf.setStrokeColorRGB(0, 0, 0)
+        # rect(x,y,width,height)
+        pdf.rect(width/2, nh-8*lh, width/2, 6.4*lh, fill=0)
+
+        self.draw_footer(pdf)
+
+    def draw_next_static(self, pdf):
+        ''' Draw parts of next pages which do not depend on the bill
+
+            The form is written once in the document and used by each page.
+        '''
+        if not pdf.hasForm(self.NEXT_FORM_NAME):
+            pdf.beginForm(self.NEXT_FORM_NAME)
+            self.draw_debug(pdf)
+            pdf.setFillColorRGB(0.3, 0.3, 0.3)
+            pdf.setStrokeColorRGB(0, 0, 0)
+            pdf.setFont("Helvetica", 10)
+            self.draw_footer(pdf)
+            pdf.endForm()
+        pdf.doForm(self.NEXT_FORM_NAME)
+
+    def draw_debug(self, pdf):
+        width, height = self.width, self.height
+
+        # if debug draw lines for document limit
+        if self.debug is True:
+            pdf.setStrokeColorRGB(1, 0, 0)
+            pdf.line(0, 0, width, 0)
+            pdf.line(0, 0, 0, height)
+            pdf.line(0, height, width, height)
+            pdf.line(width, height, width, 0)
+
+    def payment_info(self):
+        # flowables are not shared, drawOn() stores the canvas in them
+        return Paragraph(self.payment_info_text, self.styles['Normal'])
+
+    def draw_footer(self, pdf):
+        width, lh = self.width, LINE_HEIGHT
+
+        p = self.payment_info()
+        p.wrapOn(pdf, width*0.6, 100)
+        p.drawOn(pdf, 0, 3*lh)
+
+        pdf.line(0, 2*lh, width, 2*lh)
+        pdf.setFontSize(8)
+        pdf.drawCentredString(width/2.0, lh, 'Association Loi 1901')
+
+
+def get_invoice_template():
+    ''' Return the invoice template of the current settings '''
+    return invoice_template(settings_digest())
+
+
+@lru_cache(maxsize=None)
+def invoice_template(digest):
+    ''' Return the invoice template of this process for a settings digest '''
+    return InvoiceTemplate()
+
+
+def render_bill_pdf(bill):
+    ''' Render one bill and return the pdf document as bytes
+
+        Lines are read with bill.billline_set.all() so a queryset using
+        prefetch_related('billline_set__service') renders without any query.
+    '''
+    template = get_invoice_template()
+    width, height, lh = template.width, template.height, LINE_HEIGHT
+
+    # Create a buffer
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    # define new 0,0 bottom left with cm as margin
+    pdf.translate(cm, cm)
+    template.draw_static(pdf)
+
+    # billing information
+    pdf.setFillColorRGB(0.3, 0.3, 0.3)
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.drawRightString(width, height-lh, document_title(bill))
+    pdf.setFont("Helvetica-Bold", 10)
+    pdf.drawRightString(width, height-2*lh, u'Numéro : %s' % bill.number)
+    pdf.setFont("Helvetica", 10)
+    pdf.drawRightString(
+            width,
+            height-3*lh,
+            u'Date facturation : {}'.format(
+                bill.billing_date.strftime('%d/%m/%Y'))
+            )
+    if bill.is_credit_note:
+        pdf.drawRightString(
+                width, height-4*lh,
+                u'Avoir sur la facture : %s' % bill.credited_bill.number)
+
+    # define new height
+    nh = height - 90
+
+    # seller
+    issuer = Paragraph(bill.issuer_address, template.styles['Normal'])
+    issuer.wrapOn(pdf, width*0.25, 6*lh)
+    issuer.drawOn(pdf, 20, nh-6*lh)
+
+    # customer
+    customer = pdf.beginText()
+    customer.setTextOrigin(width/2+20, nh-3*lh)
+    # create text with \n and remove \r
+    text = '{} {}\n{}'.format(
+            bill.user.first_name,
+            bill.user.last_name,
+            bill.billing_address.replace('\r', '')
+            )
+    # get each line
+    for line in text.split('\n'):
+        customer.textOut(line)
+        customer.moveCursor(0, lh)
+    pdf.drawText(customer)
+
+    rows, heights, totals = line_rows(bill)
+    header_height = row_height(1)
+    pages = paginate(
+            heights,
+            template.first_top - template.bottom - header_height,
+            template.next_top - template.bottom - header_height,
+            row_height(1))
+
+    # widths in percent of pdf width
+    colWidths = (width*0.55, width*0.15, width*0.15, width*0.15)
+    for index, (start, end) in enumerate(pages):
+        if index:
+            pdf.showPage()
+            pdf.translate(cm, cm)
+            template.draw_next_static(pdf)
+            draw_next_header(pdf, template, bill)
+        if len(pages) > 1:
+            if index:
+                page_top = height-3*lh
+            elif bill.is_credit_note:
+                # below the number of the credited bill
+                page_top = height-5*lh
+            else:
+                page_top = height-4*lh
+            pdf.setFont("Helvetica", 10)
+            pdf.drawRightString(
+                    width, page_top,
+                    'Page {}/{}'.format(index + 1, len(pages)))
+
+        data = [TABLE_HEADER]
+        data.extend(rows[start:end])
+        if len(pages) > 1:
+            data.append(('', '', 'Sous-total', '{} €'.format(
+                sum(totals[start:end], Decimal(0)))))
+        if index == len(pages) - 1:
+            data.append((
+                'TVA non applicable art-293B du CGI',
+                '',
+                'Total HT',
+                '{} €'.format(bill.amount)
+                ))
+            data.append(('', '', 'TVA 0%', '0'))
+            data.append(('', '', 'Total TTC', '{} €.'.format(bill.amount)))
+
+        table = Table(data, colWidths=colWidths,
+                      style=table_style(len(data) - 1 - (end - start),
+                                        index == len(pages) - 1))
+        # create table and get width and height
+        t_width, t_height = table.wrap(0, 0)
+        top = template.first_top if index == 0 else template.next_top
+        table.drawOn(pdf, 0, top-t_height)
+
+    pdf.showPage()
+    pdf.save()
+    # get pdf from buffer and return it
+    genpdf = buffer.getvalue()
+    buffer.close()
+    return genpdf
+
+
+def document_title(bill):
+    return 'Avoir' if bill.is_credit_note else 'Facture'
+
+
+def draw_next_header(pdf, template, bill):
+    ''' Draw the bill number on top of next pages '''
+    width, height, lh = template.width, template.height, LINE_HEIGHT
+    pdf.setFillColorRGB(0.3, 0.3, 0.3)
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.drawRightString(width, height-lh, document_title(bill))
+    pdf.setFont("Helvetica-Bold", 10)
+    pdf.drawRightString(width, height-2*lh, u'Numéro : %s' % bill.number)
+
+
+def line_rows(bill):
+    ''' Return table rows, their heights and totals of the bill lines '''
+    rows = []
+    heights = []
+    totals = []
+    for line in bill.billline_set.all():
+        description = '{} - {}\n{}'.format(
+                line.service.reference,
+                line.service.name,
+                '\n'.join(wrap(line.service.description, 62)))
+
+        if line.note:
+            description = '{}\n{}'.format(
+                    description,
+                    '\n'.join(wrap(line.note, 62)))
+
+        rows.append(
+                (description, line.service.price, line.quantity, line.total))
+        heights.append(row_height(description.count('\n') + 1))
+        totals.append(line.total)
+    return rows, heights, totals
+
+
+@lru_cache(maxsize=None)
+def row_height(text_lines):
+    ''' Return height of a table row whose highest cell has text_lines
+
+        Rows are measured once by reportlab. Measuring the rows of a whole
+        table takes a time growing with the square of its size.
+    '''
+    table = Table([['\n' * (text_lines - 1)]])
+    return table.wrap(0, 0)[1]
+
+
+def paginate(heights, first_height, next_height, footer_height):
+    ''' Split rows of heights in pages, return (start, end) of each page
+
+        first_height and next_height are heights available for rows on the
+        first and next pages. A bill on one page ends with the total rows.
+        Otherwise each page ends with a subtotal row, and the last one also
+        with the total rows, all of footer_height. A row higher than a page
+        is alone on its page.
+    '''
+    pages = []
+    start = 0
+    for rows, last in stream_pages(enumerate(heights), first_height,
+                                   next_height, footer_height):
+        pages.append((start, start + len(rows)))
+        start += len(rows)
+    return pages
+
+
+def stream_pages(rows, first_height, next_height, footer_height):
+    ''' Yield (rows, last) of each page of rows, split like paginate()
+
+        rows is an iterable of (row, height), read while pages are yielded:
+        only rows of the current page are kept in memory. Rows of a page are
+        (row, height) tuples too.
+    '''
+    rows = iter(rows)
+    page = []
+    used = 0
+    available = first_height
+    first = True
+    moved = []
+    while True:
+        for row, height in chain(moved, rows):
+            if page and used + height + footer_height > available:
+                yield page, False
+                page, used, available, first = [], 0, next_height, False
+            page.append((row, height))
+            used += height
+        if first and used + TOTAL_ROWS*footer_height <= available:
+            yield page, True
+            return
+        # rows which leave no room for the totals go to a last page
+        moved = []
+        while page and used + (1 + TOTAL_ROWS)*footer_height > available:
+            row, height = page.pop()
+            used -= height
+            moved.append((row, height))
+        if not moved:
+            yield page, True
+            return
+        if not page:
+            page.append(moved.pop())
+        moved.reverse()
+        yield page, False
+        page, used, available, first = [], 0, next_height, False
+
+
+def table_style(footer_rows, last):
+    ''' Return style of a lines table ending with footer_rows rows '''
+    style = [
+            ('GRID', (0, 0), (-1, 0), 1, colors.black),
+            ('GRID', (-2, -footer_rows), (-1, -1), 1, colors.black),
+            ('BOX', (0, 1), (0, -footer_rows-1), 1, colors.black),
+            ('BOX', (1, 1), (1, -footer_rows-1), 1, colors.black),
+            ('BOX', (2, 1), (2, -footer_rows-1), 1, colors.black),
+            ('BOX', (-1, 1), (-1, -footer_rows-1), 1, colors.black),
+            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+            ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+            ('ALIGN', (-1, 0), (-1, -1), 'RIGHT'),
+            ]
+    if last:
+        style.append(('FONTNAME', (0, -3), (0, -3), 'Helvetica-Bold'))
+    return style
+
+
+def render_statement_pdf(user, billing_address, bills, totals, date):
+    ''' Render the account statement of a coworker and return it as bytes
+
+        bills is an iterable of the coworker bills, oldest first, with their
+        lines and services prefetched. It is read while pages are drawn, so
+        only the bills of one page are kept in memory. totals is a dict of
+        billed, paid and unpaid amounts of every bill.
+    '''
+    template = get_invoice_template()
+    width, height, lh = template.width, template.height, LINE_HEIGHT
+
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf.translate(cm, cm)
+    template.draw_static(pdf)
+
+    # define new height
+    nh = height - 90
+
+    # seller
+    issuer = Paragraph(billjobs_settings.BILL_ISSUER,
+                       template.styles['Normal'])
+    issuer.wrapOn(pdf, width*0.25, 6*lh)
+    issuer.drawOn(pdf, 20, nh-6*lh)
+
+    # customer
+    customer = pdf.beginText()
+    customer.setTextOrigin(width/2+20, nh-3*lh)
+    text = '{} {}\n{}'.format(
+            user.first_name, user.last_name, billing_address.replace('\r', ''))
+    for line in text.split('\n'):
+        customer.textOut(line)
+        customer.moveCursor(0, lh)
+    pdf.drawText(customer)
+
+    header_height = row_height(1)
+    pages = stream_pages(
+            statement_rows(bills),
+            template.first_top - template.bottom - header_height,
+            template.next_top - template.bottom - header_height,
+            row_height(1))
+
+    colWidths = (width*0.13, width*0.45, width*0.1, width*0.16, width*0.16)
+    for index, (page, last) in enumerate(pages):
+        if index:
+            pdf.showPage()
+            pdf.translate(cm, cm)
+            template.draw_next_static(pdf)
+        draw_statement_header(pdf, template, user, date)
+        if index or not last:
+            pdf.setFont("Helvetica", 10)
+            pdf.drawRightString(width, height-4*lh,
+                                'Page {}'.format(index + 1))
+
+        data = [STATEMENT_HEADER]
+        bold_rows = []
+        page_amount = Decimal(0)
+        for row, is_bill in (item for item, size in page):
+            if is_bill:
+                bold_rows.append(len(data))
+                page_amount += row[3]
+            data.append(statement_cells(row))
+        if index or not last:
+            data.append(('', 'Total des factures de la page', '',
+                         '{} €'.format(page_amount), ''))
+        if last:
+            data.append(('', 'Total facturé', '',
+                         '{} €'.format(totals['billed']), ''))
+            data.append(('', 'Total payé', '',
+                         '{} €'.format(totals['paid']), ''))
+            data.append(('', 'Reste à payer', '',
+                         '{} €'.format(totals['unpaid']), ''))
+
+        table = Table(data, colWidths=colWidths, style=statement_style(
+            len(data) - 1 - len(page), bold_rows))
+        t_width, t_height = table.wrap(0, 0)
+        top = template.first_top if index == 0 else template.next_top
+        table.drawOn(pdf, 0, top-t_height)
+
+    pdf.showPage()
+    pdf.save()
+    genpdf = buffer.getvalue()
+    buffer.close()
+    return genpdf
+
+
+def draw_statement_header(pdf, template, user, date):
+    ''' Draw the statement title, coworker and date on top of a page '''
+    width, height, lh = template.width, template.height, LINE_HEIGHT
+    pdf.setFillColorRGB(0.3, 0.3, 0.3)
+    pdf.setFont("Helvetica-Bold", 14)
+    pdf.drawRightString(width, height-lh, 'Relevé de compte')
+    pdf.setFont("Helvetica-Bold", 10)
+    pdf.drawRightString(width, height-2*lh, '{} {}'.format(
+        user.first_name, user.last_name))
+    pdf.setFont("Helvetica", 10)
+    pdf.drawRightString(width, height-3*lh, 'Date : {}'.format(
+        date.strftime('%d/%m/%Y')))
+
+
+def statement_rows(bills):
+    ''' Yield ((row, is_bill), height) of bills and their lines
+
+        A bill row is (date, title, '', amount, paid) and a line row is
+        ('', description, quantity, total, '').
+    '''
+    for bill in bills:
+        row = (bill.billing_date, '{} {}'.format(
+            document_title(bill), bill.number), '', bill.amount, bill.isPaid)
+        yield (row, True), row_height(1)
+        for line in bill.billline_set.all():
+            description = '\n'.join(wrap('{} - {}'.format(
+                line.service.reference, line.service.name), 50))
+            row = ('', description, line.quantity, line.total, '')
+            yield (row, False), row_height(description.count('\n') + 1)
+
+
+def statement_cells(row):
+    ''' Return table cells of a statement row '''
+    date, title, quantity, amount, paid = row
+    if date:
+        date = date.strftime('%d/%m/%Y')
+        paid = 'Oui' if paid else 'Non'
+    return (date, title, quantity, '{} €'.format(amount), paid)
+
+
+def statement_style(footer_rows, bold_rows):
+    ''' Return style of a statement table ending with footer_rows rows '''
+    style = [
+            ('GRID', (0, 0), (-1, 0), 1, colors.black),
+            ('GRID', (1, -footer_rows), (-2, -1), 1, colors.black),
+            ('BOX', (0, 0), (-1, -footer_rows-1), 1, colors.black),
+            ('ALIGN', (0, 0), (1, -1), 'LEFT'),
+            ('ALIGN', (2, 0), (2, -1), 'CENTER'),
+            ('ALIGN', (3, 0), (3, -1), 'RIGHT'),
+            ('ALIGN', (4, 0), (4, -1), 'CENTER'),
+            ('FONTNAME', (1, -footer_rows), (1, -1), 'Helvetica-Bold'),
+            ]
+    for row in bold_rows:
+        style.append(('FONTNAME', (0, row), (-1, row), 'Helvetica-Bold'))
+    return style
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+import csv
+import datetime
+import io
+import re
+import unicodedata
+from collections import deque, namedtuple
+from decimal import Decimal, InvalidOperation
+from xml.etree.ElementTree import iterparse
+from django.db import transaction
+from .models import Bill, bills_updated, chunks
+
+# one credit of a bank statement
+Payment = namedtuple('Payment', ('date', 'amount', 'label', 'reference'))
+
+STATEMENT_FORMATS = ('csv', 'ofx', 'camt')
+
+# normalized header names of csv columns
+CSV_COLUMNS = {
+        'date': ('date', 'date operation', 'booking date', 'date comptable'),
+        'amount': ('amount', 'montant', 'credit'),
+        'label': ('label', 'libelle', 'description', 'reference'),
+        }
+# year month day or day month year, strptime is slow for large statements
+DATE_PATTERNS = (
+        (re.compile(r'(\d{4})-?(\d{2})-?(\d{2})$'), (1, 2, 3)),
+        (re.compile(r'(\d{2})/(\d{2})/(\d{4})$'), (3, 2, 1)),
+        )
+
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)')
+WORD = re.compile(r'[a-z0-9]+')
+
+
+class StatementError(Exception):
+    ''' A bank statement file can not be read '''
+
+
+def normalize(text):
+    ''' Return text in lower case without accents '''
+    try:
+        return text.encode('ascii').decode('ascii').lower()
+    except UnicodeEncodeError:
+        pass
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(
+            char for char in text if not unicodedata.combining(char)).lower()
+
+
+def words(text):
+    return WORD.findall(normalize(text))
+
+
+def parse_amount(text):
+    ''' Return Decimal of an amount like 1234.50, -12,5 or 1 234,50 '''
+    text = text.replace(' ', '').replace('\xa0', '').replace('+', '')
+    if ',' in text and '.' in text:
+        # the first one separates thousands
+        thousands = ',' if text.index(',') < text.index('.') else '.'
+        text = text.replace(thousands, '')
+    try:
+        return Decimal(text.replace(',', '.')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise StatementError('Invalid amount %r' % text)
+
+
+def parse_date(text):
+    ''' Return date of 2014-05-02, 20140502 or 02/05/2014 '''
+    text = text.strip()
+    for pattern, groups in DATE_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            try:
+                return datetime.date(*(int(match.group(group))
+                                       for group in groups))
+            except ValueError:
+                break
+    raise StatementError('Invalid date %r' % text)
+
+
+def parse_csv(stream, encoding='utf-8-sig'):
+    ''' Yield credits of a csv statement, read line by line
+
+        The first row names the columns, see CSV_COLUMNS. Columns are
+        separated by ',' or ';'.
+    '''
+    lines = io.TextIOWrapper(stream, encoding=encoding, newline='')
+    header = lines.readline()
+    delimiter = ',' if header.count(',') > header.count(';') else ';'
+    names = [' '.join(words(name))
+             for name in next(csv.reader([header], delimiter=delimiter))]
+    columns = {}
+    for column, aliases in CSV_COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                columns[column] = names.index(alias)
+                break
+        else:
+            raise StatementError('No %s column in %s' % (column, header))
+
+    for number, row in enumerate(csv.reader(lines, delimiter=delimiter), 2):
+        if not any(row):
+            continue
+        amount = row[columns['amount']]
+        if not amount.strip():
+            # a debit in a statement with credit and debit columns
+            continue
+        amount = parse_amount(amount)
+        if amount > 0:
+            yield Payment(parse_date(row[columns['date']]), amount,
+                          row[columns['label']], 'line %d' % number)
+
+
+def parse_ofx(stream, encoding='latin-1'):
+    ''' Yield credits of an OFX statement, read line by line
+
+        Both OFX 1 (SGML, closing tags are optional) and OFX 2 (XML) are
+        read.
+    '''
+    fields = None
+    for line in io.TextIOWrapper(stream, encoding=encoding, newline=''):
+        for closing, tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if not closing:
+                    fields = {}
+                    continue
+                if fields:
+                    payment = ofx_payment(fields)
+                    if payment.amount > 0:
+                        yield payment
+                fields = None
+            elif fields is not None and not closing and value.strip():
+                fields[tag] = value.strip()
+
+
+def ofx_payment(fields):
+    try:
+        return Payment(
+                parse_date(fields['DTPOSTED'][:8]),
+                parse_amount(fields['TRNAMT']),
+                ' '.join(fields[tag] for tag in ('NAME', 'MEMO')
+                         if tag in fields),
+                fields.get('FITID', ''))
+    except KeyError as error:
+        raise StatementError('No %s in OFX transaction' % error)
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_camt(stream):
+    ''' Yield credits of a CAMT.053 statement
+
+        Entries are read one by one and removed from the xml tree once read,
+        so memory does not grow with the statement size.
+    '''
+    parents = []
+    try:
+        for event, element in iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                parents.append(element)
+                continue
+            parents.pop()
+            if local_name(element.tag) != 'Ntry':
+                continue
+            payment = camt_payment(element)
+            if payment is not None:
+                yield payment
+            # forget read entries and what precedes them
+            parents[-1].clear()
+    except SyntaxError as error:
+        raise StatementError('Invalid CAMT.053 file: %s' % error)
+
+
+def camt_payment(entry):
+    values = {}
+    labels = []
+    for element in entry.iter():
+        name = local_name(element.tag)
+        text = (element.text or '').strip()
+        if name in ('Ustrd', 'Nm', 'AddtlNtryInf') and text:
+            labels.append(text)
+        elif text and name not in values:
+            values[name] = text
+    if values.get('CdtDbtInd') != 'CRDT' or 'Amt' not in values:
+        return None
+    date = values.get('Dt') or values.get('DtTm', '')[:10]
+    return Payment(parse_date(date), parse_amount(values['Amt']),
+                   ' '.join(labels),
+                   values.get('AcctSvcrRef', values.get('NtryRef', '')))
+
+
+def parse_statement(stream, statement_format, encoding=None):
+    ''' Yield credits of a bank statement opened in binary mode '''
+    if statement_format == 'csv':
+        return parse_csv(stream, encoding or 'utf-8-sig')
+    if statement_format == 'ofx':
+        return parse_ofx(stream, encoding or 'latin-1')
+    if statement_format == 'camt':
+        return parse_camt(stream)
+    raise StatementError('Unknown statement format %s' % statement_format)
+
+
+def statement_format(path):
+    ''' Guess format of a statement from its file name '''
+    extension = path.rsplit('.', 1)[-1].lower()
+    if extension in ('ofx', 'qfx'):
+        return 'ofx'
+    if extension == 'xml':
+        return 'camt'
+    return 'csv'
+
+
+class UnpaidBills(object):
+    ''' Unpaid bills indexed by number and by coworker name and amount
+
+        The index is built with one query, then a payment is matched without
+        any query. A bill is matched only once, bills of a coworker with the
+        same amount are matched from the oldest one. Bills are indexed by the
+        longest word of the coworker last name, the other words of the name
+        are checked once a bill is found.
+    '''
+
+    def __init__(self, queryset=None):
+        queryset = Bill.objects.all() if queryset is None else queryset
+        self.by_number = {}
+        self.by_name = {}
+        bills = (queryset.filter(isPaid=False)
+                 .order_by('billing_date', 'pk')
+                 .values_list('pk', 'number', 'amount', 'user_id',
+                              'user__last_name', 'user__first_name')
+                 .iterator())
+        for pk, number, amount, user_id, last_name, first_name in bills:
+            last_name = frozenset(words(last_name))
+            bill = (pk, amount, user_id, last_name,
+                    last_name.union(words(first_name)))
+            self.by_number[normalize(number)] = bill
+            if last_name:
+                key = (max(last_name, key=len), amount)
+                self.by_name.setdefault(key, {}).setdefault(
+                        user_id, deque()).append(bill)
+        self.matched = set()
+
+    def match(self, payment):
+        ''' Return (bill id, reason) of the bill paid by payment
+
+            bill id is None if no bill is found, reason tells why.
+        '''
+        label_words = words(payment.label)
+        for word in label_words:
+            bill = self.by_number.get(word)
+            if bill is None or bill[0] in self.matched:
+                continue
+            if bill[1] != payment.amount:
+                return None, 'amount of %s is %s' % (word.upper(), bill[1])
+            self.matched.add(bill[0])
+            return bill[0], 'number'
+
+        # oldest unpaid bill of the coworker named in the label
+        label_words = set(label_words)
+        candidates = []
+        for word in label_words:
+            by_user = self.by_name.get((word, payment.amount), {})
+            for bills in by_user.values():
+                while bills and bills[0][0] in self.matched:
+                    bills.popleft()
+                if bills and label_words.issuperset(bills[0][3]):
+                    candidates.append(bills[0])
+        if len(candidates) > 1:
+            # coworkers with the same last name
+            candidates = [bill for bill in candidates
+                          if label_words.issuperset(bill[4])]
+            if len(candidates) != 1:
+                return None, 'several coworkers'
+        if not candidates:
+            return None, 'no bill'
+        self.matched.add(candidates[0][0])
+        return candidates[0][0], 'name'
+
+
+def reconcile(payments, queryset=None):
+    ''' Match payments to unpaid bills
+
+        Return (matches, rejects), matches is a list of (payment, bill id,
+        reason) and rejects a list of (payment, reason).
+    '''
+    bills = UnpaidBills(queryset)
+    matches = []
+    rejects = []
+    for payment in payments:
+        bill_id, reason = bills.match(payment)
+        if bill_id is None:
+            rejects.append((payment, reason))
+        else:
+            matches.append((payment, bill_id, reason))
+    return matches, rejects
+
+
+@transaction.atomic
+def mark_bills_paid(bill_ids):
+    ''' Set isPaid of bills with one UPDATE per BATCH_SIZE bills '''
+    bill_ids = list(bill_ids)
+    updated = 0
+    for ids in chunks(bill_ids):
+        updated += Bill.objects.filter(pk__in=ids, isPaid=False).update(
+                isPaid=True)
+    # update() does not send post_save
+    bills_updated(*bill_ids)
+    return updated
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import datetime
+from itertools import groupby
+from django.db import transaction
+from .models import BATCH_SIZE, Bill, BillLine, Subscription, UserProfile, \
+        chunks, reserve_bill_numbers, update_bill_amounts
+
+
+def due_subscriptions(date=None, force=False):
+    ''' Return active subscriptions not billed yet for the month of date '''
+    date = date or datetime.date.today()
+    subscriptions = Subscription.objects.filter(is_active=True)
+    if not force:
+        subscriptions = subscriptions.exclude(
+                last_billing_date__gte=date.replace(day=1))
+    return subscriptions
+
+
+@transaction.atomic
+def generate_subscription_bills(force=False):
+    ''' Create today one bill per coworker with its due subscriptions
+
+        Bills and lines are inserted with bulk_create, so no signal is sent.
+        Bill numbers are reserved at once and bill amounts are computed by
+        the database once all lines are inserted. Return created bills count.
+    '''
+    date = datetime.date.today()
+    subscriptions = (due_subscriptions(date, force)
+                     .select_related('user__userprofile', 'service')
+                     .order_by('user_id', 'id'))
+    by_user = [(user_id, list(lines)) for user_id, lines in groupby(
+        subscriptions, key=lambda subscription: subscription.user_id)]
+    if not by_user:
+        return 0
+
+    numbers = reserve_bill_numbers(len(by_user), date)
+    bills = []
+    for number, (user_id, user_subscriptions) in zip(numbers, by_user):
+        user = user_subscriptions[0].user
+        try:
+            billing_address = user.userprofile.billing_address
+        except UserProfile.DoesNotExist:
+            billing_address = ''
+        bills.append(Bill(
+            user_id=user_id,
+            number=number,
+            amount=0,
+            billing_address=billing_address))
+    Bill.objects.bulk_create(bills, batch_size=BATCH_SIZE)
+
+    # bulk_create does not set primary keys on every database
+    bill_ids = {}
+    for numbers_chunk in chunks(numbers):
+        bill_ids.update(Bill.objects.filter(number__in=numbers_chunk)
+                        .values_list('number', 'pk'))
+
+    lines = []
+    for number, (user_id, user_subscriptions) in zip(numbers, by_user):
+        for subscription in user_subscriptions:
+            lines.append(BillLine(
+                bill_id=bill_ids[number],
+                service_id=subscription.service_id,
+                quantity=subscription.quantity,
+                total=subscription.service.price * subscription.quantity,
+                note=subscription.note))
+    BillLine.objects.bulk_create(lines, batch_size=BATCH_SIZE)
+
+    for ids_chunk in chunks(list(bill_ids.values())):
+        update_bill_amounts(*ids_chunk)
+    subscription_ids = [subscription.pk
+                        for user_id, user_subscriptions in by_user
+                        for subscription in user_subscriptions]
+    for ids_chunk in chunks(subscription_ids):
+        Subscription.objects.filter(pk__in=ids_chunk).update(
+                last_billing_date=date)
+    return len(bills)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import datetime
+from django.db import transaction
+from django.db.models import Case, DecimalField, IntegerField, Q, Sum, When
+from django.db.models.functions import Coalesce, TruncMonth
+from .models import Bill, BillLine, RevenueSummary
+
+# upper age in days of unpaid bills in each aging bucket, last one is open
+AGING_DAYS = (30, 60, 90)
+
+
+def summary_rows(lines=None):
+    ''' Aggregate bill lines as revenue summary values
+
+        Return (month, user id, service id, paid, quantity, amount) tuples.
+    '''
+    lines = BillLine.objects.all() if lines is None else lines
+    return (lines
+            .annotate(month=TruncMonth('bill__billing_date'))
+            .order_by()
+            .values_list('month', 'bill__user_id', 'service_id',
+                         'bill__isPaid')
+            .annotate(Sum('quantity'), Sum('total')))
+
+
+def rebuild_revenue_summary(batch_size=500):
+    ''' Replace every revenue summary row, return number of rows
+
+        Signals keep the summary up to date, rebuild it after changing bills
+        or lines without them, e.g. with raw SQL.
+    '''
+    count = 0
+    with transaction.atomic():
+        RevenueSummary.objects.all().delete()
+        batch = []
+        for month, user_id, service_id, is_paid, quantity, amount \
+                in summary_rows().iterator():
+            batch.append(RevenueSummary(
+                month=month, user_id=user_id, service_id=service_id,
+                is_paid=is_paid, quantity=quantity, amount=amount))
+            if len(batch) >= batch_size:
+                RevenueSummary.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        RevenueSummary.objects.bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def summaries(since=None, until=None):
+    ''' Revenue summary rows of months between since and until dates '''
+    queryset = RevenueSummary.objects.order_by()
+    if since is not None:
+        queryset = queryset.filter(month__gte=since.replace(day=1))
+    if until is not None:
+        queryset = queryset.filter(month__lte=until)
+    return queryset
+
+
+def paid_amounts():
+    ''' Aggregates of billed, paid and unpaid amounts of summary rows '''
+    return {
+            'billed': Sum('amount'),
+            'paid': Coalesce(Sum(Case(
+                When(is_paid=True, then='amount'),
+                output_field=DecimalField())), 0),
+            'unpaid': Coalesce(Sum(Case(
+                When(is_paid=False, then='amount'),
+                output_field=DecimalField())), 0),
+            }
+
+
+def revenue_per_month(since=None, until=None):
+    ''' Return billed, paid and unpaid amounts per month '''
+    return (summaries(since, until)
+            .values('month')
+            .annotate(**paid_amounts())
+            .order_by('month'))
+
+
+def revenue_per_service(since=None, until=None):
+    ''' Return quantity and amounts billed per service, highest first '''
+    return (summaries(since, until)
+            .values('service_id', 'service__reference', 'service__name')
+            .annotate(quantity=Sum('quantity'), **paid_amounts())
+            .order_by('-billed', 'service_id'))
+
+
+def revenue_per_coworker(since=None, until=None):
+    ''' Return amounts billed per coworker, highest first '''
+    return (summaries(since, until)
+            .values('user_id', 'user__first_name', 'user__last_name')
+            .annotate(**paid_amounts())
+            .order_by('-billed', 'user_id'))
+
+
+def unpaid_aging(today=None):
+    ''' Return count and amount of unpaid bills by age in days
+
+        Each bucket is a dict with min_days (included), max_days (excluded,
+        None for the last one), count and amount. The summary table has no
+        billing day, so buckets are summed from unpaid bills, in one query
+        using the (isPaid, billing_date) index.
+    '''
+    today = today or datetime.date.today()
+    limits = (0,) + AGING_DAYS + (None,)
+    aggregates = {}
+    for i in range(len(limits) - 1):
+        condition = Q(billing_date__lte=today - datetime.timedelta(
+            days=limits[i]))
+        if limits[i + 1] is not None:
+            condition &= Q(billing_date__gt=today - datetime.timedelta(
+                days=limits[i + 1]))
+        aggregates['count_%d' % i] = Sum(Case(
+            When(condition, then=1), default=0, output_field=IntegerField()))
+        aggregates['amount_%d' % i] = Coalesce(Sum(Case(
+            When(condition, then='amount'), output_field=DecimalField())), 0)
+    totals = Bill.objects.filter(isPaid=False).aggregate(**aggregates)
+    return [{
+        'min_days': limits[i],
+        'max_days': limits[i + 1],
+        'count': totals['count_%d' % i] or 0,
+        'amount': totals['amount_%d' % i],
+        } for i in range(len(limits) - 1)]
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import datetime
+import random
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.db import transaction
+from .models import BATCH_SIZE, Bill, BillLine, Service, UserProfile, \
+        chunks, update_bill_amounts
+
+# usernames of seeded coworkers start with it
+SEED_PREFIX = 'seed-'
+
+FIRST_NAMES = ('Ada', 'Alan', 'Bill', 'Grace', 'Linus', 'Margaret', 'Steve',
+               'Tim')
+LAST_NAMES = ('Berners-Lee', 'Hamilton', 'Hopper', 'Jobs', 'Lovelace',
+              'Torvalds', 'Turing')
+
+
+def is_seeded():
+    return User.objects.filter(username__startswith=SEED_PREFIX).exists()
+
+
+@transaction.atomic
+def seed_bills(users=100, services=10, bills=1000, lines=5, months=36,
+               seed=0):
+    ''' Create coworkers, services and bills of lines lines, return bills
+
+        Bills are spread over the last months, the same arguments always
+        give the same data. Rows are inserted with bulk_create and bill
+        amounts are computed by the database, like generated bills.
+    '''
+    rng = random.Random(seed)
+
+    User.objects.bulk_create((
+        User(username='%s%06d' % (SEED_PREFIX, i),
+             first_name=rng.choice(FIRST_NAMES),
+             last_name=rng.choice(LAST_NAMES),
+             email='%s%06d@example.com' % (SEED_PREFIX, i),
+             password='!')
+        for i in range(users)), batch_size=BATCH_SIZE)
+    user_ids = list(User.objects
+                    .filter(username__startswith=SEED_PREFIX)
+                    .order_by('username')
+                    .values_list('pk', flat=True))
+    addresses = {user_id: '%d rue de la Paix\n75000 Paris' % user_id
+                 for user_id in user_ids}
+    UserProfile.objects.bulk_create((
+        UserProfile(user_id=user_id, billing_address=address)
+        for user_id, address in addresses.items()), batch_size=BATCH_SIZE)
+
+    created = Service.objects.bulk_create(
+            Service(reference='SD%03d' % i, name='Seeded service %d' % i,
+                    description='Service created to seed bills',
+                    price=Decimal(rng.randrange(500, 30000)) / 100)
+            for i in range(services))
+    prices = dict(Service.objects
+                  .filter(reference__in=[s.reference for s in created],
+                          description='Service created to seed bills')
+                  .values_list('pk', 'price'))
+    service_ids = sorted(prices)
+
+    today = datetime.date.today()
+    days = months * 30
+    dates = [today - datetime.timedelta(days=days - days * i // bills)
+             for i in range(bills)]
+    numbers = ['S%010d' % i for i in range(bills)]
+    bill_users = [rng.choice(user_ids) for i in range(bills)]
+    Bill.objects.bulk_create((
+        Bill(user_id=user_id, number=number, amount=0,
+             # bills older than two months are mostly paid
+             isPaid=(today - date).days > 60 and rng.random() < 0.9,
+             billing_address=addresses[user_id])
+        for number, user_id, date in zip(numbers, bill_users, dates)),
+        batch_size=BATCH_SIZE)
+    bill_ids = {}
+    for numbers_chunk in chunks(numbers):
+        bill_ids.update(Bill.objects.filter(number__in=numbers_chunk)
+                        .values_list('number', 'pk'))
+
+    # billing_date is set to today on insert
+    by_date = {}
+    for number, date in zip(numbers, dates):
+        by_date.setdefault(date, []).append(bill_ids[number])
+    for date, ids in by_date.items():
+        for ids_chunk in chunks(ids):
+            Bill.objects.filter(pk__in=ids_chunk).update(billing_date=date)
+
+    batch = []
+    for number in numbers:
+        for i in range(lines):
+            service_id = rng.choice(service_ids)
+            quantity = rng.randint(1, 3)
+            batch.append(BillLine(
+                bill_id=bill_ids[number], service_id=service_id,
+                quantity=quantity, total=prices[service_id] * quantity))
+        if len(batch) >= BATCH_SIZE * 10:
+            BillLine.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+            batch = []
+    BillLine.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+
+    for ids_chunk in chunks(list(bill_ids.values())):
+        update_bill_amounts(*ids_chunk)
+    return bills
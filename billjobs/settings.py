@@ -2,6 +2,8 @@
 
 from django.conf import settings
 import os.path
+import sys
+import types
 
 BILLJOBS_BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 BILLJOBS_DEFAULT = dict(
@@ -19,53 +21,86 @@ BILLJOBS_DEFAULT = dict(
             You can use htlm in this setting.
             """,
         FORCE_SUPERUSER=False,
-        FORCE_USER_GROUP=None
+        FORCE_USER_GROUP=None,
+        PDF_EXPORT_WORKERS=4,
+        PDF_CACHE=None,
+        PDF_CACHE_TIMEOUT=None,
+        PDF_ASYNC=False,
+        PDF_JOB_TIMEOUT=600,
+        PDF_RENDER_CONCURRENCY=None,
+        PDF_RENDER_WAIT=10,
+        API_CACHE=None,
+        API_CACHE_TIMEOUT=600,
+        API_PAGE_SIZE=20,
+        SLACK_TOKEN=False,
+        SLACK_CHANNEL=False,
+        SLACK_API_URL='https://slack.com/api/',
+        SLACK_TIMEOUT=5,
+        SLACK_RETRIES=3,
+        INSTRUMENTATION=False,
+        INVOICE_EMAIL_FROM=None,
+        INVOICE_EMAIL_BATCH_SIZE=50
         )
 
 
-BILLJOBS_DEBUG_PDF = getattr(settings, 'DEBUG', BILLJOBS_DEFAULT['DEBUG'])
-BILLJOBS_BILL_LOGO_PATH = getattr(
-        settings,
-        'BILLJOBS_BILL_LOGO_PATH',
-        BILLJOBS_DEFAULT['LOGO_PATH']
-        )
-BILLJOBS_BILL_LOGO_WIDTH = getattr(
-        settings,
-        'BILLJOBS_BILL_LOGO_WIDTH',
-        BILLJOBS_DEFAULT['LOGO_WIDTH']
-        )
-BILLJOBS_BILL_LOGO_HEIGHT = getattr(
-        settings,
-        'BILLJOBS_BILL_LOGO_HEIGHT',
-        BILLJOBS_DEFAULT['LOGO_HEIGHT']
-        )
-BILLJOBS_BILL_ISSUER = getattr(
-        settings,
-        'BILLJOBS_BILL_ISSUER',
-        BILLJOBS_DEFAULT['ISSUER']
-        )
-BILLJOBS_BILL_PAYMENT_INFO = getattr(
-        settings,
-        'BILLJOBS_BILL_PAYMENT_INFO',
-        BILLJOBS_DEFAULT['PAYMENT_INFO']
-        )
-BILLJOBS_FORCE_SUPERUSER = getattr(
-        settings,
-        'BILLJOBS_FORCE_SUPERUSER',
-        BILLJOBS_DEFAULT['FORCE_SUPERUSER']
-        )
-BILLJOBS_FORCE_USER_GROUP = getattr(
-        settings,
-        'BILLJOBS_FORCE_USER_GROUP',
-        BILLJOBS_DEFAULT['FORCE_USER_GROUP']
-        )
-BILLJOBS_SLACK_TOKEN = getattr(
-        settings,
-        'BILLJOBS_SLACK_TOKEN',
-        False
-        )
-BILLJOBS_SLACK_CHANNEL = getattr(
-        settings,
-        'BILLJOBS_SLACK_CHANNEL',
-        False
+# Django setting and BILLJOBS_DEFAULT key of settings not named BILLJOBS_<key>
+SETTING_NAMES = dict(
+        DEBUG_PDF=('DEBUG', 'DEBUG'),
+        BILL_LOGO_PATH=('BILLJOBS_BILL_LOGO_PATH', 'LOGO_PATH'),
+        BILL_LOGO_WIDTH=('BILLJOBS_BILL_LOGO_WIDTH', 'LOGO_WIDTH'),
+        BILL_LOGO_HEIGHT=('BILLJOBS_BILL_LOGO_HEIGHT', 'LOGO_HEIGHT'),
+        BILL_ISSUER=('BILLJOBS_BILL_ISSUER', 'ISSUER'),
+        BILL_PAYMENT_INFO=('BILLJOBS_BILL_PAYMENT_INFO', 'PAYMENT_INFO'),
         )
+
+
+class BilljobsSettings(object):
+    ''' Billjobs settings, read from Django settings on first use
+
+        billjobs_settings.PDF_CACHE is the BILLJOBS_PDF_CACHE setting, or its
+        default when the project does not set it. A value is read once, then
+        kept until reload() is called when a Django setting changes.
+    '''
+
+    def __getattr__(self, name):
+        setting, key = SETTING_NAMES.get(name, ('BILLJOBS_' + name, name))
+        try:
+            default = BILLJOBS_DEFAULT[key]
+        except KeyError:
+            raise AttributeError('Unknown billjobs setting %s' % name)
+        value = getattr(settings, setting, default)
+        # next reads find the attribute without calling __getattr__
+        self.__dict__[name] = value
+        return value
+
+    def reload(self):
+        ''' Forget read values, they are read again on next use '''
+        self.__dict__.clear()
+
+    def is_billjobs_setting(self, setting):
+        ''' Return True if billjobs reads the Django setting named setting '''
+        return setting.startswith('BILLJOBS_') or setting == 'DEBUG'
+
+
+billjobs_settings = BilljobsSettings()
+
+
+class SettingsModule(types.ModuleType):
+    ''' billjobs.settings module, still giving the old BILLJOBS_* constants
+
+        BILLJOBS_BILL_ISSUER is billjobs_settings.BILL_ISSUER, read when it
+        is imported. The class of the module is replaced since module
+        __getattr__ needs python 3.7.
+    '''
+
+    def __getattr__(self, name):
+        if name.startswith('BILLJOBS_'):
+            try:
+                return getattr(billjobs_settings, name[len('BILLJOBS_'):])
+            except AttributeError:
+                pass
+        raise AttributeError(
+                'module %r has no attribute %r' % (self.__name__, name))
+
+
+sys.modules[__name__].__class__ = SettingsModule
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from django.db.models import Case, DecimalField, Prefetch, Q, Sum, When
+from django.db.models.functions import Coalesce
+from .cache import get_api_version, get_pdf_cache, render_slot, \
+        settings_digest
+from .instrumentation import observe, timed
+from .models import BATCH_SIZE, Bill, BillLine, UserProfile
+from .settings import billjobs_settings
+
+
+def statement_bills(user_id, batch_size=BATCH_SIZE):
+    ''' Yield bills of a coworker, oldest first, with lines and services
+
+        Bills are read by batches of batch_size, each batch with two
+        queries: one for bills, one for their lines and services. Only one
+        batch is kept in memory, the next one starts after the billing date
+        and id of the last bill read.
+    '''
+    lines = BillLine.objects.select_related('service').order_by('pk')
+    bills = (Bill.objects
+             .filter(user_id=user_id)
+             .only('user', 'number', 'billing_date', 'amount', 'isPaid',
+                   'credited_bill')
+             .order_by('billing_date', 'pk')
+             .prefetch_related(Prefetch('billline_set', queryset=lines)))
+    batch = bills
+    while True:
+        batch = list(batch[:batch_size])
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        last = batch[-1]
+        batch = bills.filter(billing_date__gte=last.billing_date).filter(
+                Q(billing_date__gt=last.billing_date) | Q(pk__gt=last.pk))
+
+
+def statement_totals(user_id):
+    ''' Return billed, paid and unpaid amounts of a coworker with one query
+
+        Credit notes have negative amounts, they are deducted.
+    '''
+    return Bill.objects.filter(user_id=user_id).aggregate(
+            billed=Coalesce(Sum('amount'), 0),
+            paid=Coalesce(Sum(Case(
+                When(isPaid=True, then='amount'),
+                output_field=DecimalField())), 0),
+            unpaid=Coalesce(Sum(Case(
+                When(isPaid=False, then='amount'),
+                output_field=DecimalField())), 0))
+
+
+def render_statement(user, date, limited=False):
+    ''' Render the statement of a coworker at date, return the pdf '''
+    # pdf module loads reportlab, it is only needed on cache miss
+    from .pdf import render_statement_pdf
+
+    billing_address = (UserProfile.objects
+                       .filter(user=user)
+                       .values_list('billing_address', flat=True)
+                       .first())
+    with render_slot(limited), timed('pdf_render_seconds'):
+        pdf = render_statement_pdf(
+                user, billing_address or '', statement_bills(user.pk),
+                statement_totals(user.pk), date)
+    observe('pdf_bytes', len(pdf))
+    return pdf
+
+
+def statement_digest(user_id, versions, date):
+    ''' Hash of what a statement depends on, None without versions '''
+    if versions is None:
+        return None
+    return hashlib.sha1(repr((
+        settings_digest(), billjobs_settings.BILL_ISSUER, user_id, versions,
+        date.isoformat())).encode('utf-8')).hexdigest()
+
+
+def statement_filename(user, date):
+    return 'releve-{}-{}.pdf'.format(user.username, date.isoformat())
+
+
+def statement_key(digest):
+    ''' Cache key of a statement pdf '''
+    return 'billjobs:pdf:statement:%s' % digest
+
+
+def get_statement_digest(user_id, date):
+    ''' Return digest of the statement of a coworker at date or None
+
+        The digest changes with the api version of the coworker, given to
+        each change of its bills, lines, profile and services. It is None
+        when the api cache is disabled.
+    '''
+    return statement_digest(user_id, get_api_version(user_id), date)
+
+
+def get_statement_pdf(user, date, digest, limited=False):
+    ''' Return the statement pdf of a coworker at date
+
+        digest is given by get_statement_digest(), the pdf is cached with it
+        until a bill of the coworker changes. It is rendered each time when
+        the digest is None or the pdf cache is disabled.
+    '''
+    cache = get_pdf_cache()
+    if cache is None or digest is None:
+        return render_statement(user, date, limited)
+
+    pdf = cache.get(statement_key(digest))
+    if pdf is None:
+        pdf = render_statement(user, date, limited)
+        cache.set(statement_key(digest), pdf,
+                  billjobs_settings.PDF_CACHE_TIMEOUT)
+    return pdf
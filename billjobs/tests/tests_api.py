@@ -0,0 +1,114 @@
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from billjobs.models import Bill, BillLine, Service
+
+
+@override_settings(BILLJOBS_API_CACHE='default')
+class ApiTestCase(TestCase):
+    ''' Tests for the json read api of coworker data '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.get(username='bill')
+        self.client.force_login(self.user)
+
+    def test_authentication_required(self):
+        ''' Test anonymous request is refused '''
+        self.client.logout()
+        response = self.client.get('/billjobs/api/bills/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_bill_list_keyset_pagination(self):
+        ''' Test pages follow each other without offset '''
+        for i in range(4):
+            Bill(user=self.user).save()
+        numbers = list(Bill.objects.filter(user=self.user)
+                       .order_by('-billing_date', '-pk')
+                       .values_list('number', flat=True))
+        self.assertEqual(len(numbers), 5)
+        url, pages = '/billjobs/api/bills/?limit=2', []
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                data = self.client.get(url).json()
+                pages.append([bill['number'] for bill in data['results']])
+                url = data['next']
+        self.assertEqual(pages, [numbers[0:2], numbers[2:4], numbers[4:]])
+        for query in queries.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+
+    def test_bill_list_invalid_cursor(self):
+        ''' Test an invalid cursor is a bad request '''
+        response = self.client.get('/billjobs/api/bills/?cursor=2014-04')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+    def test_bill_detail(self):
+        ''' Test bill is sent with its lines, only to its coworker '''
+        bill = Bill.objects.get(number='F201404001')
+        data = self.client.get('/billjobs/api/bills/%d/' % bill.pk).json()
+        self.assertEqual(data['amount'], '180.00')
+        self.assertEqual(data['lines'][0]['service']['reference'], 'FT001')
+        other = Bill.objects.get(number='F201405002')
+        response = self.client.get('/billjobs/api/bills/%d/' % other.pk)
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_and_cached_response(self):
+        ''' Test unchanged data is not read again, changed data is '''
+        url = '/billjobs/api/bills/'
+        first = self.client.get(url)
+        # session and user of each request only
+        with self.assertNumQueries(4):
+            cached = self.client.get(url)
+            not_modified = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(cached.content, first.content)
+        self.assertEqual(not_modified.status_code, 304)
+
+        BillLine.objects.create(
+                bill=Bill.objects.get(number='F201404001'),
+                service=Service.objects.get(pk=2))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.json()['results'][0]['amount'], '280.00')
+
+    @override_settings(BILLJOBS_API_CACHE=None)
+    def test_conditional_response_without_cache(self):
+        ''' Test ETag is a hash of the response without api cache '''
+        url = '/billjobs/api/bills/'
+        first = self.client.get(url)
+        self.assertNotIn('Last-Modified', first)
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], first['ETag'])
+
+        BillLine.objects.create(
+                bill=Bill.objects.get(number='F201404001'),
+                service=Service.objects.get(pk=2))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_cache_is_per_user(self):
+        ''' Test another coworker does not get a cached response '''
+        self.client.get('/billjobs/api/profile/')
+        self.client.force_login(User.objects.get(username='steve'))
+        data = self.client.get('/billjobs/api/profile/').json()
+        self.assertEqual(data['username'], 'steve')
+
+    def test_service_change_update_services(self):
+        ''' Test services response changes with a service '''
+        url = '/billjobs/api/services/'
+        first = self.client.get(url)
+        service = Service.objects.get(reference='FT001')
+        service.name = 'Full Time Access'
+        service.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Full Time Access', response.content.decode())
@@ -1,10 +1,15 @@
 import csv
+import gzip
 import io
+import tracemalloc
 from django.test import TestCase
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.contrib.admin.sites import AdminSite
 from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
 from billjobs.admin import UserAdmin
+from billjobs.export import stream_email_csv
 
 class MockRequest(object):
             pass
@@ -32,11 +37,11 @@ class EmailExportTestCase(TestCase):
                 'Export email of selected users')
 
     def test_action_return_http_response(self):
-        """ Test method return an HttpResponse """
+        """ Test method return a StreamingHttpResponse """
         user_admin = UserAdmin(User, self.site)
         response = user_admin.export_email(request=MockRequest(),
                 queryset=self.query_set)
-        self.assertIsInstance(response, HttpResponse)
+        self.assertIsInstance(response, StreamingHttpResponse)
 
     def test_action_return_csv(self):
         """ Test method return text/csv as http response content type """
@@ -52,6 +57,51 @@ class EmailExportTestCase(TestCase):
                 queryset=self.query_set)
         output = io.StringIO()
         writer = csv.writer(output)
-        for email in User.objects.values_list('email'):
-            writer.writerow(email)
-        self.assertEqual(response.content.decode(), output.getvalue())
+        writer.writerow(['email', 'first_name', 'last_name'])
+        for row in User.objects.order_by('pk').values_list(
+                'email', 'first_name', 'last_name'):
+            writer.writerow(row)
+        self.assertEqual(
+                b''.join(response.streaming_content).decode(),
+                output.getvalue())
+
+    def test_endpoint_return_gzip_csv(self):
+        """ Test staff endpoint return compressed csv """
+        self.client.force_login(User.objects.get(username='superuser'))
+        response = self.client.get('/billjobs/export/emails.csv',
+                                   {'gzip': ''})
+        self.assertEqual(response.get('Content-Type'), 'application/gzip')
+        content = gzip.decompress(b''.join(response.streaming_content))
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows[0], ['email', 'first_name', 'last_name'])
+        self.assertEqual(len(rows), User.objects.count() + 1)
+
+    def test_endpoint_require_permission(self):
+        """ Test a staff account without permission is refused """
+        member = User.objects.create_user('member', is_staff=True)
+        self.client.force_login(member)
+        response = self.client.get('/billjobs/export/emails.csv')
+        self.assertEqual(response.status_code, 403)
+
+    def test_export_memory_is_constant(self):
+        """ Test exporting 500k users does not keep them in memory """
+        # creating 500k model instances is much slower than the export
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                    'INSERT INTO auth_user (password, is_superuser, username,'
+                    ' first_name, last_name, email, is_staff, is_active,'
+                    ' date_joined) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                    (('', False, 'user%d' % i, 'User', str(i),
+                      'user%d@billjobs.org' % i, False, True, now)
+                     for i in range(500000)))
+        tracemalloc.start()
+        try:
+            rows = sum(chunk.count('\n') for chunk in
+                       stream_email_csv(User.objects.all()))
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(rows, User.objects.count() + 1)
+        # the whole csv is more than 15MB
+        self.assertLess(peak, 4 * 1024 * 1024)
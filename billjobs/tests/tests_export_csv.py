@@ -0,0 +1,93 @@
+import csv
+import io
+import os
+import tempfile
+from django.test import TestCase
+from django.http import StreamingHttpResponse
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from billjobs.admin import BillAdmin
+from billjobs.export import ACCOUNTING_HEADER
+from billjobs.models import Bill
+
+
+class MockRequest(object):
+    pass
+
+
+def read_csv(content):
+    return list(csv.reader(io.StringIO(content)))
+
+
+class AccountingCsvExportTestCase(TestCase):
+    ''' Tests for accounting export of bills and lines '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        self.bill_admin = BillAdmin(Bill, AdminSite())
+
+    def test_action_return_streaming_csv(self):
+        ''' Test action stream one row per line after the header '''
+        response = self.bill_admin.export_accounting_csv(
+                MockRequest(), self.bill_admin.get_queryset(MockRequest()))
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response.get('Content-Type'), 'text/csv')
+        rows = read_csv(b''.join(response).decode('utf-8'))
+        self.assertEqual(tuple(rows[0]), ACCOUNTING_HEADER)
+        self.assertEqual(
+                [row[0] for row in rows[1:]],
+                ['F201404001', 'F201405002', 'F201501003', 'F201704004'])
+        self.assertEqual(rows[1][1], '2014-04-02')
+
+    def test_bill_without_line(self):
+        ''' Test a bill without line is exported with empty line columns '''
+        bill = Bill(user=User.objects.get(username='bill'))
+        bill.save()
+        response = self.bill_admin.export_accounting_csv(
+                MockRequest(), Bill.objects.filter(pk=bill.pk))
+        rows = read_csv(b''.join(response).decode('utf-8'))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][0], bill.number)
+        self.assertEqual(rows[1][6:], [''] * 6)
+
+    def test_view_filter_fiscal_year(self):
+        ''' Test staff view export bills of a period '''
+        self.client.force_login(User.objects.get(username='bill'))
+        response = self.client.get(
+                '/billjobs/export/bills.csv',
+                {'since': '2014-01-01', 'until': '2014-12-31'})
+        self.assertEqual(response.status_code, 200)
+        rows = read_csv(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(
+                [row[0] for row in rows[1:]], ['F201404001', 'F201405002'])
+        response = self.client.get(
+                '/billjobs/export/bills.csv', {'since': '2014'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_view_require_staff(self):
+        ''' Test anonymous user is redirected to login '''
+        response = self.client.get('/billjobs/export/bills.csv')
+        self.assertEqual(response.status_code, 302)
+
+    def test_view_require_permission(self):
+        ''' Test a signed up coworker without permission is refused '''
+        member = User.objects.create_user('member', is_staff=True)
+        self.client.force_login(member)
+        response = self.client.get('/billjobs/export/bills.csv')
+        self.assertEqual(response.status_code, 403)
+
+    def test_command_write_csv(self):
+        ''' Test management command write the csv of filtered bills '''
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        call_command('export_bills_csv', path, unpaid=True,
+                     stdout=io.StringIO())
+        with open(path, newline='') as output:
+            rows = list(csv.reader(output))
+        self.assertEqual(
+                [row[0] for row in rows[1:]],
+                ['F201404001', 'F201405002', 'F201501003'])
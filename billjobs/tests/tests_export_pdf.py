@@ -0,0 +1,93 @@
+import io
+import os
+import tempfile
+import zipfile
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.http import StreamingHttpResponse
+from django.contrib.admin.sites import AdminSite
+from django.core.management import call_command
+from billjobs.admin import BillAdmin
+from billjobs.cache import bill_digest, get_cached_pdf
+from billjobs.export import iter_export_bills, iter_rendered_pdfs
+from billjobs.models import Bill
+
+
+class MockRequest(object):
+    pass
+
+
+class BillPdfZipExportTestCase(TestCase):
+    ''' Tests for bulk pdf export of bills '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        self.bill_admin = BillAdmin(Bill, AdminSite())
+
+    def test_action_is_available(self):
+        ''' Test export is a BillAdmin action '''
+        self.assertTrue('export_pdf_zip' in BillAdmin.actions)
+
+    def test_action_return_streaming_zip(self):
+        ''' Test action stream a zip archive with one pdf per bill '''
+        response = self.bill_admin.export_pdf_zip(
+                MockRequest(), Bill.objects.all())
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response.get('Content-Type'), 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response)))
+        self.assertEqual(
+                sorted(archive.namelist()),
+                sorted('%s.pdf' % bill.number for bill in Bill.objects.all()))
+        for name in archive.namelist():
+            self.assertTrue(archive.read(name).startswith(b'%PDF'))
+
+    def test_action_export_only_selected_bills(self):
+        ''' Test archive contains only bills of the queryset '''
+        response = self.bill_admin.export_pdf_zip(
+                MockRequest(), Bill.objects.filter(number='F201404001'))
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response)))
+        self.assertEqual(archive.namelist(), ['F201404001.pdf'])
+
+    def test_command_write_archive(self):
+        ''' Test management command write the archive of filtered bills '''
+        fd, path = tempfile.mkstemp(suffix='.zip')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        call_command('export_bills_pdf', path, since='2015-01-01',
+                     workers=2, stdout=io.StringIO())
+        with zipfile.ZipFile(path) as archive:
+            self.assertEqual(
+                    sorted(archive.namelist()),
+                    ['F201501003.pdf', 'F201704004.pdf'])
+
+    def test_bills_by_chunks(self):
+        ''' Test bills are read by pk order, one chunk after the other '''
+        expected = list(Bill.objects.order_by('pk')
+                        .values_list('pk', flat=True))
+        # bills, lines and services of two chunks, then an empty chunk
+        with self.assertNumQueries(7):
+            bills = [(bill.pk, bill.user.username,
+                      [line.service.name for line in bill.billline_set.all()])
+                     for bill in iter_export_bills(Bill.objects.all(), 2)]
+        self.assertEqual([pk for pk, username, services in bills], expected)
+
+    @override_settings(BILLJOBS_PDF_CACHE='default')
+    def test_render_in_processes(self):
+        ''' Test pdf rendered by worker processes are cached by this one '''
+        cache.clear()
+        pdfs = list(iter_rendered_pdfs(Bill.objects.all(), workers=2))
+        self.assertEqual(
+                [bill.pk for bill, pdf in pdfs],
+                list(Bill.objects.order_by('pk').values_list('pk', flat=True)))
+        for bill, pdf in pdfs:
+            self.assertTrue(pdf.startswith(b'%PDF'))
+            self.assertEqual(get_cached_pdf(bill_digest(bill)), pdf)
+        with mock.patch('billjobs.export.ProcessPoolExecutor.submit') \
+                as submit:
+            cached = list(iter_rendered_pdfs(Bill.objects.all(), workers=2))
+        submit.assert_not_called()
+        self.assertEqual([pdf for bill, pdf in cached],
+                         [pdf for bill, pdf in pdfs])
@@ -1,5 +1,8 @@
 from django.test import TestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from billjobs.models import Bill, BillLine, Service
 
 
 class BillingAdminListViewTestCase(TestCase):
@@ -14,3 +17,119 @@ class BillingAdminListViewTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response,
                 '<td class="field-coworker_name_link"><a href="/admin/auth/user/1/change/">Bill Jobs</a></td>')
+
+    def test_changelist_query_count_does_not_depend_on_bills(self):
+        ''' Test list view runs the same queries for 1 or 50 bills '''
+        admin = User.objects.get(pk=1)
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as one_bill:
+            self.client.get('/admin/billjobs/bill/')
+        for i in range(49):
+            Bill(user=admin).save()
+        with self.assertNumQueries(len(one_bill)):
+            response = self.client.get('/admin/billjobs/bill/')
+        self.assertEqual(len(response.context['cl'].result_list), 50)
+        # session, user, count, bills
+        self.assertEqual(len(one_bill), 4)
+
+    def test_actions_get_whole_bills(self):
+        ''' Test only listed bills skip address columns '''
+        admin = User.objects.get(pk=1)
+        self.client.force_login(admin)
+        cl = self.client.get('/admin/billjobs/bill/').context['cl']
+        self.assertIn('billing_address',
+                      cl.result_list[0].get_deferred_fields())
+        # queryset given to actions
+        with self.assertNumQueries(1):
+            bill = cl.queryset.first()
+            bill.billing_address, bill.issuer_address, bill.user.email
+
+
+class BillingAdminChangeViewTestCase(TestCase):
+    ''' Test bill creation from admin change view '''
+    fixtures = ['test_billing_admin.yaml', 'dev_model_030_service.yaml']
+
+    def test_bill_amount_with_inline_lines(self):
+        ''' Test bill amount is the sum of lines saved by the inline '''
+        self.client.force_login(User.objects.get(pk=1))
+        data = {
+                'user': 1,
+                'isPaid': '',
+                'billline_set-TOTAL_FORMS': 2,
+                'billline_set-INITIAL_FORMS': 0,
+                'billline_set-MIN_NUM_FORMS': 0,
+                'billline_set-MAX_NUM_FORMS': 1000,
+                'billline_set-0-service': 1,
+                'billline_set-0-quantity': 2,
+                'billline_set-0-total': '',
+                'billline_set-0-note': '',
+                'billline_set-1-service': 2,
+                'billline_set-1-quantity': 1,
+                'billline_set-1-total': '',
+                'billline_set-1-note': '',
+                }
+        response = self.client.post('/admin/billjobs/bill/add/', data)
+        self.assertEqual(response.status_code, 302)
+        bill = Bill.objects.latest('pk')
+        self.assertEqual(bill.billline_set.count(), 2)
+        self.assertEqual(
+                bill.amount,
+                2 * Service.objects.get(pk=1).price +
+                Service.objects.get(pk=2).price)
+
+    def test_change_view_reads_services_once(self):
+        ''' Test service choices of every line come from one query '''
+        admin = User.objects.get(pk=1)
+        self.client.force_login(admin)
+        bill = Bill.objects.create(user=admin)
+        BillLine.objects.bulk_create(
+                BillLine(bill=bill, service_id=1, quantity=1, total=1)
+                for i in range(40))
+        url = '/admin/billjobs/bill/%d/change/' % bill.pk
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([
+            query for query in queries
+            if query['sql'].startswith('SELECT') and
+            'FROM "billjobs_service"' in query['sql']]), 1)
+        # a change made by another process, without signal, is read
+        Service.objects.filter(pk=2).update(is_available=False)
+        response = self.client.get(url)
+        self.assertNotContains(response, '<option value="2">')
+
+    def test_unavailable_service_of_line(self):
+        ''' Test an unavailable service is only a choice of its lines '''
+        admin = User.objects.get(pk=1)
+        self.client.force_login(admin)
+        bill = Bill.objects.create(user=admin)
+        line = BillLine.objects.create(bill=bill, service_id=4)
+        data = {
+                'user': 1,
+                'isPaid': '',
+                'billline_set-TOTAL_FORMS': 2,
+                'billline_set-INITIAL_FORMS': 1,
+                'billline_set-MIN_NUM_FORMS': 0,
+                'billline_set-MAX_NUM_FORMS': 1000,
+                'billline_set-0-id': line.pk,
+                'billline_set-0-bill': bill.pk,
+                'billline_set-0-service': 4,
+                'billline_set-0-quantity': 2,
+                'billline_set-0-total': '',
+                'billline_set-0-note': '',
+                'billline_set-1-bill': bill.pk,
+                'billline_set-1-service': 4,
+                'billline_set-1-quantity': 1,
+                'billline_set-1-total': '',
+                'billline_set-1-note': '',
+                }
+        url = '/admin/billjobs/bill/%d/change/' % bill.pk
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 200)
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(formset.forms[0].errors, {})
+        self.assertIn('service', formset.forms[1].errors)
+        data['billline_set-TOTAL_FORMS'] = 1
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(BillLine.objects.get(pk=line.pk).quantity, 2)
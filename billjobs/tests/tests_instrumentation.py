@@ -0,0 +1,93 @@
+import json
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from billjobs.instrumentation import metrics, timed
+from billjobs.models import Bill
+
+
+class InstrumentationDisabledTestCase(TestCase):
+    ''' Tests instrumentation costs nothing when disabled '''
+
+    def setUp(self):
+        metrics.clear()
+
+    def test_nothing_recorded(self):
+        ''' Test requests and blocks are not recorded '''
+        with timed('block_seconds'):
+            pass
+        self.client.get('/billjobs/signup/')
+        self.assertEqual(metrics.summaries, {})
+
+    def test_metrics_not_found(self):
+        ''' Test metrics endpoint does not exist '''
+        response = self.client.get('/billjobs/metrics')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(BILLJOBS_INSTRUMENTATION=True)
+class InstrumentationTestCase(TestCase):
+    ''' Tests for request metrics and log lines '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        cache.clear()
+        metrics.clear()
+        self.client.force_login(User.objects.get(username='bill'))
+        self.url = '/billjobs/generate_pdf/%d' % Bill.objects.get(
+                number='F201404001').pk
+
+    def test_request_log_line(self):
+        ''' Test a json log line gives queries and pdf values of request '''
+        with self.assertLogs('billjobs.instrumentation', 'INFO') as logs:
+            self.client.get(self.url)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'generate-pdf')
+        self.assertEqual(line['status'], 200)
+        self.assertGreater(line['db_queries'], 0)
+        self.assertGreater(line['pdf_bytes'], 0)
+        self.assertIn('pdf_render_seconds', line)
+
+    def test_streaming_response_recorded_once_sent(self):
+        ''' Test queries of a streaming response are recorded once sent '''
+        with self.assertLogs('billjobs.instrumentation', 'INFO') as logs:
+            response = self.client.get('/billjobs/export/bills.csv')
+            self.assertTrue(response.streaming)
+            self.assertEqual(metrics.summaries, {})
+            b''.join(response.streaming_content)
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'export-bills-csv')
+        # session, user and rows of the export
+        self.assertEqual(line['db_queries'], 3)
+
+    def test_prometheus_metrics(self):
+        ''' Test metrics endpoint renders recorded summaries '''
+        self.client.get(self.url)
+        with timed('block_seconds', part='test') as labels:
+            labels['status'] = 'done'
+        content = self.client.get('/billjobs/metrics').content.decode()
+        self.assertIn('# TYPE billjobs_request_seconds summary', content)
+        self.assertIn(
+                'billjobs_request_seconds_count{method="GET",status="200",'
+                'view="generate-pdf"} 1', content)
+        self.assertIn(
+                'billjobs_db_queries_count{view="generate-pdf"} 1', content)
+        self.assertIn('billjobs_pdf_render_seconds_count 1', content)
+        self.assertIn(
+                'billjobs_block_seconds_count{part="test",status="done"} 1',
+                content)
+
+    def test_metrics_access(self):
+        ''' Test metrics are refused to other addresses than INTERNAL_IPS '''
+        self.client.logout()
+        response = self.client.get('/billjobs/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+        member = User.objects.create_user('member', is_staff=True)
+        self.client.force_login(member)
+        response = self.client.get('/billjobs/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(User.objects.get(username='bill'))
+        response = self.client.get('/billjobs/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,183 @@
+import io
+from decimal import Decimal
+from django.test import TestCase
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.db.models import Sum
+from billjobs.ledger import CreditNoteError, credit_bill
+from billjobs.models import Bill, BillLine, LedgerEntry, Service, \
+        coworker_balance
+from billjobs.reconciliation import mark_bills_paid
+
+
+class LedgerTestCase(TestCase):
+    ''' Tests for ledger entries appended by bill changes '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        self.user = User.objects.get(username='bill')
+        self.service = Service.objects.get(pk=1)
+
+    def unpaid_amount(self, user):
+        return Bill.objects.filter(user=user, isPaid=False).aggregate(
+                amount=Sum('amount'))['amount'] or Decimal(0)
+
+    def assertBalances(self):
+        for user in User.objects.all():
+            self.assertEqual(coworker_balance(user.pk),
+                             self.unpaid_amount(user))
+
+    def entries(self, bill_id):
+        return list(LedgerEntry.objects.filter(bill_id=bill_id)
+                    .order_by('pk').values_list('kind', 'amount'))
+
+    def test_fixture_balances(self):
+        ''' Test balance of each coworker is the amount of unpaid bills '''
+        self.assertBalances()
+
+    def test_line_changes(self):
+        ''' Test each change of a bill amount appends an entry '''
+        bill = Bill.objects.create(user=self.user)
+        line = BillLine.objects.create(
+                bill=bill, service=self.service, quantity=2)
+        line.quantity = 3
+        line.total = 0
+        line.save()
+        price = self.service.price
+        self.assertEqual(self.entries(bill.pk), [
+            (LedgerEntry.BILLED, 2 * price), (LedgerEntry.BILLED, price)])
+        self.assertBalances()
+
+    def test_paid_changes(self):
+        ''' Test paid status changes from save and update append entries '''
+        bill = Bill.objects.get(number='F201404001')
+        bill.isPaid = True
+        bill.save()
+        Bill.objects.filter(pk=bill.pk).update(isPaid=False)
+        mark_bills_paid([bill.pk])
+        self.assertEqual(self.entries(bill.pk)[1:], [
+            (LedgerEntry.PAID, -bill.amount)])
+        bill.isPaid = False
+        bill.save()
+        self.assertEqual(self.entries(bill.pk)[2:], [
+            (LedgerEntry.UNPAID, bill.amount)])
+        self.assertBalances()
+
+    def test_moved_and_deleted_bill(self):
+        ''' Test a bill given to another coworker then deleted '''
+        bill = Bill.objects.get(number='F201404001')
+        other = User.objects.get(pk=2)
+        bill.user = other
+        bill.save()
+        self.assertBalances()
+        bill_id = bill.pk
+        bill.delete()
+        self.assertEqual(self.entries(bill_id)[1:], [
+            (LedgerEntry.MOVED, -bill.amount),
+            (LedgerEntry.MOVED, bill.amount),
+            (LedgerEntry.DELETED, -bill.amount)])
+        self.assertBalances()
+
+    def test_deleted_bill_with_lines(self):
+        ''' Test deleting a bill with many lines appends one entry '''
+        bill = Bill.objects.create(user=self.user)
+        for i in range(3):
+            BillLine.objects.create(
+                    bill=bill, service=self.service, quantity=1)
+        count = LedgerEntry.objects.count()
+        bill_id = bill.pk
+        Bill.objects.filter(pk=bill_id).delete()
+        self.assertEqual(LedgerEntry.objects.count(), count + 1)
+        self.assertEqual(self.entries(bill_id)[-1], (
+            LedgerEntry.DELETED, -3 * self.service.price))
+        self.assertBalances()
+        # lines of other bills still update their bill
+        line = BillLine.objects.create(
+                bill=Bill.objects.create(user=self.user),
+                service=self.service, quantity=1)
+        self.assertEqual(Bill.objects.get(pk=line.bill_id).amount,
+                         self.service.price)
+
+    def test_entries_are_append_only(self):
+        ''' Test an entry can not be changed or deleted '''
+        entry = LedgerEntry.objects.first()
+        entry.amount = 0
+        with self.assertRaises(ValueError):
+            entry.save()
+        with self.assertRaises(ValueError):
+            entry.delete()
+
+    def test_balance_reads_one_entry(self):
+        ''' Test balance comes from one query '''
+        with self.assertNumQueries(1):
+            coworker_balance(self.user.pk)
+
+    def test_rebuild_command(self):
+        ''' Test rebuilt ledger gives the same balances '''
+        bill = Bill.objects.get(number='F201404001')
+        bill.isPaid = True
+        bill.save()
+        output = io.StringIO()
+        call_command('rebuild_ledger', stdout=output)
+        # four bills, one paid in fixtures and one paid above
+        self.assertEqual(output.getvalue(), '6 ledger entries written\n')
+        self.assertBalances()
+
+
+class CreditNoteTestCase(TestCase):
+    ''' Tests for credit notes of bills '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        self.bill = Bill.objects.get(number='F201404001')
+        self.user = self.bill.user
+
+    def test_cancel_unpaid_bill(self):
+        ''' Test a credit note of a whole unpaid bill settles both '''
+        balance = coworker_balance(self.user.pk)
+        credit_note = credit_bill(self.bill)
+        self.bill.refresh_from_db()
+        self.assertTrue(credit_note.number.startswith('A'))
+        self.assertEqual(credit_note.credited_bill, self.bill)
+        self.assertEqual(credit_note.amount, -self.bill.amount)
+        self.assertTrue(credit_note.isPaid)
+        self.assertTrue(self.bill.isPaid)
+        self.assertEqual(coworker_balance(self.user.pk),
+                         balance - self.bill.amount)
+
+    def test_partial_credit_of_paid_bill(self):
+        ''' Test a credit note of a paid bill is owed to the coworker '''
+        self.bill.isPaid = True
+        self.bill.save()
+        line = self.bill.billline_set.first()
+        credit_note = credit_bill(self.bill, [line])
+        self.assertFalse(credit_note.isPaid)
+        self.assertEqual(credit_note.amount, -line.total)
+        self.assertEqual(coworker_balance(self.user.pk), -line.total)
+
+    def test_bill_is_not_credited_twice(self):
+        ''' Test crediting more than the bill amount fails '''
+        self.bill.isPaid = True
+        self.bill.save()
+        credit_bill(self.bill)
+        with self.assertRaises(CreditNoteError):
+            credit_bill(self.bill)
+
+    def test_credit_note_is_not_credited(self):
+        ''' Test a credit note has no credit note '''
+        credit_note = credit_bill(self.bill)
+        with self.assertRaises(CreditNoteError):
+            credit_bill(credit_note)
+
+    def test_credit_note_pdf(self):
+        ''' Test a credit note pdf is downloaded '''
+        credit_note = credit_bill(self.bill)
+        self.client.force_login(User.objects.get(username='bill'))
+        response = self.client.get(
+                '/billjobs/generate_pdf/%d' % credit_note.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
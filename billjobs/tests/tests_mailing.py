@@ -0,0 +1,86 @@
+import io
+import os
+import tempfile
+from django.test import TestCase, override_settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from billjobs.mailing import send_invoices
+from billjobs.models import Bill
+
+
+class CountingBackend(locmem.EmailBackend):
+    ''' Email backend counting connections and batches '''
+
+    def __init__(self, *args, **kwargs):
+        super(CountingBackend, self).__init__(*args, **kwargs)
+        self.opened = 0
+        self.batches = []
+
+    def open(self):
+        self.opened += 1
+
+    def send_messages(self, messages):
+        self.batches.append(len(messages))
+        return super(CountingBackend, self).send_messages(messages)
+
+
+class SendInvoicesTestCase(TestCase):
+    ''' Tests for invoices sent by email '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        cache.clear()
+
+    def test_send_invoices(self):
+        ''' Test each bill is sent to its coworker with its pdf '''
+        connection = CountingBackend()
+        sent, skipped = send_invoices(
+                Bill.objects.all(), connection=connection, batch_size=3)
+        self.assertEqual((sent, skipped), (4, []))
+        self.assertEqual(connection.opened, 1)
+        self.assertEqual(connection.batches, [3, 1])
+        self.assertEqual(
+                [(message.subject, message.to) for message in mail.outbox],
+                [('Facture F201404001', ['bill@billjobs.org']),
+                 ('Facture F201405002', ['steve@billjobs.org']),
+                 ('Facture F201501003', ['bill@billjobs.org']),
+                 ('Facture F201704004', ['sam@billjobs.org'])])
+        filename, content, mimetype = mail.outbox[0].attachments[0]
+        self.assertEqual(filename, 'F201404001.pdf')
+        self.assertEqual(mimetype, 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_coworker_without_email(self):
+        ''' Test bills of a coworker without email are not sent '''
+        User.objects.filter(username='steve').update(email='')
+        sent, skipped = send_invoices(Bill.objects.all())
+        self.assertEqual(sent, 3)
+        self.assertEqual([bill.number for bill in skipped], ['F201405002'])
+
+    def test_admin_action(self):
+        ''' Test admin action sends selected bills '''
+        self.client.force_login(User.objects.get(username='bill'))
+        bill = Bill.objects.get(number='F201404001')
+        response = self.client.post('/admin/billjobs/bill/', {
+            'action': 'send_invoices', '_selected_action': [bill.pk]},
+            follow=True)
+        self.assertContains(response, '1 bills sent by email.')
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_command_with_file_backend(self):
+        ''' Test command writes every email with one file backend stream '''
+        path = tempfile.mkdtemp()
+        with override_settings(
+                EMAIL_BACKEND='django.core.mail.backends.filebased.'
+                              'EmailBackend',
+                EMAIL_FILE_PATH=path):
+            output = io.StringIO()
+            call_command('send_invoices', '--unpaid', '--batch-size', '2',
+                         stdout=output)
+        self.assertIn('3 bills sent by email', output.getvalue())
+        self.assertEqual(len(os.listdir(path)), 1)
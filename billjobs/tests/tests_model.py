@@ -1,8 +1,9 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
 from django.db.utils import IntegrityError
-from billjobs.models import Bill, Service
-from billjobs.settings import BILLJOBS_BILL_ISSUER
+from billjobs.models import Bill, BillLine, Service, reserve_bill_numbers, \
+        defer_bill_amount
+from billjobs.settings import billjobs_settings
 import datetime
 
 
@@ -17,10 +18,26 @@ class BillingTestCase(TestCase):
         bill = Bill(user=self.user)
         bill.save()
         self.assertEqual(bill.user.username, self.user.username)
-        self.assertEqual(bill.issuer_address, BILLJOBS_BILL_ISSUER)
+        self.assertEqual(bill.issuer_address, billjobs_settings.BILL_ISSUER)
         self.assertEqual(
                 bill.billing_address, self.user.userprofile.billing_address)
 
+    @override_settings(BILLJOBS_BILL_ISSUER='Coworking<br/>Paris')
+    def test_create_bill_with_overridden_issuer(self):
+        ''' Test issuer address of a new bill is read when it is created '''
+        bill = Bill.objects.create(user=self.user)
+        self.assertEqual(bill.issuer_address, 'Coworking<br/>Paris')
+
+    @override_settings(BILLJOBS_BILL_ISSUER='Coworking<br/>Paris')
+    def test_old_setting_constants(self):
+        ''' Test BILLJOBS_* constants of billjobs.settings are still given '''
+        from billjobs.settings import BILLJOBS_BILL_ISSUER, \
+            BILLJOBS_PDF_CACHE
+        self.assertEqual(BILLJOBS_BILL_ISSUER, 'Coworking<br/>Paris')
+        self.assertIsNone(BILLJOBS_PDF_CACHE)
+        with self.assertRaises(ImportError):
+            from billjobs.settings import BILLJOBS_UNKNOWN  # noqa
+
     def test_user_change_billing_address(self):
         ''' Test when user is changing is billing address
             Previous bill is with old address
@@ -67,6 +84,70 @@ class BillingTestCase(TestCase):
         last_number = 'F%s%s' % (today.strftime('%Y%m'), '1100')
         self.assertEqual(last_bill.number, last_number)
 
+    def test_bill_number_restart_each_month(self):
+        ''' Test bill counter starts again at 001 for a new month '''
+        Bill(user=self.user).save()
+        numbers = reserve_bill_numbers(date=datetime.date(2030, 1, 15))
+        self.assertEqual(numbers, ['F203001001'])
+
+    def test_reserve_many_bill_numbers(self):
+        ''' Test a batch of numbers is consecutive and not given twice '''
+        date = datetime.date(2030, 2, 1)
+        first = reserve_bill_numbers(3, date)
+        second = reserve_bill_numbers(2, date)
+        self.assertEqual(first, ['F203002001', 'F203002002', 'F203002003'])
+        self.assertEqual(second, ['F203002004', 'F203002005'])
+
+    def test_bill_number_continue_existing_bills(self):
+        ''' Test counter starts after bills numbered before the sequence '''
+        today = datetime.date.today()
+        Bill(user=self.user,
+             number='F%s041' % today.strftime('%Y%m')).save()
+        bill = Bill(user=self.user)
+        bill.save()
+        self.assertEqual(bill.number, 'F%s042' % today.strftime('%Y%m'))
+
+
+class BillAmountTestCase(TestCase):
+    ''' Test bill amount follows its lines '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml']
+
+    def setUp(self):
+        self.bill = Bill(user=User.objects.get(username='bill'))
+        self.bill.save()
+        self.service = Service.objects.get(reference='FT001')
+
+    def amount(self):
+        return Bill.objects.get(pk=self.bill.pk).amount
+
+    def test_line_save_and_delete_update_amount(self):
+        ''' Test amount is updated when a line is added or deleted '''
+        line = BillLine.objects.create(
+                bill=self.bill, service=self.service, quantity=2)
+        BillLine.objects.create(
+                bill=self.bill, service=self.service, quantity=1)
+        self.assertEqual(self.amount(), 3 * self.service.price)
+        line.delete()
+        self.assertEqual(self.amount(), self.service.price)
+
+    def test_bill_save_compute_amount(self):
+        ''' Test a saved bill gets the sum of its lines '''
+        BillLine.objects.create(
+                bill=self.bill, service=self.service, quantity=2)
+        self.bill.amount = 1
+        self.bill.save()
+        self.assertEqual(self.bill.amount, 2 * self.service.price)
+
+    def test_deferred_amount_is_computed_once(self):
+        ''' Test lines saved in defer_bill_amount update amount at the end '''
+        with defer_bill_amount():
+            for i in range(5):
+                BillLine.objects.create(
+                        bill=self.bill, service=self.service, quantity=1)
+            self.assertEqual(self.amount(), 0)
+        self.assertEqual(self.amount(), 5 * self.service.price)
+
 
 class ServiceTestCase(TestCase):
     ''' Test CRUD for Service model '''
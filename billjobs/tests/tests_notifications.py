@@ -0,0 +1,187 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from django.test import TestCase
+from django.shortcuts import reverse
+from django.contrib.auth.models import User
+from billjobs.notifications import Dispatcher, dispatcher, notify_subscription
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    ''' Answer POST requests like slack API, with statuses of the server '''
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        data = {name: values[0]
+                for name, values in parse_qs(body.decode()).items()}
+        self.server.received.append((self.path, data))
+        self.server.request_received.set()
+        # answer once the test releases the server
+        self.server.released.wait(5)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'ok': status == 200}).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients which timed out have closed the connection
+        pass
+
+
+class SlackStubTestCase(TestCase):
+    ''' Base test case with a local stub of slack API '''
+
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.server.received = []
+        self.server.statuses = []
+        self.server.request_received = threading.Event()
+        self.server.released = threading.Event()
+        self.server.released.set()
+        self.url = 'http://127.0.0.1:%d/api/' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.server.released.set)
+
+
+class DispatcherTestCase(SlackStubTestCase):
+    ''' Tests for http requests sent by a background thread '''
+
+    def setUp(self):
+        super(DispatcherTestCase, self).setUp()
+        self.dispatcher = Dispatcher(timeout=1, retries=2, backoff=0)
+
+    def test_retry_on_error(self):
+        ''' Test a request answered with an error is sent again '''
+        self.server.statuses = [500, 503]
+        answers = []
+        self.dispatcher.post(self.url + 'method', {'a': '1'}, answers.append)
+        self.assertTrue(self.dispatcher.flush(5))
+        self.assertEqual(len(self.server.received), 3)
+        self.assertEqual(answers, [{'ok': True}])
+
+    def test_timeout(self):
+        ''' Test a request without answer gives None after retries '''
+        self.server.released.clear()
+        self.dispatcher.timeout = 0.1
+        answers = []
+        self.dispatcher.post(self.url + 'method', {'a': '1'}, answers.append)
+        self.assertTrue(self.dispatcher.flush(5))
+        self.assertEqual(answers, [None])
+
+    def test_no_retry_after_timeout(self):
+        ''' Test a request which must not be received twice is sent once '''
+        self.server.released.clear()
+        self.dispatcher.timeout = 0.1
+        answers = []
+        self.dispatcher.post(self.url + 'method', {'a': '1'}, answers.append,
+                             idempotent=False)
+        self.assertTrue(self.dispatcher.flush(5))
+        self.assertEqual(len(self.server.received), 1)
+        self.assertEqual(answers, [None])
+
+    def test_no_retry_on_error(self):
+        ''' Test a request which must not be received twice gets the error '''
+        self.server.statuses = [503]
+        answers = []
+        self.dispatcher.post(self.url + 'method', {'a': '1'}, answers.append,
+                             idempotent=False)
+        self.assertTrue(self.dispatcher.flush(5))
+        self.assertEqual(len(self.server.received), 1)
+        self.assertEqual(answers, [{'ok': False}])
+
+    def test_retry_when_not_received(self):
+        ''' Test a request which must not be received twice is sent again '''
+        self.server.statuses = [429]
+        answers = []
+        self.dispatcher.post(self.url + 'method', {'a': '1'}, answers.append,
+                             idempotent=False)
+        self.assertTrue(self.dispatcher.flush(5))
+        self.assertEqual(len(self.server.received), 2)
+        self.assertEqual(answers, [{'ok': True}])
+
+    def test_retry_connection_refused(self):
+        ''' Test a request is sent again when slack refuses the connection '''
+        # nothing listens on the port anymore
+        self.server.shutdown()
+        self.server.server_close()
+        answers = []
+        with self.assertLogs('billjobs.notifications') as logs:
+            self.dispatcher.post(self.url + 'method', {'a': '1'},
+                                 answers.append, idempotent=False)
+            self.assertTrue(self.dispatcher.flush(5))
+        self.assertIn('failed 3 times', logs.output[-1])
+        self.assertEqual(answers, [None])
+
+    def test_join_queued_messages(self):
+        ''' Test messages waiting for the thread are sent together '''
+        self.server.released.clear()
+        url = self.url + 'chat.postMessage'
+        self.dispatcher.post(url, {'channel': 'a', 'text': '1'}, join='text')
+        self.server.request_received.wait(5)
+        self.dispatcher.post(url, {'channel': 'a', 'text': '2'}, join='text')
+        self.dispatcher.post(url, {'channel': 'b', 'text': '3'}, join='text')
+        self.dispatcher.post(url, {'channel': 'a', 'text': '4'}, join='text')
+        self.server.released.set()
+        self.assertTrue(self.dispatcher.flush(5))
+        self.assertEqual(
+                [(data['channel'], data['text'])
+                 for path, data in self.server.received],
+                [('a', '1'), ('a', '2\n\n4'), ('b', '3')])
+
+
+class SignupSlackTestCase(SlackStubTestCase):
+    ''' Test signup does not wait for slack '''
+
+    def test_signup_send_invitation_after_response(self):
+        ''' Test invitation and message are sent after signup response '''
+        self.server.released.clear()
+        data = {
+                'username': 'slack',
+                'password': 'motdepasse',
+                'first_name': 'Bill',
+                'last_name': 'Jobs',
+                'email': 'billjobs_slack@yopmail.com',
+                'billing_address': 'une adresse'
+                }
+        with self.settings(BILLJOBS_SLACK_TOKEN='token',
+                           BILLJOBS_SLACK_API_URL=self.url):
+            response = self.client.post(reverse('billjobs_signup'), data)
+            # slack has not answered yet
+            self.assertEqual(response.status_code, 302)
+            self.server.released.set()
+            self.assertTrue(dispatcher.flush(5))
+        self.assertEqual(
+                [path for path, data in self.server.received],
+                ['/api/users.admin.invite', '/api/chat.postMessage'])
+        self.assertEqual(
+                self.server.received[0][1]['email'],
+                'billjobs_slack@yopmail.com')
+        self.assertIn('a réussi', self.server.received[1][1]['text'])
+
+    def test_message_not_posted_twice(self):
+        ''' Test a message without answer in time is not posted again '''
+        self.server.released.clear()
+        user = User(username='slack', first_name='Bill', last_name='Jobs',
+                    email='billjobs_slack@yopmail.com')
+        with self.settings(BILLJOBS_SLACK_TOKEN='token',
+                           BILLJOBS_SLACK_API_URL=self.url,
+                           BILLJOBS_SLACK_TIMEOUT=0.1):
+            notify_subscription(user, True)
+            self.assertTrue(dispatcher.flush(5))
+        self.assertEqual(
+                [path for path, data in self.server.received],
+                ['/api/chat.postMessage'])
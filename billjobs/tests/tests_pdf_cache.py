@@ -0,0 +1,128 @@
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from billjobs.cache import get_render_slots
+from billjobs.models import Bill, BillLine, Service
+from billjobs.pdf import render_bill_pdf
+
+
+@override_settings(BILLJOBS_PDF_CACHE='default')
+class PdfCacheTestCase(TestCase):
+    ''' Tests for bill pdf cache and conditional download '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.get(username='bill'))
+        self.bill = Bill.objects.get(number='F201404001')
+        self.url = '/billjobs/generate_pdf/%d' % self.bill.pk
+
+    def test_pdf_is_rendered_once(self):
+        ''' Test second download use the cached pdf '''
+        with mock.patch('billjobs.pdf.render_bill_pdf',
+                        side_effect=render_bill_pdf) as render:
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_if_none_match_return_not_modified(self):
+        ''' Test a download with the current ETag return 304 '''
+        etag = self.client.get(self.url)['ETag']
+        # only session and user queries from login_required
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_bill_line_change_invalidate_pdf(self):
+        ''' Test adding a line gives a new pdf and a new ETag '''
+        etag = self.client.get(self.url)['ETag']
+        BillLine.objects.create(
+                bill=self.bill, service=Service.objects.get(pk=2), quantity=3)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_service_change_invalidate_pdf(self):
+        ''' Test a service description change gives a new ETag '''
+        etag = self.client.get(self.url)['ETag']
+        service = self.bill.billline_set.first().service
+        service.description = 'New description'
+        service.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class PdfWithoutCacheTestCase(TestCase):
+    ''' Tests for conditional download without pdf cache '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        self.client.force_login(User.objects.get(username='bill'))
+        self.bill = Bill.objects.get(number='F201404001')
+        self.url = '/billjobs/generate_pdf/%d' % self.bill.pk
+
+    def test_if_none_match_return_not_modified(self):
+        ''' Test a download with the current ETag is not rendered again '''
+        etag = self.client.get(self.url)['ETag']
+        with mock.patch('billjobs.pdf.render_bill_pdf') as render:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        render.assert_not_called()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        BillLine.objects.create(
+                bill=self.bill, service=Service.objects.get(pk=2), quantity=3)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(BILLJOBS_PDF_CACHE='default',
+                   BILLJOBS_PDF_RENDER_CONCURRENCY=1,
+                   BILLJOBS_PDF_RENDER_WAIT=0.01)
+class PdfRenderConcurrencyTestCase(TestCase):
+    ''' Tests for the limit of pdf renders running together '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.get(username='bill'))
+        self.bill = Bill.objects.get(number='F201404001')
+        self.url = '/billjobs/generate_pdf/%d' % self.bill.pk
+        self.slots = get_render_slots()
+
+    def hold_slot(self):
+        self.slots.acquire()
+        self.addCleanup(self.slots.release)
+
+    def test_free_slot_is_released(self):
+        ''' Test a download renders in a free slot and releases it '''
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.slots.acquire(blocking=False))
+        self.slots.release()
+
+    def test_busy_renders_return_service_unavailable(self):
+        ''' Test a download waiting too long for a slot returns 503 '''
+        self.hold_slot()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+
+    def test_cached_pdf_does_not_wait(self):
+        ''' Test a cached pdf is returned while renders are busy '''
+        self.client.get(self.url)
+        self.hold_slot()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,109 @@
+import datetime
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from billjobs.jobs import claim_next_job, enqueue_pdf_job, work
+from billjobs.models import Bill, BillLine, PdfJob, Service
+
+
+@override_settings(BILLJOBS_PDF_ASYNC=True)
+class PdfJobTestCase(TestCase):
+    ''' Tests for pdf rendered by worker processes '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.get(username='bill'))
+        self.bill = Bill.objects.get(number='F201404001')
+        self.url = '/billjobs/generate_pdf/%d' % self.bill.pk
+
+    def test_download_enqueue_job(self):
+        ''' Test download returns a job to poll instead of the pdf '''
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 202)
+        job = PdfJob.objects.get()
+        self.assertEqual(response.json(), {
+            'job': job.pk,
+            'status': PdfJob.PENDING,
+            'url': '/billjobs/pdf_job/%d' % job.pk})
+        # downloading again does not create another job
+        self.client.get(self.url)
+        self.assertEqual(PdfJob.objects.count(), 1)
+
+    def test_download_queries(self):
+        ''' Test queries of a download do not grow with bill lines '''
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(self.url)
+        service = Service.objects.get(pk=2)
+        BillLine.objects.bulk_create(
+                BillLine(bill=self.bill, service=service, quantity=1,
+                         total=service.price)
+                for i in range(5))
+        PdfJob.objects.all().delete()
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(self.url)
+        self.assertEqual(len(after), len(before))
+
+    def test_worker_render_pdf(self):
+        ''' Test polling url returns the pdf once the worker is done '''
+        url = self.client.get(self.url).json()['url']
+        self.assertEqual(self.client.get(url).status_code, 202)
+        self.assertEqual(work(burst=True), 1)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+        # worker result is used even if this process cache is empty
+        cache.clear()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+    def test_job_is_claimed_once(self):
+        ''' Test a claimed job is not given to another worker '''
+        enqueue_pdf_job(self.bill)
+        job = claim_next_job()
+        self.assertEqual(job.status, PdfJob.RUNNING)
+        self.assertIsNone(claim_next_job())
+
+    def test_failed_job(self):
+        ''' Test a rendering error is stored and returned '''
+        url = self.client.get(self.url).json()['url']
+        with mock.patch('billjobs.jobs.get_bill_pdf',
+                        side_effect=ValueError('broken')):
+            work(burst=True)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['status'], PdfJob.FAILED)
+        self.assertIn('broken', PdfJob.objects.get().error)
+
+    def test_stuck_job_is_replaced(self):
+        ''' Test a job left running by a stopped worker gives a new job '''
+        url = self.client.get(self.url).json()['url']
+        job = claim_next_job()
+        PdfJob.objects.filter(pk=job.pk).update(
+                started_at=timezone.now() - datetime.timedelta(hours=1))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(response.json()['job'], job.pk)
+        self.assertEqual(PdfJob.objects.get(pk=job.pk).status,
+                         PdfJob.FAILED)
+        self.assertEqual(work(burst=True), 1)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_outdated_job_is_replaced(self):
+        ''' Test a job done before a bill change gives a new job '''
+        url = self.client.get(self.url).json()['url']
+        work(burst=True)
+        BillLine.objects.create(
+                bill=self.bill, service=Service.objects.get(pk=2), quantity=1)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], PdfJob.PENDING)
+        self.assertEqual(PdfJob.objects.count(), 2)
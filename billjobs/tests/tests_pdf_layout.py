@@ -0,0 +1,84 @@
+import re
+from unittest import mock
+from django.test import TestCase
+from reportlab.pdfgen.canvas import Canvas
+from billjobs.ledger import credit_bill
+from billjobs.models import Bill, BillLine, Service
+from billjobs.pdf import paginate, render_bill_pdf
+
+
+def page_count(pdf):
+    return len(re.findall(rb'/Type /Page\b', pdf))
+
+
+class PaginateTestCase(TestCase):
+    ''' Tests for the split of bill lines in pages '''
+
+    def test_one_page(self):
+        ''' Test lines and totals fitting the first page '''
+        self.assertEqual(paginate([10] * 5, 80, 200, 10), [(0, 5)])
+
+    def test_next_pages(self):
+        ''' Test each page has a subtotal and last one the totals '''
+        # 7 lines on the first page, 19 on next ones
+        self.assertEqual(
+                paginate([10] * 40, 80, 200, 10),
+                [(0, 7), (7, 26), (26, 40)])
+
+    def test_totals_on_last_page(self):
+        ''' Test lines leaving no room for totals go to a last page '''
+        self.assertEqual(
+                paginate([10] * 25, 80, 200, 10),
+                [(0, 7), (7, 23), (23, 25)])
+        self.assertEqual(
+                paginate([10] * 23, 80, 200, 10),
+                [(0, 7), (7, 23)])
+
+    def test_higher_than_page(self):
+        ''' Test a row higher than a page does not stop pagination '''
+        self.assertEqual(
+                paginate([10, 500, 10], 80, 200, 10),
+                [(0, 1), (1, 2), (2, 3)])
+
+
+class PdfLayoutTestCase(TestCase):
+    ''' Tests for pdf of bills with many lines '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        self.bill = Bill.objects.get(number='F201404001')
+
+    def test_one_page_bill(self):
+        ''' Test a bill with few lines has one page '''
+        self.assertEqual(page_count(render_bill_pdf(self.bill)), 1)
+
+    def add_lines(self, count):
+        service = Service.objects.first()
+        BillLine.objects.bulk_create(
+                BillLine(bill=self.bill, service=service, quantity=1,
+                         total=service.price)
+                for i in range(count))
+        self.bill.save()
+
+    def test_many_pages_bill(self):
+        ''' Test lines overflowing the first page are drawn on next ones '''
+        self.add_lines(100)
+        bill = (Bill.objects.prefetch_related('billline_set__service')
+                .get(pk=self.bill.pk))
+        self.assertGreater(page_count(render_bill_pdf(bill)), 2)
+
+    def test_many_pages_credit_note(self):
+        ''' Test page number and credited bill are on different lines '''
+        self.add_lines(100)
+        credit_note = (Bill.objects
+                       .prefetch_related('billline_set__service')
+                       .get(pk=credit_bill(self.bill).pk))
+        with mock.patch.object(Canvas, 'drawRightString', autospec=True,
+                               side_effect=Canvas.drawRightString) as draw:
+            pdf = render_bill_pdf(credit_note)
+        self.assertGreater(page_count(pdf), 2)
+        tops = {text.split(' :')[0].split('/')[0]: y
+                for (canvas, x, y, text), kwargs in draw.call_args_list}
+        self.assertLess(tops['Page 1'], tops['Avoir sur la facture'])
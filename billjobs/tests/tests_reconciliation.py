@@ -0,0 +1,164 @@
+import datetime
+import io
+import os
+import tempfile
+from decimal import Decimal
+from django.test import TestCase
+from django.core.management import call_command
+from billjobs.models import Bill, RevenueSummary
+from billjobs.reconciliation import Payment, StatementError, \
+        parse_statement, reconcile
+
+CSV_STATEMENT = '''Date;Libellé;Montant
+02/05/2014;VIR FACTURE F201404001 BILL JOBS;{f1}
+03/05/2014;PRLV ELECTRICITE;-42,00
+05/06/2014;VIREMENT STEVE GATES;{f2}
+'''
+
+OFX_STATEMENT = '''OFXHEADER:100
+DATA:OFXSGML
+
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20140502120000
+<TRNAMT>1234.50
+<FITID>A1
+<NAME>VIR SEPA BILL JOBS
+<MEMO>F201404001
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20140503
+<TRNAMT>-42.00
+<FITID>A2
+<NAME>ELECTRICITE
+</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+'''
+
+CAMT_STATEMENT = '''<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">
+<BkToCstmrStmt><Stmt><Id>1</Id>
+<Ntry>
+  <Amt Ccy="EUR">1 234,50</Amt>
+  <CdtDbtInd>CRDT</CdtDbtInd>
+  <BookgDt><Dt>2014-05-02</Dt></BookgDt>
+  <AcctSvcrRef>C1</AcctSvcrRef>
+  <NtryDtls><TxDtls>
+    <RltdPties><Dbtr><Nm>Bill Jobs</Nm></Dbtr></RltdPties>
+    <RmtInf><Ustrd>Facture F201404001</Ustrd></RmtInf>
+  </TxDtls></NtryDtls>
+</Ntry>
+<Ntry>
+  <Amt Ccy="EUR">42.00</Amt>
+  <CdtDbtInd>DBIT</CdtDbtInd>
+  <BookgDt><Dt>2014-05-03</Dt></BookgDt>
+</Ntry>
+</Stmt></BkToCstmrStmt>
+</Document>
+'''
+
+
+def parse(content, statement_format):
+    return list(parse_statement(
+        io.BytesIO(content.encode('utf-8')), statement_format))
+
+
+class StatementTestCase(TestCase):
+    ''' Tests for bank statement parsers '''
+
+    def test_csv(self):
+        ''' Test credits of a csv statement with decimal commas '''
+        payments = parse(
+                CSV_STATEMENT.format(f1='1 234,50', f2='10,00'), 'csv')
+        self.assertEqual([payment[:3] for payment in payments], [
+            (datetime.date(2014, 5, 2), Decimal('1234.50'),
+             'VIR FACTURE F201404001 BILL JOBS'),
+            (datetime.date(2014, 6, 5), Decimal('10.00'),
+             'VIREMENT STEVE GATES')])
+
+    def test_ofx(self):
+        ''' Test credits of an OFX statement '''
+        self.assertEqual(parse(OFX_STATEMENT, 'ofx'), [Payment(
+            datetime.date(2014, 5, 2), Decimal('1234.50'),
+            'VIR SEPA BILL JOBS F201404001', 'A1')])
+
+    def test_camt(self):
+        ''' Test credits of a CAMT.053 statement '''
+        self.assertEqual(parse(CAMT_STATEMENT, 'camt'), [Payment(
+            datetime.date(2014, 5, 2), Decimal('1234.50'),
+            'Bill Jobs Facture F201404001', 'C1')])
+
+    def test_csv_without_amount(self):
+        ''' Test a csv statement without amount column is refused '''
+        with self.assertRaises(StatementError):
+            parse('Date;Libellé\n02/05/2014;VIR\n', 'csv')
+
+
+class ReconciliationTestCase(TestCase):
+    ''' Tests for bills paid by bank statements '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        self.amounts = dict(Bill.objects.values_list('number', 'amount'))
+
+    def payment(self, label, amount):
+        return Payment(datetime.date(2014, 6, 1), amount, label, '')
+
+    def test_match_by_number(self):
+        ''' Test bill number in label with the bill amount '''
+        matches, rejects = reconcile([
+            self.payment('VIR F201404001', self.amounts['F201404001']),
+            self.payment('VIR F201405002', Decimal('1.00')),
+            ])
+        self.assertEqual(
+                [(bill_id, reason) for payment, bill_id, reason in matches],
+                [(1, 'number')])
+        self.assertEqual(rejects[0][1], 'amount of F201405002 is %s' %
+                         self.amounts['F201405002'])
+
+    def test_match_by_name(self):
+        ''' Test coworker name in label with the amount of a bill '''
+        Bill.objects.filter(number='F201501003').update(
+                amount=self.amounts['F201404001'])
+        matches, rejects = reconcile([
+            self.payment('VIREMENT DE M. STEVE GATES',
+                         self.amounts['F201405002']),
+            # two coworkers are named Bill Jobs
+            self.payment('VIREMENT BILL JOBS', self.amounts['F201404001']),
+            # paid bill
+            self.payment('SAMUEL JACKSON', self.amounts['F201704004']),
+            ])
+        self.assertEqual(
+                [(bill_id, reason) for payment, bill_id, reason in matches],
+                [(2, 'name')])
+        self.assertEqual([reason for payment, reason in rejects],
+                         ['several coworkers', 'no bill'])
+
+    def test_command(self):
+        ''' Test command marks matched bills paid and updates summary '''
+        path = os.path.join(tempfile.mkdtemp(), 'statement.csv')
+        with open(path, 'w', encoding='utf-8') as statement:
+            statement.write(CSV_STATEMENT.format(
+                f1=self.amounts['F201404001'],
+                f2=self.amounts['F201405002']))
+        output = io.StringIO()
+        call_command('reconcile_payments', path, '--dry-run', stdout=output)
+        self.assertIn('2 bills would be marked paid', output.getvalue())
+        self.assertFalse(Bill.objects.filter(isPaid=True, pk=1).exists())
+
+        output = io.StringIO()
+        call_command('reconcile_payments', path, stdout=output)
+        self.assertIn('2 bills marked paid, 0 payments not matched',
+                      output.getvalue())
+        self.assertEqual(
+                set(Bill.objects.filter(isPaid=True)
+                    .values_list('number', flat=True)),
+                {'F201404001', 'F201405002', 'F201704004'})
+        self.assertFalse(RevenueSummary.objects.filter(
+            user_id__in=(1, 2), is_paid=False).exists())
@@ -0,0 +1,64 @@
+import io
+import datetime
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from billjobs.models import Bill, BillLine, Service, Subscription
+
+
+class SubscriptionBillingTestCase(TestCase):
+    ''' Test bills generation from subscriptions '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml']
+
+    def setUp(self):
+        self.full_time = Service.objects.get(reference='FT001')
+        self.meeting = Service.objects.get(reference='SR001')
+        for user in User.objects.all():
+            Subscription.objects.create(user=user, service=self.full_time)
+        self.bill_user = User.objects.get(username='bill')
+        Subscription.objects.create(
+                user=self.bill_user, service=self.meeting, quantity=3)
+        Subscription.objects.create(
+                user=User.objects.get(username='steve'),
+                service=self.meeting, is_active=False)
+
+    def generate(self, **options):
+        call_command('generate_bills', stdout=io.StringIO(), **options)
+
+    def test_one_bill_per_coworker(self):
+        ''' Test each coworker gets one bill with its active subscriptions '''
+        self.generate()
+        self.assertEqual(Bill.objects.count(), User.objects.count())
+        bill = Bill.objects.get(user=self.bill_user)
+        self.assertEqual(bill.billline_set.count(), 2)
+        self.assertEqual(
+                bill.amount, self.full_time.price + 3 * self.meeting.price)
+        self.assertEqual(
+                bill.billing_address,
+                self.bill_user.userprofile.billing_address)
+        steve_bill = Bill.objects.get(user__username='steve')
+        self.assertEqual(steve_bill.amount, self.full_time.price)
+
+    def test_bill_numbers_are_consecutive(self):
+        ''' Test generated bills take numbers of this month sequence '''
+        self.generate()
+        prefix = 'F%s' % datetime.date.today().strftime('%Y%m')
+        self.assertEqual(
+                sorted(Bill.objects.values_list('number', flat=True)),
+                ['%s%03d' % (prefix, i)
+                 for i in range(1, User.objects.count() + 1)])
+        bill = Bill(user=self.bill_user)
+        bill.save()
+        self.assertEqual(
+                bill.number, '%s%03d' % (prefix, User.objects.count() + 1))
+
+    def test_subscriptions_are_billed_once_a_month(self):
+        ''' Test a second run does not bill again unless forced '''
+        self.generate()
+        self.generate()
+        self.assertEqual(Bill.objects.count(), User.objects.count())
+        self.generate(force=True)
+        self.assertEqual(Bill.objects.count(), 2 * User.objects.count())
+        self.assertEqual(
+                BillLine.objects.count(), 2 * (User.objects.count() + 1))
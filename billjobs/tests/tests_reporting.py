@@ -0,0 +1,125 @@
+import datetime
+import io
+from decimal import Decimal
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from billjobs.models import Bill, BillLine, RevenueSummary, Service, \
+        Subscription
+from billjobs.recurring import generate_subscription_bills
+from billjobs.reporting import revenue_per_coworker, revenue_per_month, \
+        revenue_per_service, unpaid_aging
+
+
+def summary():
+    return sorted(RevenueSummary.objects.values_list(
+        'month', 'user_id', 'service_id', 'is_paid', 'quantity', 'amount'))
+
+
+class ReportingTestCase(TestCase):
+    ''' Tests for revenue summary and reports '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        self.bill = Bill.objects.get(number='F201404001')
+        self.year = (datetime.date(2014, 1, 1), datetime.date(2014, 12, 31))
+
+    def test_revenue_per_month(self):
+        ''' Test monthly amounts of a year '''
+        months = list(revenue_per_month(*self.year))
+        self.assertEqual(
+                [(month['month'], month['billed'], month['unpaid'])
+                 for month in months],
+                [(datetime.date(2014, 4, 1), Decimal('180.00'),
+                  Decimal('180.00')),
+                 (datetime.date(2014, 5, 1), Decimal('100.00'),
+                  Decimal('100.00'))])
+
+    def test_revenue_per_service_and_coworker(self):
+        ''' Test amounts per service and per coworker, highest first '''
+        self.assertEqual(
+                [row['service__reference'] for row in revenue_per_service()],
+                ['FT001', 'SR001', 'MT001'])
+        self.assertEqual(
+                [(row['user_id'], row['billed'])
+                 for row in revenue_per_coworker(*self.year)],
+                [(1, Decimal('180.00')), (2, Decimal('100.00'))])
+
+    def test_line_change_update_summary(self):
+        ''' Test saving and deleting a line update the summary '''
+        line = BillLine.objects.create(
+                bill=self.bill, service=Service.objects.get(pk=2),
+                quantity=3)
+        self.assertIn(
+                (datetime.date(2014, 4, 1), 1, 2, False, 3,
+                 Decimal('300.00')),
+                summary())
+        line.delete()
+        self.assertEqual(
+                [row for row in summary() if row[2] == 2 and row[1] == 1],
+                [])
+
+    def test_paid_change_update_summary(self):
+        ''' Test paying a bill moves its lines to paid amounts '''
+        self.bill.isPaid = True
+        self.bill.save()
+        month = revenue_per_month(*self.year)[0]
+        self.assertEqual(month['paid'], Decimal('180.00'))
+        self.assertEqual(month['unpaid'], 0)
+
+    def test_bill_delete_update_summary(self):
+        ''' Test deleting a bill removes its lines from the summary '''
+        self.bill.delete()
+        self.assertEqual(
+                [month['month'] for month in revenue_per_month(*self.year)],
+                [datetime.date(2014, 5, 1)])
+
+    def test_generated_bills_are_summarized(self):
+        ''' Test bills created in bulk from subscriptions are summarized '''
+        Subscription.objects.create(
+                user=User.objects.get(pk=1),
+                service=Service.objects.get(pk=3), quantity=2)
+        generate_subscription_bills()
+        month = datetime.date.today().replace(day=1)
+        self.assertIn((month, 1, 3, False, 2, Decimal('280.00')), summary())
+
+    def test_summary_match_rebuild(self):
+        ''' Test incremental summary is equal to a full rebuild '''
+        BillLine.objects.create(
+                bill=self.bill, service=Service.objects.get(pk=3))
+        Bill.objects.get(number='F201501003').delete()
+        self.bill.isPaid = True
+        self.bill.save()
+        incremental = summary()
+        output = io.StringIO()
+        call_command('rebuild_revenue_summary', stdout=output)
+        self.assertIn('4 revenue summary rows', output.getvalue())
+        self.assertEqual(summary(), incremental)
+
+    def test_unpaid_aging(self):
+        ''' Test unpaid bills are counted by age '''
+        aging = unpaid_aging(today=datetime.date(2014, 5, 31))
+        self.assertEqual(
+                [(bucket['min_days'], bucket['count'], bucket['amount'])
+                 for bucket in aging],
+                [(0, 1, Decimal('100.00')), (30, 1, Decimal('180.00')),
+                 (60, 0, 0), (90, 0, 0)])
+
+    def test_reporting_view(self):
+        ''' Test staff reporting page of a year '''
+        self.client.force_login(User.objects.get(username='bill'))
+        response = self.client.get('/billjobs/reporting/', {'year': 2014})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Chiffre d'affaires 2014")
+        self.assertContains(response, '180.00 €')
+        response = self.client.get('/billjobs/reporting/', {'year': 'all'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_reporting_view_require_permission(self):
+        ''' Test a signed up coworker without permission is refused '''
+        member = User.objects.create_user('member', is_staff=True)
+        self.client.force_login(member)
+        response = self.client.get('/billjobs/reporting/')
+        self.assertEqual(response.status_code, 403)
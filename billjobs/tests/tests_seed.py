@@ -0,0 +1,50 @@
+import io
+from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.models import User
+from billjobs.models import Bill, BillLine, RevenueSummary, Service
+from billjobs.reporting import rebuild_revenue_summary
+from billjobs.seed import SEED_PREFIX
+from billjobs.totals import audit_bill_totals
+
+
+def seeded_bills():
+    return list(Bill.objects.order_by('number').values_list(
+        'number', 'user__username', 'billing_date', 'isPaid', 'amount'))
+
+
+class SeedBillsTestCase(TestCase):
+    ''' Tests for the seed_bills command used by benchmarks '''
+
+    def seed(self):
+        call_command('seed_bills', users=5, services=3, bills=40, lines=4,
+                     months=12, stdout=io.StringIO())
+
+    def test_seed_bills(self):
+        ''' Test bills are created with their lines, amounts and summary '''
+        self.seed()
+        self.assertEqual(Bill.objects.count(), 40)
+        self.assertEqual(BillLine.objects.count(), 160)
+        self.assertEqual(
+                Bill.objects.values('billing_date').distinct().count(), 40)
+        self.assertEqual(list(audit_bill_totals()), [])
+        summary = sorted(RevenueSummary.objects.values_list(
+            'month', 'user_id', 'service_id', 'is_paid', 'amount'))
+        rebuild_revenue_summary()
+        self.assertEqual(summary, sorted(RevenueSummary.objects.values_list(
+            'month', 'user_id', 'service_id', 'is_paid', 'amount')))
+
+    def test_seed_is_reproducible(self):
+        ''' Test same arguments give same data '''
+        self.seed()
+        bills = seeded_bills()
+        User.objects.filter(username__startswith=SEED_PREFIX).delete()
+        Service.objects.all().delete()
+        self.seed()
+        self.assertEqual(seeded_bills(), bills)
+
+    def test_already_seeded(self):
+        ''' Test seeding twice is refused '''
+        self.seed()
+        self.assertRaises(CommandError, self.seed)
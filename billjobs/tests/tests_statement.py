@@ -0,0 +1,129 @@
+import datetime
+import re
+from decimal import Decimal
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from billjobs.models import Bill, BillLine, Service
+from billjobs.pdf import render_statement_pdf
+from billjobs.statement import statement_bills, statement_totals
+
+
+def page_count(pdf):
+    return len(re.findall(rb'/Type /Page\b', pdf))
+
+
+class StatementTestCase(TestCase):
+    ''' Tests for the account statement pdf of a coworker '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml',
+                'dev_model_030_service.yaml', 'dev_model_040_bill.yaml',
+                'dev_model_050_billline.yaml']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.get(username='bill')
+        self.service = Service.objects.get(pk=1)
+        self.client.force_login(self.user)
+        self.url = '/billjobs/statement/'
+
+    def add_bills(self, count, lines=1):
+        for i in range(count):
+            bill = Bill.objects.create(user=self.user)
+            BillLine.objects.bulk_create(
+                    BillLine(bill=bill, service=self.service, quantity=1,
+                             total=self.service.price)
+                    for j in range(lines))
+            bill.save()
+
+    def test_statement_download(self):
+        ''' Test the statement of the logged in coworker is a pdf '''
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(
+                response['Content-Disposition'],
+                'attachment; filename="releve-bill-%s.pdf"' % (
+                    datetime.date.today().isoformat()))
+
+    def test_bills_and_lines_in_two_queries(self):
+        ''' Test bills, lines and services are read with two queries '''
+        self.add_bills(3, lines=2)
+        with self.assertNumQueries(2):
+            bills = list(statement_bills(self.user.pk))
+            lines = [(line.total, line.service.name) for bill in bills
+                     for line in bill.billline_set.all()]
+        self.assertEqual(len(bills), 4)
+        # one line in fixtures
+        self.assertEqual(len(lines), 7)
+
+    def test_bills_by_batches(self):
+        ''' Test bills are read oldest first, one batch after the other '''
+        self.add_bills(4)
+        Bill.objects.filter(number='F201404001').update(
+                billing_date=datetime.date.today())
+        expected = list(Bill.objects.filter(user=self.user)
+                        .order_by('billing_date', 'pk')
+                        .values_list('pk', flat=True))
+        # batches of two, two and one bills
+        with self.assertNumQueries(6):
+            bills = [bill.pk for bill in
+                     statement_bills(self.user.pk, batch_size=2)]
+        self.assertEqual(bills, expected)
+
+    def test_totals(self):
+        ''' Test billed, paid and unpaid amounts are summed '''
+        self.add_bills(2)
+        bill = Bill.objects.filter(user=self.user).order_by('pk').last()
+        bill.isPaid = True
+        bill.save()
+        unpaid = Bill.objects.get(number='F201404001').amount + \
+            self.service.price
+        with self.assertNumQueries(1):
+            totals = statement_totals(self.user.pk)
+        self.assertEqual(totals, {
+            'billed': unpaid + self.service.price,
+            'paid': self.service.price,
+            'unpaid': unpaid})
+        self.assertEqual(statement_totals(0), {
+            'billed': Decimal(0), 'paid': Decimal(0), 'unpaid': Decimal(0)})
+
+    def test_many_pages_statement(self):
+        ''' Test bills overflowing the first page are drawn on next ones '''
+        self.add_bills(40, lines=2)
+        pdf = render_statement_pdf(
+                self.user, '', statement_bills(self.user.pk),
+                statement_totals(self.user.pk), datetime.date.today())
+        self.assertGreater(page_count(pdf), 2)
+
+    @override_settings(BILLJOBS_PDF_CACHE='default',
+                       BILLJOBS_API_CACHE='default')
+    def test_statement_is_cached(self):
+        ''' Test statement is rendered again only when a bill changes '''
+        with mock.patch('billjobs.pdf.render_statement_pdf',
+                        side_effect=render_statement_pdf) as render:
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+            self.assertEqual(render.call_count, 1)
+            self.assertEqual(first.content, second.content)
+            response = self.client.get(
+                    self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+            BillLine.objects.create(
+                    bill=Bill.objects.get(number='F201404001'),
+                    service=self.service, quantity=1)
+            response = self.client.get(
+                    self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], first['ETag'])
+            self.assertEqual(render.call_count, 2)
+
+    def test_statement_of_other_coworker(self):
+        ''' Test only superusers download statements of other coworkers '''
+        other = User.objects.get(username='steve')
+        url = '/billjobs/statement/%d' % other.pk
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.user.is_superuser = False
+        self.user.save()
+        self.assertEqual(self.client.get(url).status_code, 403)
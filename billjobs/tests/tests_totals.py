@@ -0,0 +1,56 @@
+import io
+from decimal import Decimal
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from billjobs.models import Bill, BillLine, Service
+from billjobs.totals import audit_bill_totals, period_totals, to_cents, \
+        from_cents
+
+
+class TotalsTestCase(TestCase):
+    ''' Test exact amounts and totals computed by the database '''
+    fixtures = ['dev_model_010_user.yaml', 'dev_model_020_userprofile.yaml']
+
+    def setUp(self):
+        self.service = Service.objects.create(
+                reference='CF001', name='Coffee', description='A coffee',
+                price=Decimal('0.10'))
+        self.bill = Bill(user=User.objects.get(username='bill'))
+        self.bill.save()
+        for i in range(3):
+            BillLine.objects.create(bill=self.bill, service=self.service)
+
+    def test_amount_is_exact(self):
+        ''' Test three lines of 0.10 give 0.30 '''
+        self.assertEqual(
+                Bill.objects.get(pk=self.bill.pk).amount, Decimal('0.30'))
+
+    def test_cents_conversion(self):
+        ''' Test amounts are converted to integer cents and back '''
+        self.assertEqual(to_cents(Decimal('12.345')), 1235)
+        self.assertEqual(to_cents(0.1 + 0.2), 30)
+        self.assertEqual(from_cents(1235), Decimal('12.35'))
+
+    def test_audit_find_and_fix_wrong_amount(self):
+        ''' Test audit command reports and fixes a wrong bill amount '''
+        self.assertEqual(list(audit_bill_totals()), [])
+        Bill.objects.filter(pk=self.bill.pk).update(amount=Decimal('1.00'))
+        self.assertEqual(
+                [pk for pk, number, amount, total in audit_bill_totals()],
+                [self.bill.pk])
+        output = io.StringIO()
+        call_command('audit_bill_totals', fix=True, stdout=output)
+        self.assertIn('1 bill amounts fixed', output.getvalue())
+        self.assertEqual(list(audit_bill_totals()), [])
+
+    def test_period_totals(self):
+        ''' Test monthly billed, paid and unpaid amounts '''
+        paid = Bill(user=self.bill.user, isPaid=True)
+        paid.save()
+        BillLine.objects.create(bill=paid, service=self.service, quantity=5)
+        totals = list(period_totals())
+        self.assertEqual(len(totals), 1)
+        self.assertEqual(totals[0]['billed'], Decimal('0.80'))
+        self.assertEqual(totals[0]['paid'], Decimal('0.50'))
+        self.assertEqual(totals[0]['unpaid'], Decimal('0.30'))
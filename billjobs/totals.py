@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from decimal import Decimal, ROUND_HALF_UP
+from django.db.models import Case, DecimalField, Sum, When
+from django.db.models.functions import Coalesce, TruncMonth
+from .models import Bill, update_bill_amounts
+
+CENT = Decimal('0.01')
+
+
+def to_cents(value):
+    ''' Return an amount as an integer number of cents '''
+    return int(Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+
+
+def from_cents(cents):
+    ''' Return an integer number of cents as a decimal amount '''
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+def bills_with_lines_total(queryset=None):
+    ''' Annotate bills with lines_total, the sum of their lines '''
+    queryset = Bill.objects.all() if queryset is None else queryset
+    return queryset.order_by().annotate(lines_total=Coalesce(
+        Sum('billline__total'), 0, output_field=DecimalField()))
+
+
+def audit_bill_totals(queryset=None):
+    ''' Yield (bill id, number, amount, lines total) of wrong bill amounts
+
+        Every bill is read with the sum of its lines in one query, amounts
+        are compared as integer cents.
+    '''
+    bills = bills_with_lines_total(queryset).values_list(
+            'pk', 'number', 'amount', 'lines_total')
+    for pk, number, amount, lines_total in bills.iterator():
+        if to_cents(amount) != to_cents(lines_total):
+            yield pk, number, amount, lines_total
+
+
+def fix_bill_totals(bill_ids, batch_size=500):
+    ''' Set amount of bills to the sum of their lines, by batch '''
+    bill_ids = list(bill_ids)
+    for start in range(0, len(bill_ids), batch_size):
+        update_bill_amounts(*bill_ids[start:start+batch_size])
+
+
+def period_totals(queryset=None):
+    ''' Return billed, paid and unpaid amounts per month, computed in SQL '''
+    queryset = Bill.objects.all() if queryset is None else queryset
+    return (queryset
+            .annotate(month=TruncMonth('billing_date'))
+            .order_by()
+            .values('month')
+            .annotate(
+                billed=Sum('amount'),
+                paid=Coalesce(Sum(Case(
+                    When(isPaid=True, then='amount'),
+                    output_field=DecimalField())), 0),
+                unpaid=Coalesce(Sum(Case(
+                    When(isPaid=False, then='amount'),
+                    output_field=DecimalField())), 0))
+            .order_by('month'))
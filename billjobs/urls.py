@@ -1,9 +1,25 @@
 from django.conf.urls import url
-from . import views
+from . import api, views
 
 urlpatterns = [
         url(r'^generate_pdf/(?P<bill_id>\d+)$', views.generate_pdf,
             name='generate-pdf'),
+        url(r'^statement/$', views.generate_statement,
+            name='generate-statement'),
+        url(r'^statement/(?P<user_id>\d+)$', views.generate_statement,
+            name='generate-user-statement'),
+        url(r'^export/bills\.csv$', views.export_bills_csv,
+            name='export-bills-csv'),
+        url(r'^export/emails\.csv$', views.export_emails_csv,
+            name='export-emails-csv'),
+        url(r'^metrics$', views.metrics_view, name='billjobs_metrics'),
+        url(r'^reporting/$', views.reporting, name='billjobs_reporting'),
+        url(r'^pdf_job/(?P<job_id>\d+)$', views.pdf_job, name='pdf-job'),
+        url(r'^api/bills/$', api.bill_list, name='api-bill-list'),
+        url(r'^api/bills/(?P<bill_id>\d+)/$', api.bill_detail,
+            name='api-bill-detail'),
+        url(r'^api/services/$', api.service_list, name='api-service-list'),
+        url(r'^api/profile/$', api.profile, name='api-profile'),
         url(r'^signup/$', views.signup, name='billjobs_signup'),
         url(r'^signup-success/$', views.signup_success,
             name='billjobs_signup_success')
@@ -1,25 +1,36 @@
 # -*- coding: utf-8 -*-
 from django.forms import ModelForm, ValidationError
-from django.http import HttpResponse
-from django.shortcuts import render, redirect
-from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, \
+        HttpResponseForbidden, HttpResponseNotModified, JsonResponse, \
+        StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import reverse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required, \
+        permission_required
 from django.contrib.auth.models import User, Group
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags, quote_etag
 from django.utils.translation import ugettext as _
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import cm
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import Table, Paragraph
-import requests
-from io import BytesIO
-from .settings import BILLJOBS_DEBUG_PDF, BILLJOBS_BILL_LOGO_PATH, \
-        BILLJOBS_BILL_LOGO_WIDTH, BILLJOBS_BILL_LOGO_HEIGHT, \
-        BILLJOBS_BILL_PAYMENT_INFO, BILLJOBS_FORCE_SUPERUSER, \
-        BILLJOBS_FORCE_USER_GROUP, BILLJOBS_SLACK_TOKEN, \
-        BILLJOBS_SLACK_CHANNEL
-from .models import Bill, UserProfile
-from textwrap import wrap
+import datetime
+from .settings import billjobs_settings
+from .models import Bill, PdfJob, UserProfile
+from .cache import RenderBusy, bill_digest, get_bill_digest, \
+        get_cached_pdf, get_bill_pdf
+from .export import filter_export_bills, stream_accounting_csv, \
+        stream_email_csv
+from .instrumentation import metrics
+from .jobs import enqueue_pdf_job, find_done_job
+from .notifications import send_slack_invitation
+from .reporting import revenue_per_coworker, revenue_per_month, \
+        revenue_per_service, unpaid_aging
+from .statement import get_statement_digest, get_statement_pdf, \
+        statement_filename
+
+# seconds a client waits before downloading again a pdf refused while busy
+RENDER_RETRY_AFTER = 5
 
 
 class UserSignupForm(ModelForm):
@@ -63,57 +74,14 @@ class UserProfileForm(ModelForm):
 def force_user_properties(user):
     ''' Force user properties to be set when we register them '''
     user.is_staff = True
-    if BILLJOBS_FORCE_SUPERUSER is True:
+    if billjobs_settings.FORCE_SUPERUSER is True:
         user.is_superuser = True
-    if BILLJOBS_FORCE_USER_GROUP is not None:
-        group = Group.objects.get(name=BILLJOBS_FORCE_USER_GROUP)
+    if billjobs_settings.FORCE_USER_GROUP is not None:
+        group = Group.objects.get(name=billjobs_settings.FORCE_USER_GROUP)
         user.groups.add(group.id)
     user.save()
 
 
-def send_slack_invitation(user):
-    ''' Send an invitation to the newly created user '''
-    url = 'https://slack.com/api/users.admin.invite'
-    payload = {'token': BILLJOBS_SLACK_TOKEN, 'email': user.email}
-    # send request
-    response = requests.post(url, data=payload)
-    # get json response
-    json_response = response.json()
-    # response['ok'] is a bool
-    notify_subscription(user, json_response['ok'])
-
-
-def notify_subscription(user, invitation):
-    ''' Send to a specific channel information about last signup '''
-    if invitation is True:
-        invitation_status = 'L\'envoi de l\'invitation slack a réussi'
-    elif invitation is False:
-        invitation_status = (
-                "L\'envoi de l\'invitation slack a échoué\nSoit il sait pas "
-                "écrire son email (ça commence bien), soit slack a un "
-                "problème (c\'est possible)"
-                )
-
-    url = 'https://slack.com/api/chat.postMessage'
-    payload = {
-            'username': 'signup-bot',
-            'token': BILLJOBS_SLACK_TOKEN,
-            'channel': BILLJOBS_SLACK_CHANNEL,
-            'text': (
-                ':new:\nL\'utilisateur {0} ({1} {2}) est inscrit\n'
-                'L\'adresse email est {3}\n{4}'.format(
-                    user.username,
-                    user.first_name,
-                    user.last_name,
-                    user.email,
-                    invitation_status
-                    )
-                )
-            }
-    # this failed silently, we do not manage errors
-    requests.post(url, data=payload)
-
-
 def signup(request):
     ''' Signup view for new user '''
     if request.method == 'POST':
@@ -126,7 +94,7 @@ def signup(request):
             profile = profile_form.save(commit=False)
             profile.user = user
             profile.save()
-            if BILLJOBS_SLACK_TOKEN is not False:
+            if billjobs_settings.SLACK_TOKEN:
                 send_slack_invitation(user)
             return redirect('billjobs_signup_success')
     else:
@@ -145,145 +113,226 @@ def signup_success(request):
 
 @login_required
 def generate_pdf(request, bill_id):
-    bill = Bill.objects.get(id=bill_id)
+    # digest of the last pdf is known until the bill changes
+    digest = get_bill_digest(bill_id)
+    if digest is not None and is_not_modified(request, digest):
+        return not_modified_response(digest)
+
+    # digest and pdf of the bill are computed without any query
+    bill = (Bill.objects
+            .select_related('user')
+            .prefetch_related('billline_set__service')
+            .get(id=bill_id))
+    if digest is None:
+        # not cached, or no pdf cache at all
+        digest = bill_digest(bill)
+        if is_not_modified(request, digest):
+            return not_modified_response(digest)
+    pdf = get_cached_pdf(digest)
+    if pdf is None:
+        if billjobs_settings.PDF_ASYNC is True:
+            # worker processes may not share the cache of this process
+            job = find_done_job(bill)
+            if job is None:
+                return pdf_job_response(enqueue_pdf_job(bill))
+            return pdf_response(bill, job.digest, bytes(job.pdf))
+        try:
+            digest, pdf = get_bill_pdf(bill, limited=True)
+        except RenderBusy:
+            return render_busy_response()
+
+    return pdf_response(bill, digest, pdf)
+
+
+@login_required
+def generate_statement(request, user_id=None):
+    ''' Account statement pdf of the logged in coworker
+
+        Superusers download the statement of any coworker with its id.
+    '''
+    if user_id is None or int(user_id) == request.user.pk:
+        user = request.user
+    elif request.user.is_superuser:
+        user = get_object_or_404(User, pk=user_id)
+    else:
+        return HttpResponseForbidden()
+
+    date = datetime.date.today()
+    digest = get_statement_digest(user.pk, date)
+    if digest is not None and is_not_modified(request, digest):
+        return not_modified_response(digest)
+    try:
+        pdf = get_statement_pdf(user, date, digest, limited=True)
+    except RenderBusy:
+        return render_busy_response()
+
+    response = HttpResponse(pdf, content_type='application/pdf')
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            statement_filename(user, date))
+    if digest is not None:
+        response['ETag'] = quote_etag(digest)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def is_not_modified(request, digest):
+    ''' Return True if the client already has the pdf of digest '''
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    return '*' in etags or quote_etag(digest) in etags
+
+
+def not_modified_response(digest):
+    response = HttpResponseNotModified()
+    response['ETag'] = quote_etag(digest)
+    return response
+
+
+def render_busy_response():
+    ''' Ask the client to download the pdf later, renders are all busy '''
+    response = HttpResponse(
+            _('Too many bills are being generated, please retry later.'),
+            content_type='text/plain; charset=utf-8', status=503)
+    response['Retry-After'] = RENDER_RETRY_AFTER
+    return response
+
+
+def pdf_response(bill, digest, pdf):
     response = HttpResponse(content_type='application/pdf')
     response['Content-Disposition'] = '{} "{}"'.format(
             'attachment; filename=', bill.number)
+    response['ETag'] = quote_etag(digest)
+    # browser must ask if its copy is still valid
+    patch_cache_control(response, private=True, no_cache=True)
 
-    # Create a buffer
-    buffer = BytesIO()
-    pdf = canvas.Canvas(buffer, pagesize=A4)
-    # define new 0,0 bottom left with cm as margin
-    pdf.translate(cm, cm)
-    # define document width and height with cm as margin
-    width, height = A4
-    width = width - 2*cm
-    height = height - 2*cm
-
-    # if debug draw lines for document limit
-    if BILLJOBS_DEBUG_PDF is True:
-        pdf.setStrokeColorRGB(1, 0, 0)
-        pdf.line(0, 0, width, 0)
-        pdf.line(0, 0, 0, height)
-        pdf.line(0, height, width, height)
-        pdf.line(width, height, width, 0)
-
-    # Put logo on top of pdf original image size is 570px/250px
-    pdf.drawImage(
-            BILLJOBS_BILL_LOGO_PATH,
-            0,
-            height-BILLJOBS_BILL_LOGO_HEIGHT,
-            width=BILLJOBS_BILL_LOGO_WIDTH,
-            height=BILLJOBS_BILL_LOGO_HEIGHT
-            )
-    # billing information
-    lh = 15  # define a line height
-    pdf.setFillColorRGB(0.3, 0.3, 0.3)
-    pdf.setFont("Helvetica-Bold", 14)
-    pdf.drawRightString(width, height-lh, 'Facture')
-    pdf.setFont("Helvetica-Bold", 10)
-    pdf.drawRightString(width, height-2*lh, u'Numéro : %s' % bill.number)
-    pdf.setFont("Helvetica", 10)
-    pdf.drawRightString(
-            width,
-            height-3*lh,
-            u'Date facturation : {}'.format(
-                bill.billing_date.strftime('%d/%m/%Y'))
-            )
+    response.write(pdf)
+    return response
 
-    # define new height
-    nh = height - 90
-
-    # seller
-    pdf.setFillColorRGB(0.95, 0.95, 0.95)
-    pdf.setStrokeColorRGB(1, 1, 1)
-    # rect(x,y,width,height)
-    pdf.rect(0, nh-8*lh, width/2-40, 6.4*lh, fill=1)
-    # reset fill for text color
-    pdf.setFillColorRGB(0.3, 0.3, 0.3)
-    pdf.drawString(10, nh-lh, 'Émetteur')
-    issuer = Paragraph(bill.issuer_address, getSampleStyleSheet()['Normal'])
-    issuer.wrapOn(pdf, width*0.25, 6*lh)
-    issuer.drawOn(pdf, 20, nh-6*lh)
-
-    # customer
-    pdf.drawString(width/2, nh-lh, 'Adressé à')
-    customer = pdf.beginText()
-    customer.setTextOrigin(width/2+20, nh-3*lh)
-    # create text with \n and remove \r
-    text = '{} {}\n{}'.format(
-            bill.user.first_name,
-            bill.user.last_name,
-            bill.billing_address.replace('\r', '')
-            )
-    # get each line
-    for line in text.split('\n'):
-        customer.textOut(line)
-        customer.moveCursor(0, lh)
-    pdf.drawText(customer)
-    pdf.setStrokeColorRGB(0, 0, 0)
-    # rect(x,y,width,height)
-    pdf.rect(width/2, nh-8*lh, width/2, 6.4*lh, fill=0)
-
-    # define new height
-    nh = nh - 10*lh
-
-    data = [['Désignation', 'Prix unit. HT', 'Quantité', 'Total HT']]
-
-    for line in bill.billline_set.all():
-        description = '{} - {}\n{}'.format(
-                line.service.reference,
-                line.service.name,
-                '\n'.join(wrap(line.service.description, 62)))
-
-        if line.note:
-            description = '{}\n{}'.format(
-                    description,
-                    '\n'.join(wrap(line.note, 62)))
-
-        line = (description, line.service.price, line.quantity, line.total)
-        data.append(line)
-
-    data.append((
-        'TVA non applicable art-293B du CGI',
-        '',
-        'Total HT',
-        '{} €'.format(bill.amount)
-        ))
-    data.append(('', '', 'TVA 0%', '0'))
-    data.append(('', '', 'Total TTC', '{} €.'.format(bill.amount)))
-
-    # widths in percent of pdf width
-    colWidths = (width*0.55, width*0.15, width*0.15, width*0.15)
-    style = [
-            ('GRID', (0, 0), (-1, 0), 1, colors.black),
-            ('GRID', (-2, -3), (-1, -1), 1, colors.black),
-            ('BOX', (0, 1), (0, -4), 1, colors.black),
-            ('BOX', (1, 1), (1, -4), 1, colors.black),
-            ('BOX', (2, 1), (2, -4), 1, colors.black),
-            ('BOX', (-1, 1), (-1, -4), 1, colors.black),
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-            ('ALIGN', (-1, 0), (-1, -1), 'RIGHT'),
-            ('FONTNAME', (0, -3), (0, -3), 'Helvetica-Bold'),
-            ]
-    table = Table(data, colWidths=colWidths, style=style)
-    # create table and get width and height
-    t_width, t_height = table.wrap(0, 0)
-    table.drawOn(pdf, 0, nh-t_height)
-
-    p = Paragraph(BILLJOBS_BILL_PAYMENT_INFO, getSampleStyleSheet()['Normal'])
-    p.wrapOn(pdf, width*0.6, 100)
-    p.drawOn(pdf, 0, 3*lh)
-
-    pdf.line(0, 2*lh, width, 2*lh)
-    pdf.setFontSize(8)
-    pdf.drawCentredString(width/2.0, lh, 'Association Loi 1901')
-
-    pdf.showPage()
-    pdf.save()
-    # get pdf from buffer and return it to response
-    genpdf = buffer.getvalue()
-    buffer.close()
-    response.write(genpdf)
+
+def pdf_job_response(job):
+    ''' Job status, with the url to ask for it again until pdf is ready '''
+    data = {
+            'job': job.pk,
+            'status': job.status,
+            'url': reverse('pdf-job', args=(job.pk,)),
+            }
+    if job.status == PdfJob.FAILED:
+        return JsonResponse(data, status=500)
+    return JsonResponse(data, status=202)
+
+
+@login_required
+def pdf_job(request, job_id):
+    ''' Return the pdf when the job is done, its status otherwise
+
+        A job left running by a stopped worker, or done before a change of
+        the bill, is replaced by a new one.
+    '''
+    job = get_object_or_404(PdfJob.objects.select_related('bill'), pk=job_id)
+    if job.status in (PdfJob.PENDING, PdfJob.RUNNING):
+        return pdf_job_response(enqueue_pdf_job(job.bill))
+    if job.status != PdfJob.DONE:
+        return pdf_job_response(job)
+    bill = (Bill.objects
+            .select_related('user')
+            .prefetch_related('billline_set__service')
+            .get(pk=job.bill_id))
+    if job.digest != bill_digest(bill):
+        return pdf_job_response(enqueue_pdf_job(bill))
+    return pdf_response(bill, job.digest, bytes(job.pdf))
+
+
+@staff_member_required
+@permission_required('billjobs.change_bill', raise_exception=True)
+def export_bills_csv(request):
+    ''' Stream bills and their lines as csv for accounting
+
+        Bills are filtered with since and until dates (YYYY-MM-DD), user
+        (username) and unpaid query parameters. Signed up coworkers are
+        staff without permission, only users allowed to change bills export
+        them.
+    '''
+    dates = {}
+    for name in ('since', 'until'):
+        value = request.GET.get(name)
+        if not value:
+            continue
+        try:
+            dates[name] = parse_date(value)
+        except ValueError:
+            dates[name] = None
+        if dates[name] is None:
+            return HttpResponseBadRequest(
+                    'Date must be in YYYY-MM-DD format: %s' % value)
+    queryset = filter_export_bills(
+            Bill.objects.all(),
+            username=request.GET.get('user'),
+            unpaid='unpaid' in request.GET,
+            **dates)
+    response = StreamingHttpResponse(
+            stream_accounting_csv(queryset), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="bills.csv"'
+    return response
+
+
+@staff_member_required
+@permission_required('auth.change_user', raise_exception=True)
+def export_emails_csv(request):
+    ''' Stream emails and names of user accounts as csv
+
+        Only active accounts are exported with the active query parameter,
+        the file is compressed with gzip with the gzip query parameter. Only
+        users allowed to change accounts export them.
+    '''
+    queryset = User.objects.all()
+    if 'active' in request.GET:
+        queryset = queryset.filter(is_active=True)
+    if 'gzip' in request.GET:
+        response = StreamingHttpResponse(
+                stream_email_csv(queryset, compress=True),
+                content_type='application/gzip')
+        filename = 'emails.csv.gz'
+    else:
+        response = StreamingHttpResponse(
+                stream_email_csv(queryset), content_type='text/csv')
+        filename = 'emails.csv'
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
     return response
+
+
+@staff_member_required
+@permission_required('billjobs.change_bill', raise_exception=True)
+def reporting(request):
+    ''' Revenue of a year per month, service and coworker, unpaid bills age
+
+        The year is given by the year query parameter, current year if none.
+        Only users allowed to change bills read it.
+    '''
+    try:
+        year = int(request.GET.get('year', datetime.date.today().year))
+        since = datetime.date(year, 1, 1)
+    except ValueError:
+        return HttpResponseBadRequest('Year must be a number')
+    until = datetime.date(year, 12, 31)
+    return render(request, 'billjobs/reporting.html', {
+        'year': year,
+        'months': revenue_per_month(since, until),
+        'services': revenue_per_service(since, until),
+        'coworkers': revenue_per_coworker(since, until),
+        'aging': unpaid_aging(),
+        })
+
+
+def metrics_view(request):
+    ''' Metrics of this process in Prometheus text format
+
+        Available to superusers and to INTERNAL_IPS addresses, like a
+        Prometheus server, when BILLJOBS_INSTRUMENTATION is True. Signed up
+        coworkers are staff, staff is not enough.
+    '''
+    if not billjobs_settings.INSTRUMENTATION:
+        raise Http404
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS and \
+            not request.user.is_superuser:
+        return HttpResponseForbidden()
+    return HttpResponse(
+            metrics.render(), content_type='text/plain; version=0.0.4')